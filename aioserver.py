@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+GaraServer
+Copyright 2016 Nicola Ferruzzi <nicola.ferruzzi@gmail.com>
+License: GPLv3 (see LICENSE)
+"""
+import asyncio
+import concurrent.futures
+import io
+import json
+import sys
+import threading
+import time
+import urllib.parse
+from gara import Gara
+from logs import log
+from metrics import HTTP_REQUESTS, HTTP_LATENCY
+from webserver import webapp, API_VERSION, EVENTS_TIMEOUT
+
+# threads running the bottle routes, they are the only ones touching the db
+DB_THREADS = 4
+# larger requests are refused
+MAX_BODY = 1024 * 1024
+
+REASONS = {
+    200: 'OK',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    401: 'Unauthorized',
+    403: 'Forbidden',
+    404: 'Not Found',
+    413: 'Request Entity Too Large',
+    500: 'Internal Server Error',
+    501: 'Not Implemented',
+    503: 'Service Unavailable',
+}
+
+
+class HttpError(Exception):
+    """A request that can't be served: answered with `status`, then the
+    connection is closed"""
+
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+class AsyncController:
+    """Same routes of Controller served by an asyncio loop on its own
+    thread. Idle connections and judges waiting on /events only cost a
+    socket, the bottle routes run on a small executor.
+    """
+
+    def __init__(self, options):
+        self.options = options
+        self.loop = None
+        self.server = None
+        self.port = None
+        self.started = threading.Event()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix='db')
+        # set and replaced after every poll of a watched gara, loop thread only
+        self.versionChanged = None
+
+    def listen(self):
+        log.info("listening (asyncio): %s", self.options)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.versionChanged = asyncio.Event()
+        self.server = self.loop.run_until_complete(
+            asyncio.start_server(self.handle, '0.0.0.0', self.options['port'],
+                                 backlog=self.options['queue']))
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.server.close()
+            # the open connections
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.run_until_complete(self.server.wait_closed())
+            self.loop.close()
+
+    def shutdown(self):
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self.executor.shutdown(wait=False)
+        log.info("done listening")
+
+    def notify(self):
+        # state watcher thread
+        try:
+            self.loop.call_soon_threadsafe(self.wake)
+        except RuntimeError:
+            # loop closed, nobody waits anymore
+            pass
+
+    def wake(self):
+        self.versionChanged.set()
+        self.versionChanged = asyncio.Event()
+
+    async def waitVersion(self, states, since):
+        while not states.past(since):
+            await self.versionChanged.wait()
+
+    async def handle(self, reader, writer):
+        timeout = self.options['timeout']
+        try:
+            while True:
+                try:
+                    request = await self.readRequest(reader, writer, timeout)
+                except HttpError as e:
+                    await self.respond(writer, e.status, [], b'', False)
+                    break
+                if request is None:
+                    break
+                method, url, protocol, headers, body = request
+                connection = headers.get('connection', '').lower()
+                if protocol == 'HTTP/1.1':
+                    keepAlive = connection != 'close'
+                else:
+                    keepAlive = connection == 'keep-alive'
+
+                if method == 'GET' and url.path.startswith('/events/'):
+                    start = time.perf_counter()
+                    status, responseHeaders, payload = await self.events(url, headers)
+                    HTTP_REQUESTS.inc('/events/<judge>', method, status)
+                    HTTP_LATENCY.observe(time.perf_counter() - start, '/events/<judge>')
+                else:
+                    environ = self.environ(method, url, protocol, headers, body, writer)
+                    status, responseHeaders, payload = await self.loop.run_in_executor(self.executor, self.wsgi, environ)
+                await self.respond(writer, status, responseHeaders, payload, keepAlive, method == 'HEAD')
+                if not keepAlive:
+                    break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    async def readRequest(self, reader, writer, timeout):
+        """(method, url, protocol, headers, body) of the next request, None
+        once the client is gone or idle for `timeout` seconds. Chunked
+        bodies are not supported."""
+        try:
+            line = await asyncio.wait_for(reader.readline(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if not line:
+            return None
+        parts = line.decode('latin-1').split()
+        if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+            raise HttpError(400)
+        method, target, protocol = parts
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            k, sep, v = line.decode('latin-1').partition(':')
+            if not sep or not k.strip():
+                raise HttpError(400)
+            headers[k.strip().lower()] = v.strip()
+        if headers.get('transfer-encoding', 'identity').lower() != 'identity':
+            raise HttpError(501)
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HttpError(400)
+        if length < 0:
+            raise HttpError(400)
+        if length > MAX_BODY:
+            raise HttpError(413)
+        if length and headers.get('expect', '').lower() == '100-continue':
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            await writer.drain()
+        body = await asyncio.wait_for(reader.readexactly(length), timeout) if length else b''
+        return method, urllib.parse.urlsplit(target), protocol, headers, body
+
+    async def respond(self, writer, status, headers, payload, keepAlive, head=False):
+        lines = ["HTTP/1.1 {} {}".format(status, REASONS.get(status, ''))]
+        names = set()
+        for k, v in headers:
+            names.add(k.lower())
+            lines.append("{}: {}".format(k, v))
+        if 'content-length' not in names and status != 304:
+            lines.append("Content-Length: {}".format(len(payload)))
+        lines.append("Connection: {}".format('keep-alive' if keepAlive else 'close'))
+        # HEAD: the length of the body that is not sent
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + (b'' if head else payload))
+        await writer.drain()
+
+    def environ(self, method, url, protocol, headers, body, writer):
+        peer = writer.get_extra_info('peername') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': urllib.parse.unquote_to_bytes(url.path).decode('latin-1'),
+            'QUERY_STRING': url.query,
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': str(self.port),
+            'SERVER_PROTOCOL': protocol,
+            'REMOTE_ADDR': peer[0],
+            'CONTENT_LENGTH': str(len(body)),
+            'CONTENT_TYPE': headers.get('content-type', ''),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for k, v in headers.items():
+            if k not in ('content-length', 'content-type'):
+                environ['HTTP_' + k.upper().replace('-', '_')] = v
+        return environ
+
+    def wsgi(self, environ):
+        # executor
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split()[0])
+            response['headers'] = headers
+
+        chunks = webapp(environ, start_response)
+        try:
+            payload = b''.join(chunks)
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+        return response['status'], response['headers'], payload
+
+    def register(self, gara, judge, uuid):
+        # executor
+        with gara.pool.connection() as connection:
+            return gara.registerJudgeWithUUID(connection, judge, uuid)
+
+    def state(self, gara):
+        # executor
+        if gara.connection is None:
+            # closed meanwhile
+            return None
+        with gara.pool.connection() as connection:
+            return gara.getState(connection)
+
+    async def events(self, url, headers):
+        """/events/<judge>?since=<cursor> as served by webserver.events"""
+        def reply(status, body):
+            return status, [('Content-Type', 'application/json')], json.dumps(body).encode()
+
+        query = urllib.parse.parse_qs(url.query)
+        try:
+            judge = int(url.path.split('/')[2])
+            since = int(query.get('since', ['-1'])[0])
+        except ValueError:
+            return reply(400, {'error': 'malformed request'})
+        uuid = headers.get('x-user-auth')
+        if uuid is None:
+            return reply(401, {'error': 'no token'})
+        gara = Gara.activeInstance
+        if gara is None:
+            return reply(500, {'error': 'server not configured'})
+        try:
+            code, err = await self.loop.run_in_executor(self.executor, self.register, gara, judge, uuid)
+            if code != 200:
+                return reply(code, err)
+
+            # the gara watcher polls the version and keeps the judge alive
+            states = gara.states
+            states.join(uuid, self.notify)
+            try:
+                await asyncio.wait_for(self.waitVersion(states, since), EVENTS_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                states.leave(uuid, self.notify)
+            version = states.result(since)
+            response = await self.loop.run_in_executor(self.executor, self.state, gara)
+        except TimeoutError:
+            return reply(503, {'error': 'server busy'})
+        if response is None:
+            return reply(500, {'error': 'server not configured'})
+        response['version'] = API_VERSION
+        response['cursor'] = version
+        return reply(200, response)
@@ -15,6 +15,7 @@ VOTE = "http://localhost:8000/vote"
 
 KEEP_ALIVE = "http://192.168.43.147:8000/keepAlive"
 VOTE = "http://192.168.43.147:8000/vote"
+VOTES = "http://192.168.43.147:8000/votes"
 
 class Client:
     def __init__(self, judge):
@@ -32,6 +33,11 @@ class Client:
         self.keepAlive()
         return requests.post(VOTE, headers={'X-User-Auth': self.judge}, json={"judge": self.judge, "trial": trial, "user": user, "vote": vote})    
 
+    def votes(self, votes):
+        # votes: [(trial, user, vote), ..] in a single request
+        payload = [{"trial": trial, "user": user, "vote": vote} for trial, user, vote in votes]
+        return requests.post(VOTES, headers={'X-User-Auth': self.judge}, json={"judge": self.judge, "votes": payload})
+
 def doIt(client):
     for user in range(1, 101):
         try:
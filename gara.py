@@ -5,18 +5,36 @@ GaraServer
 Copyright 2016 Nicola Ferruzzi <nicola.ferruzzi@gmail.com>
 License: GPLv3 (see LICENSE)
 """
-from PyQt5.QtCore import *
 import datetime
+import logging
+import os
+import sys
 import time
 import threading
 import pathlib
+import queue
 import apsw
 import csv
-from rapport import generateRapport
-
-USER_DB_VERSION = 3
-MAX_JUDGES = 6
-MAX_TRIALS = 10
+import collections
+import contextlib
+import types
+import tempfile
+import weakref
+from uuid import uuid4
+from logs import log, audit
+from metrics import VOTES
+
+USER_DB_VERSION = 9
+MAX_JUDGES = 20
+MAX_TRIALS = 30
+# keepAlive trusts the cached state version for this long, changes made by
+# this process are seen at once, those of other processes within a second
+STATE_RECHECK = 1.0
+# judge liveness is written to the db at most this often, registrations
+# within a second, both by the checkpoint thread
+SESSIONS_SAVE_INTERVAL = 10.0
+# a judge not seen for this long is not restored by openDB
+SESSIONS_EXPIRE = 600.0
 
 Average_Aritmetica = 0
 Average_Mediata = 1
@@ -25,22 +43,96 @@ State_Configure = 0
 State_Running = 1
 State_Completed = 2
 
+Durability_Safe = 0
+Durability_Balanced = 1
+Durability_Fast = 2
+
+# journal mode and synchronous level of every connection, WAL checkpoints
+# are run by CheckpointScheduler when the judges are quiet
+DURABILITY_PROFILES = {
+    Durability_Safe: ('wal', 'FULL'),
+    Durability_Balanced: ('wal', 'NORMAL'),
+    Durability_Fast: ('wal', 'OFF'),
+}
+# WAL pages before SQLite checkpoints by itself (10 times its default): a
+# backstop for the writes that do not touch the CheckpointScheduler
+WAL_AUTOCHECKPOINT = 10000
+
+
+# per trial counters of users with at least a vote (received) and with the
+# votes of every judge (done), kept in sync with users.status by triggers
+PROGRESS_SCHEMA = """CREATE TABLE progress (
+trial INTEGER NOT NULL,
+received INTEGER NOT NULL DEFAULT 0,
+done INTEGER NOT NULL DEFAULT 0,
+PRIMARY KEY (trial)
+);
+CREATE INDEX users_trial_status ON users (trial, status);
+CREATE TRIGGER progress_insert AFTER INSERT ON users BEGIN
+INSERT OR IGNORE INTO progress (trial) VALUES (NEW.trial);
+UPDATE progress SET received=received+(coalesce(NEW.status, 0)>0), done=done+(coalesce(NEW.status, 0)=2) WHERE trial=NEW.trial;
+END;
+CREATE TRIGGER progress_update AFTER UPDATE OF status, trial ON users
+WHEN OLD.status IS NOT NEW.status OR OLD.trial IS NOT NEW.trial BEGIN
+UPDATE progress SET received=received-(coalesce(OLD.status, 0)>0), done=done-(coalesce(OLD.status, 0)=2) WHERE trial=OLD.trial;
+INSERT OR IGNORE INTO progress (trial) VALUES (NEW.trial);
+UPDATE progress SET received=received+(coalesce(NEW.status, 0)>0), done=done+(coalesce(NEW.status, 0)=2) WHERE trial=NEW.trial;
+END;
+CREATE TRIGGER progress_delete AFTER DELETE ON users BEGIN
+UPDATE progress SET received=received-(coalesce(OLD.status, 0)>0), done=done-(coalesce(OLD.status, 0)=2) WHERE trial=OLD.trial;
+END;
+"""
+
+Status_Empty = 0
+Status_Incomplete = 1
+Status_Done = 2
 
-def createTableV2(connection):
-    cmd = """CREATE TABLE users (
-id INTEGER NOT NULL,
+# one row per judge vote, users keeps a row per (user, trial) with the
+# scores computed from them
+VOTES_SCHEMA = """CREATE TABLE users (
 user INTEGER NOT NULL,
-trial INTEGER,
-vote1 FLOAT,
-vote2 FLOAT,
-vote3 FLOAT,
-vote4 FLOAT,
-vote5 FLOAT,
-vote6 FLOAT,
-extra INTEGER,
-PRIMARY KEY (id)
+trial INTEGER NOT NULL,
+score FLOAT,
+score_bonus FLOAT,
+partials INTEGER,
+average FLOAT,
+average_bonus FLOAT,
+status INTEGER,
+PRIMARY KEY (user, trial)
+) WITHOUT ROWID;
+CREATE TABLE votes (
+trial INTEGER NOT NULL,
+user INTEGER NOT NULL,
+judge INTEGER NOT NULL,
+vote FLOAT NOT NULL,
+PRIMARY KEY (trial, user, judge)
+) WITHOUT ROWID;
+CREATE INDEX votes_user ON votes (user, trial, judge, vote);
+CREATE TABLE athletes (
+user INTEGER NOT NULL,
+nickname VARCHAR(250),
+PRIMARY KEY (user)
+);
+CREATE TABLE credits (
+user INTEGER NOT NULL,
+trial INTEGER NOT NULL,
+credit FLOAT,
+PRIMARY KEY (user, trial)
+) WITHOUT ROWID;
+"""
+
+# the judges registered with their token, reloaded by openDB
+SESSIONS_SCHEMA = """CREATE TABLE judges (
+judge INTEGER NOT NULL,
+uuid VARCHAR(250) NOT NULL,
+seen FLOAT NOT NULL,
+PRIMARY KEY (judge)
 );
-CREATE TABLE config (
+"""
+
+
+def createTableV2(connection):
+    cmd = VOTES_SCHEMA + SESSIONS_SCHEMA + """CREATE TABLE config (
 id INTEGER NOT NULL,
 description VARCHAR(250),
 date DATE,
@@ -52,91 +144,160 @@ date DATE,
 "state" INTEGER,
 "uuid" VARCHAR(250),
 "maxVote" FLOAT,
+"durability" INTEGER,
 PRIMARY KEY (id)
 );
-CREATE TABLE credits (
-user INTEGER NOT NULL,
-trial1 FLOAT,
-trial2 FLOAT,
-trial3 FLOAT,
-trial4 FLOAT,
-trial5 FLOAT,
-trial6 FLOAT,
-trial7 FLOAT,
-trial8 FLOAT,
-trial9 FLOAT,
-trial10 FLOAT,
-nickname VARCHAR(250),
-PRIMARY KEY (user)
-);
 PRAGMA user_version={};
 """.format(USER_DB_VERSION)
-    connection.cursor().execute(cmd)
+    connection.cursor().execute(cmd + PROGRESS_SCHEMA)
 
 def version_from_2_to_3(connection):
     cmd = """ALTER TABLE config ADD COLUMN "maxVote" FLOAT DEFAULT 100.0;
-PRAGMA user_version={};
-""".format(USER_DB_VERSION)
+PRAGMA user_version=3;
+"""
     connection.cursor().execute(cmd)
 
-def getUserInfo(connection, user):
-    query = 'select * from credits where user=?'
-    for v in connection.cursor().execute(query, (user,)):
-        vals = v[1:11]
-        vals = list(map(lambda x: 0.0 if x is None else x, vals))
-        return {
-            'nickname': v[11],
-            'credits': vals
-        }
+
+def version_from_3_to_4(connection):
+    # v3 had no key on (user, trial), merge any duplicated row into the
+    # oldest one before creating the unique index
+    with connection:
+        cursor = connection.cursor()
+        query = 'select user, trial, min(id) from users group by user, trial having count(*) > 1'
+        for user, trial, keep in list(cursor.execute(query)):
+            for j in range(1, 7):
+                vf = '"vote{}"'.format(j)
+                query = 'update users set {0}=(select {0} from users where user=? and trial=? and {0} is not null order by id limit 1) where id=? and {0} is null'.format(vf)
+                cursor.execute(query, (user, trial, keep))
+            cursor.execute('delete from users where user=? and trial=? and id<>?', (user, trial, keep))
+        cmd = """CREATE UNIQUE INDEX users_user_trial ON users (user, trial);
+PRAGMA user_version=4;
+"""
+        cursor.execute(cmd)
+
+
+def version_from_4_to_5(connection):
+    cmd = """ALTER TABLE config ADD COLUMN "durability" INTEGER DEFAULT {};
+PRAGMA user_version=5;
+""".format(Durability_Safe)
+    connection.cursor().execute(cmd)
+
+
+def version_from_5_to_6(connection):
+    cmd = """ALTER TABLE users ADD COLUMN score FLOAT;
+ALTER TABLE users ADD COLUMN score_bonus FLOAT;
+ALTER TABLE users ADD COLUMN partials INTEGER;
+ALTER TABLE users ADD COLUMN average FLOAT;
+ALTER TABLE users ADD COLUMN average_bonus FLOAT;
+PRAGMA user_version=6;
+"""
+    connection.cursor().execute(cmd)
+
+
+def version_from_6_to_7(connection):
+    cmd = """ALTER TABLE users ADD COLUMN status INTEGER;
+PRAGMA user_version=7;
+"""
+    with connection:
+        connection.cursor().execute(cmd + PROGRESS_SCHEMA)
+
+
+def version_from_7_to_8(connection):
+    # vote1..vote6 and trial1..trial10 columns move to the votes, athletes
+    # and credits tables
+    cmd = """DROP TRIGGER progress_insert;
+DROP TRIGGER progress_update;
+DROP TRIGGER progress_delete;
+DROP INDEX users_trial_status;
+DROP INDEX users_user_trial;
+DROP TABLE progress;
+ALTER TABLE users RENAME TO users_v7;
+ALTER TABLE credits RENAME TO credits_v7;
+"""
+    cmd += VOTES_SCHEMA + PROGRESS_SCHEMA
+    for j in range(1, 7):
+        cmd += "INSERT INTO votes (trial, user, judge, vote) SELECT trial, user, {0}, vote{0} FROM users_v7 WHERE vote{0} IS NOT NULL;\n".format(j)
+    for t in range(1, 11):
+        cmd += "INSERT INTO credits (user, trial, credit) SELECT user, {0}, trial{1} FROM credits_v7 WHERE trial{1} IS NOT NULL;\n".format(t-1, t)
+    cmd += """INSERT INTO users (user, trial) SELECT user, trial FROM users_v7;
+INSERT INTO athletes (user, nickname) SELECT user, nickname FROM credits_v7 WHERE nickname IS NOT NULL;
+DROP TABLE users_v7;
+DROP TABLE credits_v7;
+PRAGMA user_version=8;
+"""
+    with connection:
+        connection.cursor().execute(cmd)
+
+
+def version_from_8_to_9(connection):
+    cmd = SESSIONS_SCHEMA + "PRAGMA user_version=9;\n"
+    with connection:
+        connection.cursor().execute(cmd)
+
+
+def getJudgeSessions(connection):
+    """{judge: (uuid, seen)}"""
+    query = 'select judge, uuid, seen from judges'
+    return {judge: (uuid, seen) for judge, uuid, seen in connection.cursor().execute(query)}
+
+
+def saveJudgeSessions(connection, sessions, removed=()):
+    """Upsert {judge: (uuid, seen)} and delete the `removed` judges"""
+    with connection:
+        cursor = connection.cursor()
+        query = 'insert into judges (judge, uuid, seen) values(?,?,?) ' \
+                'on conflict(judge) do update set uuid=excluded.uuid, seen=excluded.seen'
+        cursor.executemany(query, [(judge, uuid, seen) for judge, (uuid, seen) in sessions.items()])
+        cursor.executemany('delete from judges where judge=?', [(judge,) for judge in removed])
+
+
+def emptyUserInfo():
     return {
         'nickname': '',
-        'credits': [0.0, ]*10
+        'credits': [0.0, ]*MAX_TRIALS
     }
 
 
-def updateUserInfo(connection, user, payload):
+def getUserInfo(connection, user):
+    info = emptyUserInfo()
+    cursor = connection.cursor()
+    for nickname, in cursor.execute('select nickname from athletes where user=?', (user,)):
+        info['nickname'] = nickname
+    query = 'select trial, credit from credits where user=? and trial<?'
+    for trial, credit in cursor.execute(query, (user, MAX_TRIALS)):
+        info['credits'][trial] = 0.0 if credit is None else credit
+    return info
+
+
+def getAllUserInfo(connection):
+    res = {}
+    cursor = connection.cursor()
+    for user, nickname in cursor.execute('select user, nickname from athletes'):
+        res.setdefault(user, emptyUserInfo())['nickname'] = nickname
+    query = 'select user, trial, credit from credits where trial<?'
+    for user, trial, credit in cursor.execute(query, (MAX_TRIALS,)):
+        res.setdefault(user, emptyUserInfo())['credits'][trial] = 0.0 if credit is None else credit
+    return res
+
+
+def updateUserInfo(connection, user, payload, conf=None):
     with connection:
-        cols = []
-        vals = []
-        ques = []
-        vks = []
+        cursor = connection.cursor()
         n = payload.get(-1)
         if n is not None:
-            cols.append('nickname')
-            vals.append(n)
-            ques.append('?')
-            vks.append('nickname=?')
+            query = 'insert into athletes (user, nickname) values (?, ?) on conflict (user) do update set nickname=excluded.nickname'
+            cursor.execute(query, (user, n))
+        vals = []
         for i in range(0, MAX_TRIALS):
             c = payload.get(i)
             if c is not None:
-                e = 'trial{}'.format(i+1)
-                cols.append(e)
-                vals.append(c)
-                ques.append('?')
-                vks.append('{}=?'.format(e))
+                vals.append((user, i, c))
+        if vals:
+            query = 'insert into credits (user, trial, credit) values (?, ?, ?) on conflict (user, trial) do update set credit=excluded.credit'
+            cursor.executemany(query, vals)
 
-        query = 'select * from credits where user=?'
-        cursor = connection.cursor()
-        update = False
-        for values in cursor.execute(query, (user,)):
-            update = True
-            break
-
-        if update:
-            vk = ", ".join(vks)
-            query = 'update credits set {} where user=?'.format(vk)
-            vals.append(user)
-            # print("Update credits: ", query, vals)
-            cursor.execute(query, vals)
-        else:
-            cols.append('user')
-            vals.append(user)
-            ques.append('?')
-            cn = ", ".join(cols)
-            vn = ", ".join(ques)
-            query = 'insert into credits ({}) values ({})'.format(cn, vn)
-            cursor.execute(query, vals)
-            # print("New credits:", query, vals)
+        if set(payload) - {-1}:
+            refreshUserScores(connection, user, conf)
 
 
 def checkDBVersion(connection):
@@ -158,11 +319,26 @@ def dateFromSQLite(column):
 
 
 def setConfig(connection,
-              description, date, nJudges, nUsers, nTrials, average, state, uuid, maxVote):
+              description, date, nJudges, nUsers, nTrials, average, state, uuid, maxVote,
+              durability=Durability_Balanced):
     assert isinstance(date, datetime.date)
     # we want just one conf
-    vals = (1, description, dateToSQLite(date), nJudges, nUsers, nTrials, 0, average, state, uuid, maxVote)
-    connection.cursor().execute('insert into config (id, description, date, "nJudges", "nUsers", "nTrials", "currentTrial", average, state, uuid, maxVote) values(?,?,?,?,?,?,?,?,?,?,?)', vals)
+    vals = (1, description, dateToSQLite(date), nJudges, nUsers, nTrials, 0, average, state, uuid, maxVote, durability)
+    connection.cursor().execute('insert into config (id, description, date, "nJudges", "nUsers", "nTrials", "currentTrial", average, state, uuid, maxVote, durability) values(?,?,?,?,?,?,?,?,?,?,?,?)', vals)
+
+
+def setDurability(connection, durability):
+    query = 'update config set "durability"=? where id=1'
+    connection.cursor().execute(query, (durability,))
+
+
+def applyDurability(connection, durability):
+    journal, synchronous = DURABILITY_PROFILES[durability]
+    cursor = connection.cursor()
+    for mode, in cursor.execute('PRAGMA journal_mode={}'.format(journal)):
+        pass
+    # checkpoints are left to CheckpointScheduler
+    cursor.execute('PRAGMA synchronous={}; PRAGMA wal_autocheckpoint={};'.format(synchronous, WAL_AUTOCHECKPOINT))
 
 
 def advanceToNextTrial(connection):
@@ -204,62 +380,347 @@ def getConfig(connection):
             'state': v[8],
             'uuid': v[9],
             'maxVote': v[10],
+            'durability': v[11],
         }
     return None
 
 
-def addVote(connection, trial, user, judge, vote):
-    assert judge > 0, "judge starts from 1"
-    query = 'select * from users where user=? and trial=?'
-    trovato = None
-    vf = 'vote{}'.format(judge)
-    for v in connection.cursor().execute(query, (user, trial)):
-        trovato = v
-    if not trovato:
-        print("Insert vote")
-        query = 'insert into users (trial, user, {}) values(?, ?, ?)'.format(vf)
-        connection.cursor().execute(query, (trial, user, vote))
-    else:
-        # update
-        print("Update vote")
-        current = v[2+judge]
-        if current is not None:
-            print("Duplicated vote for user {} judge {}".format(user, judge))
-            return False
-        query = 'update users set "{}"=? where id=?'.format(vf)
-        connection.cursor().execute(query, (vote, v[0]))
-    return True
+def addVote(connection, trial, user, judge, vote, conf=None):
+    return addVotes(connection, [(trial, user, judge, vote)], conf)[0]
 
 
-def getUser(connection, user):
+def addVotes(connection, votes, conf=None):
+    """Store (trial, user, judge, vote) tuples in a single transaction, a
+    vote is stored only if the judge did not vote the same trial and user
+    already. Returns True/False for each vote.
+    """
+    cursor = connection.cursor()
+    res = []
+    users = []
+    with connection:
+        for trial, user, judge, vote in votes:
+            assert 0 < judge <= MAX_JUDGES, "judge starts from 1"
+            query = 'insert or ignore into votes (trial, user, judge, vote) values (?, ?, ?, ?)'
+            cursor.execute(query, (trial, user, judge, vote))
+            if connection.changes() == 0:
+                log.debug("duplicated vote for user %s judge %s", user, judge)
+                res.append(False)
+                continue
+            query = 'insert or ignore into users (user, trial) values (?, ?)'
+            cursor.execute(query, (user, trial))
+            res.append(True)
+            if user not in users:
+                users.append(user)
+        for user in users:
+            refreshUserScores(connection, user, conf)
+    return res
+
+
+def groupVotes(nj, records):
+    """(user, trial, judge, vote) records ordered by user and trial to
+    user -> [[trial, vote of judge 1, .., vote of judge nj], ..]
+    """
+    res = {}
+    last = None
+    for user, trial, judge, vote in records:
+        if (user, trial) != last:
+            last = (user, trial)
+            row = [trial] + [None]*nj
+            res.setdefault(user, []).append(row)
+        if judge is not None and judge <= nj:
+            row[judge] = vote
+    return res
+
+
+VOTES_QUERY = 'select u.user, u.trial, v.judge, v.vote from users u left join votes v on v.user=u.user and v.trial=u.trial'
+
+
+def storeScores(connection, user, response, trials):
+    query = 'update users set score=?, score_bonus=?, partials=?, average=?, average_bonus=?, status=? where user=? and trial=?'
+    vals = []
+    for t in trials:
+        v = response['trials'][t]
+        votes = v['votes'].values()
+        if None not in votes:
+            status = Status_Done
+        elif set(votes) != set([None]):
+            status = Status_Incomplete
+        else:
+            status = Status_Empty
+        vals.append((v['score'], v['score_bonus'], v['partials'], v.get('average'), v['average_bonus'], status, user, t))
+    connection.cursor().executemany(query, vals)
+
+
+def refreshUserScores(connection, user, conf=None):
+    """Recompute the stored scores of an user after its votes or credits
+    changed, progressive averages make every trial depend on the previous.
+    """
+    if conf is None:
+        conf = getConfig(connection)
+    query = VOTES_QUERY + ' where u.user=? and u.trial<? order by u.trial'
+    records = connection.cursor().execute(query, (user, conf['nTrials']))
+    rows = groupVotes(conf['nJudges'], records).get(user, [])
+    credits = getUserInfo(connection, user)
+    response = scoreUser(conf, credits, rows)
+    storeScores(connection, user, response, [r[0] for r in rows])
+
+
+def rebuildScores(connection):
     conf = getConfig(connection)
+    query = VOTES_QUERY + ' where u.trial<? order by u.user, u.trial'
+    votes = groupVotes(conf['nJudges'], connection.cursor().execute(query, (conf['nTrials'],)))
+    credits = getAllUserInfo(connection)
+    with connection:
+        for user, response in scoreCompetition(conf, credits, votes, votes).items():
+            storeScores(connection, user, response, [r[0] for r in votes[user]])
+
+
+SCORES_QUERY = 'select u.user, u.trial, v.judge, v.vote, u.score, u.score_bonus, u.partials, u.average, u.average_bonus from users u left join votes v on v.user=u.user and v.trial=u.trial'
+
+
+def groupScores(nj, records):
+    """SCORES_QUERY records ordered by user and trial to
+    user -> [(trial, votes, (score, score_bonus, partials, average, average_bonus)), ..]
+    """
+    res = {}
+    last = None
+    for vals in records:
+        user, trial, judge, vote = vals[0:4]
+        if (user, trial) != last:
+            last = (user, trial)
+            votes = dict.fromkeys(range(1, nj+1))
+            res.setdefault(user, []).append((trial, votes, vals[4:9]))
+        if judge is not None and judge <= nj:
+            votes[judge] = vote
+    return res
+
+
+def getUser(connection, user, conf=None):
+    if conf is None:
+        conf = getConfig(connection)
+    query = SCORES_QUERY + ' where u.user=? and u.trial<? order by u.trial'
+    records = connection.cursor().execute(query, (user, conf['nTrials']))
+    return userFromScores(conf, groupScores(conf['nJudges'], records).get(user, ()))
+
+
+def getAllUsers(connection, users=None, conf=None):
+    """Same as getUser for many users (default: 0..nUsers and whoever got a
+    vote) with a single query.
+    """
+    if conf is None:
+        conf = getConfig(connection)
+    query = SCORES_QUERY + ' where u.trial<? order by u.user, u.trial'
+    records = connection.cursor().execute(query, (conf['nTrials'],))
+    rows = groupScores(conf['nJudges'], records)
+    if users is None:
+        users = sorted(set(range(0, conf['nUsers']+1)) | set(rows))
+    res = {}
+    for user in users:
+        res[user] = userFromScores(conf, rows.get(user, ()))
+    return res
+
+
+def userFromScores(conf, rows):
+    """Build the getUser response from the stored scores"""
     nj = conf['nJudges']
     nt = conf['nTrials']
-    average = conf['average']
-    query = 'select trial, vote1, vote2, vote3, vote4, vote5, vote6 from users where user=? and trial<?'
     response = {}
     trials = {}
+    for t, votes, scores in rows:
+        score, score_bonus, partials, average, average_bonus = scores
+        trial = {
+            'votes': votes,
+            'score': score,
+            'score_bonus': score_bonus,
+            'average_bonus': average_bonus,
+            'partials': bool(partials),
+        }
+        if average is not None:
+            trial['average'] = average
+        trials[t] = trial
+    if len(trials) == nt:
+        finals = list(map(lambda x: x['score'], trials.values()))
+        if None not in finals:
+            # the progressive averages of the last trial are the results
+            results = {}
+            results['average'] = trials[nt-1]['average']
+            results['average_bonus'] = trials[nt-1]['average_bonus']
+            results['sum'] = sum(map(lambda x: x['score_bonus'], trials.values()))
+            response['results'] = results
+    else:
+        fillMissingTrials(trials, nt, nj)
+    response['trials'] = trials
+    return response
+
+
+def fillMissingTrials(trials, nt, nj):
+    for k in range(0, nt):
+        if trials.get(k) == None:
+            votes = {}
+            for i in range(0, nj):
+                votes[i+1] = None
+            trials[k] = {}
+            trials[k]['votes'] = votes
+            trials[k]['score'] = None
+            trials[k]['score_bonus'] = None
+            trials[k]['average'] = None
+            trials[k]['average_bonus'] = None
+
+
+def loadNumpy():
+    """numpy, imported on first use (it is only needed to score the whole
+    competition), None when not installed"""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def scoreCompetition(conf, credits, votes, users):
+    """Score users from already fetched data.
+
+    credits: user -> getUserInfo, votes: user -> (trial, vote of judge 1,
+    .., vote of judge nJudges) rows ordered by trial.
+    """
+    if loadNumpy() is not None and not (conf['average'] == Average_Mediata and conf['nJudges'] < 3):
+        return scoreCompetitionNumpy(conf, credits, votes, users)
+    default = emptyUserInfo()
+    res = {}
+    for user in users:
+        res[user] = scoreUser(conf, credits.get(user, default), votes.get(user, ()))
+    return res
 
-    # get credits, they are used one by one or all together
-    credits = getUserInfo(connection, user)
-    sum_credits = sum(credits['credits'])
 
-    for vals in connection.cursor().execute(query, (user, nt)):
+def scoreCompetitionNumpy(conf, credits, votes, users):
+    """Vectorized scoreCompetition, values are identical to scoreUser.
+
+    Sums are accumulated judge by judge and trial by trial, the same order
+    used by the python builtins, so results match to the last bit.
+    """
+    import numpy
+    nj = conf['nJudges']
+    nt = conf['nTrials']
+    users = list(users)
+    nu = len(users)
+    default = emptyUserInfo()
+
+    # users x trials x judges, nan for a missing vote
+    v = numpy.full((nu, nt, nj), numpy.nan)
+    present = numpy.zeros((nu, nt), dtype=bool)
+    bonus = numpy.zeros((nu, nt))
+    for u, user in enumerate(users):
+        for row in votes.get(user, ()):
+            t = row[0]
+            present[u, t] = True
+            v[u, t] = [numpy.nan if x is None else x for x in row[1:nj+1]]
+        bonus[u] = credits.get(user, default)['credits'][:nt]
+
+    mask = ~numpy.isnan(v)
+    n = mask.sum(axis=2)
+    total = numpy.zeros((nu, nt))
+    for j in range(0, nj):
+        total = numpy.where(mask[:, :, j], total + v[:, :, j], total)
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        if conf['average'] == Average_Aritmetica:
+            valid = n > 0
+            score = total / n
+        else:
+            valid = n > 2
+            vmin = numpy.where(mask, v, numpy.inf).min(axis=2)
+            vmax = numpy.where(mask, v, -numpy.inf).max(axis=2)
+            score = (total - vmin - vmax) / (n - 2)
+        valid &= present
+        partials = present & (n > 0) & (n < nj)
+        score_bonus = score + bonus
+
+        def progressive(values):
+            out = numpy.full((nu, nt), numpy.nan)
+            reached = numpy.ones(nu, dtype=bool)
+            acc = numpy.zeros(nu)
+            for t in range(0, nt):
+                reached &= valid[:, t]
+                acc = numpy.where(reached, acc + values[:, t], acc)
+                out[:, t] = acc / (t+1)
+            return out, reached
+
+        average, complete = progressive(score)
+        average_bonus, _ = progressive(score_bonus)
+        total_bonus = numpy.zeros(nu)
+        for t in range(0, nt):
+            total_bonus = total_bonus + score_bonus[:, t]
+    complete &= present.all(axis=1)
+
+    # back to python values, None marks a missing vote
+    v = numpy.where(mask, v, None).tolist()
+    present = present.tolist()
+    valid = valid.tolist()
+    partials = partials.tolist()
+    complete = complete.tolist()
+    score = score.tolist()
+    score_bonus = score_bonus.tolist()
+    average = average.tolist()
+    average_bonus = average_bonus.tolist()
+    res = {}
+    for u, user in enumerate(users):
+        trials = {}
+        dummies = []
+        reached = True
+        for t in range(0, nt):
+            if not present[u][t]:
+                reached = False
+                votes_t = {}
+                for i in range(0, nj):
+                    votes_t[i+1] = None
+                dummies.append((t, {
+                    'votes': votes_t,
+                    'score': None,
+                    'score_bonus': None,
+                    'average': None,
+                    'average_bonus': None,
+                }))
+                continue
+            trial = {
+                'votes': dict(zip(range(1, nj+1), v[u][t])),
+                'score': None,
+                'score_bonus': None,
+                'average_bonus': None,
+                'partials': partials[u][t],
+            }
+            if valid[u][t]:
+                trial['score'] = score[u][t]
+                trial['score_bonus'] = score_bonus[u][t]
+                if reached:
+                    trial['average'] = average[u][t]
+                    trial['average_bonus'] = average_bonus[u][t]
+            reached = reached and valid[u][t]
+            trials[t] = trial
+        for t, trial in dummies:
+            trials[t] = trial
+        response = {}
+        if complete[u]:
+            response['results'] = {
+                'average': average[u][nt-1],
+                'average_bonus': average_bonus[u][nt-1],
+                'sum': float(total_bonus[u]),
+            }
+        response['trials'] = trials
+        res[user] = response
+    return res
+
+
+def scoreUser(conf, credits, rows):
+    nj = conf['nJudges']
+    nt = conf['nTrials']
+    average = conf['average']
+    response = {}
+    trials = {}
+
+    for vals in rows:
         t = vals[0]
         # judge votes are stored from 1:..
-        vt = vals[1:]
-        votes = {
-            1: vt[0],
-            2: vt[1],
-            3: vt[2],
-            4: vt[3],
-            5: vt[4],
-            6: vt[5],
-        }
-
-        # we remove votes not needed so we can test for None properly
-        for i in range(nj+1, MAX_JUDGES+1):
-            del votes[i]
+        votes = dict(zip(range(1, nj+1), vals[1:nj+1]))
 
         trials[t] = {}
         trials[t]['votes'] = votes
@@ -313,17 +774,7 @@ def getUser(connection, user):
             response['results'] = results
     else:
         # fill with dummy data
-        for k in range(0, conf['nTrials']):
-            if trials.get(k) == None:
-                votes = {}
-                for i in range(0, MAX_JUDGES):
-                    votes[i+1] = None
-                trials[k] = {}
-                trials[k]['votes'] = votes
-                trials[k]['score'] = None
-                trials[k]['score_bonus'] = None
-                trials[k]['average'] = None
-                trials[k]['average_bonus'] = None
+        fillMissingTrials(trials, nt, nj)
 
     # we need them ordered to create progessive averages
     def calcProgressive(key, store):
@@ -343,60 +794,57 @@ def getUser(connection, user):
     return response
 
 
-def deleteTrialForUser(connection, trial, user):
-    query = 'delete from users where "user"=? AND "trial"=?'
-    connection.cursor().execute(query, (user, trial))
+def deleteTrialForUser(connection, trial, user, conf=None):
+    cursor = connection.cursor()
+    with connection:
+        cursor.execute('delete from votes where trial=? and user=?', (trial, user))
+        cursor.execute('delete from users where user=? and trial=?', (user, trial))
+        refreshUserScores(connection, user, conf)
 
 
-def deleteTrialVotesForUser(connection, trial, user, judges):
-    j = []
-    for x in range(1, MAX_JUDGES+1):
-        if x in judges:
-            j.append('"vote{}"=null'.format(x))
-    j = ", ".join(j)
-    query = 'update users set {} where "user"=? AND "trial"=?'.format(j)
-    connection.cursor().execute(query, (user, trial))
+def deleteTrialVotesForUser(connection, trial, user, judges, conf=None):
+    query = 'delete from votes where trial=? and user=? and judge=?'
+    with connection:
+        connection.cursor().executemany(query, [(trial, user, j) for j in sorted(judges)])
+        refreshUserScores(connection, user, conf)
+
+
+def getTrialProgress(connection, trial):
+    """Users of a trial with all the votes (done), with at least a vote
+    (received) and the list of the ones still waiting for some judge.
+    """
+    query = 'select p.received, p.done, u.user from progress p left join users u on u.trial=p.trial and u.status=? where p.trial=? order by u.user'
+    progress = {
+        'done': 0,
+        'received': 0,
+        'incomplete': 0,
+        'incompleteUsers': [],
+    }
+    for received, done, user in connection.cursor().execute(query, (Status_Incomplete, trial)):
+        progress['received'] = received
+        progress['done'] = done
+        if user is not None:
+            progress['incompleteUsers'].append(user)
+    progress['incomplete'] = len(progress['incompleteUsers'])
+    return progress
 
 
 def countDone(connection, trial):
-    configuration = getConfig(connection)
-    query = 'select count(*) from users where "trial"=? AND'
-    mv = []
-    for i in range(1, configuration['nJudges']+1):
-        mv.append('"vote{}" is not NULL'.format(i))
-    query += ' AND '.join(mv)
-    query += ';'
+    query = 'select done from progress where trial=?'
     for v in connection.cursor().execute(query, (trial,)):
         return v[0]
     return 0
 
 
 def countReceived(connection, trial):
-    configuration = getConfig(connection)
-    query = 'select count(*) from users where "trial"=? AND ('
-    mv = []
-    for i in range(1, configuration['nJudges']+1):
-        mv.append('"vote{}" is not NULL'.format(i))
-    query += ' OR '.join(mv)
-    query += ');'
+    query = 'select received from progress where trial=?'
     for v in connection.cursor().execute(query, (trial,)):
         return v[0]
     return 0
 
 
 def countIncomplete(connection, trial):
-    configuration = getConfig(connection)
-    mv = []
-    query = 'select user, vote1, vote2, vote3, vote4, vote5, vote6 from users where "trial"=? AND ('
-    for i in range(1, configuration['nJudges']+1):
-        mv.append('"vote{}" is NULL'.format(i))
-    query += ' OR '.join(mv)
-    query += ');'
-    res = []
-    for v in connection.cursor().execute(query, (trial,)):
-        if set(v[1:]) != set([None]):
-            res.append(v[0])
-    return res
+    return getTrialProgress(connection, trial)['incompleteUsers']
 
 
 def getAllUsersWithAVote(connection):
@@ -407,23 +855,737 @@ def getAllUsersWithAVote(connection):
     return res
 
 
-class TimeoutLock:
-    lock = threading.RLock()
+# histogram of the statement times, None until observeQueries
+queryTimes = None
+_profiled = weakref.WeakSet()
+_profiledMutex = threading.Lock()
+
 
-    def __enter__(self):
-        # print(threading.currentThread().getName())
-        return TimeoutLock.lock.acquire(timeout = 20.0)
+def profileQuery(statement, nanoseconds):
+    times = queryTimes
+    if times is not None:
+        times.observe(nanoseconds / 1e9)
+
+
+def observeQueries(histogram):
+    """Time the SQLite statements in `histogram`, None to stop. Each
+    connection follows the next time profileConnection is called on it."""
+    global queryTimes
+    queryTimes = histogram
+
+
+def profileConnection(connection):
+    """Attach or detach profileQuery, from the thread using `connection`:
+    unobserved connections have no per statement callback."""
+    if queryTimes is None and not _profiled:
+        return
+    wanted = queryTimes is not None
+    if wanted != (connection in _profiled):
+        connection.set_profile(profileQuery if wanted else None)
+        with _profiledMutex:
+            if wanted:
+                _profiled.add(connection)
+            else:
+                _profiled.discard(connection)
+
+
+class LockTimeout(TimeoutError):
+    """The gara lock was not acquired in time"""
+
+
+class LockStats:
+    """Wait and hold times of a ReadWriteLock for every call site, a call
+    site is (mode, file:line function) of the `with lock.read/write`.
+    """
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._held = threading.local()
+        self.sites = {}
+
+    def _site(self, site):
+        v = self.sites.get(site)
+        if v is None:
+            v = self.sites[site] = {
+                'count': 0,
+                'wait': 0.0,
+                'waitMax': 0.0,
+                'hold': 0.0,
+                'holdMax': 0.0,
+                'depthMax': 0,
+                'timeouts': 0,
+            }
+        return v
+
+    def acquired(self, site, wait, depth):
+        with self._mutex:
+            v = self._site(site)
+            v['count'] += 1
+            v['wait'] += wait
+            v['waitMax'] = max(v['waitMax'], wait)
+            v['depthMax'] = max(v['depthMax'], depth)
+        held = self._held.__dict__.setdefault('stack', [])
+        held.append((site, time.perf_counter()))
+
+    def released(self):
+        held = self._held.__dict__.get('stack')
+        if not held:
+            # stats enabled while the lock was held
+            return
+        site, start = held.pop()
+        hold = time.perf_counter() - start
+        with self._mutex:
+            v = self._site(site)
+            v['hold'] += hold
+            v['holdMax'] = max(v['holdMax'], hold)
+
+    def timedOut(self, site, wait):
+        with self._mutex:
+            v = self._site(site)
+            v['timeouts'] += 1
+            v['wait'] += wait
+            v['waitMax'] = max(v['waitMax'], wait)
+
+    def statistics(self):
+        with self._mutex:
+            return {k: dict(v) for k, v in self.sites.items()}
+
+    def dump(self):
+        lines = ["{:<5} {:<40} {:>7} {:>9} {:>9} {:>9} {:>9} {:>5} {:>8}".format(
+            'mode', 'site', 'count', 'wait', 'wait max', 'hold', 'hold max', 'depth', 'timeouts')]
+        stats = self.statistics()
+        for (mode, site), v in sorted(stats.items(), key=lambda x: -x[1]['wait']):
+            lines.append("{:<5} {:<40} {:>7} {:>9.4f} {:>9.4f} {:>9.4f} {:>9.4f} {:>5} {:>8}".format(
+                mode, site, v['count'], v['wait'], v['waitMax'], v['hold'], v['holdMax'],
+                v['depthMax'], v['timeouts']))
+        return "\n".join(lines)
+
+
+class ReadWriteLock:
+    """Reentrant reader-writer lock: many readers or a single writer.
+
+    The writer can take the lock again for reading or writing. A reader
+    taking it for writing waits for the other readers to leave, two readers
+    doing so at once both time out. Waiting writers stop new readers so
+    votes are not starved by polling judges.
+
+        with lock.read:
+            ...
+        with lock.write:
+            ...
+    """
+
+    class Side:
+        def __init__(self, lock, mode, acquire, release):
+            self.lock = lock
+            self.mode = mode
+            self.acquire = acquire
+            self.release = release
+
+        def __enter__(self):
+            stats = self.lock.stats
+            waits = self.lock.waits
+            if stats is None and waits is None:
+                self.acquire()
+                return
+            start = time.perf_counter()
+            if stats is None:
+                self.acquire()
+                waits.observe(time.perf_counter() - start, self.mode)
+                return
+            frame = sys._getframe(1)
+            code = frame.f_code
+            site = (self.mode, "{}:{} {}".format(os.path.basename(code.co_filename), frame.f_lineno, code.co_name))
+            try:
+                depth = self.acquire()
+            except LockTimeout:
+                stats.timedOut(site, time.perf_counter() - start)
+                raise
+            wait = time.perf_counter() - start
+            stats.acquired(site, wait, depth)
+            if waits is not None:
+                waits.observe(wait, self.mode)
+
+        def __exit__(self, a, b, c):
+            self.release()
+            stats = self.lock.stats
+            if stats is not None:
+                stats.released()
+
+    def __init__(self, timeout=20.0, waits=None):
+        self.timeout = timeout
+        # a metrics.Histogram for the wait of every acquire, None costs nothing
+        self.waits = waits
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = {}
+        self._writer = None
+        self._writerDepth = 0
+        self._writersWaiting = 0
+        self.read = ReadWriteLock.Side(self, 'read', self.acquireRead, self.releaseRead)
+        self.write = ReadWriteLock.Side(self, 'write', self.acquireWrite, self.releaseWrite)
+        # LockStats while enabled
+        self.stats = None
+
+    def enableStats(self):
+        if self.stats is None:
+            self.stats = LockStats()
+        return self.stats
+
+    def disableStats(self):
+        self.stats = None
+
+    def observeWaits(self, histogram):
+        """Observe the wait of every acquire in `histogram`, None to stop"""
+        self.waits = histogram
+
+    def statistics(self):
+        stats = self.stats
+        return {} if stats is None else stats.statistics()
+
+    def dump(self):
+        stats = self.stats
+        return "lock stats disabled" if stats is None else stats.dump()
+
+    def acquireRead(self, timeout=None):
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me or me in self._readers:
+                depth = self._readers[me] = self._readers.get(me, 0) + 1
+                return depth
+            if not self._condition.wait_for(lambda: self._writer is None and self._writersWaiting == 0,
+                                            self.timeout if timeout is None else timeout):
+                raise LockTimeout("read lock not acquired")
+            self._readers[me] = 1
+            return 1
+
+    def releaseRead(self):
+        me = threading.get_ident()
+        with self._condition:
+            depth = self._readers[me] - 1
+            if depth:
+                self._readers[me] = depth
+            else:
+                del self._readers[me]
+                self._condition.notify_all()
+
+    def acquireWrite(self, timeout=None):
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me:
+                self._writerDepth += 1
+                return self._writerDepth
+            # upgrade: only our own read can be left
+            others = 1 if me in self._readers else 0
+            self._writersWaiting += 1
+            try:
+                acquired = self._condition.wait_for(lambda: self._writer is None and len(self._readers) == others,
+                                                    self.timeout if timeout is None else timeout)
+            finally:
+                self._writersWaiting -= 1
+            if not acquired:
+                # readers waiting for us can go on
+                self._condition.notify_all()
+                raise LockTimeout("write lock not acquired")
+            self._writer = me
+            self._writerDepth = 1
+            return 1
+
+    def held(self):
+        me = threading.get_ident()
+        with self._condition:
+            return self._writer == me or me in self._readers
+
+    def releaseWrite(self):
+        with self._condition:
+            assert self._writer == threading.get_ident(), "write lock not owned"
+            self._writerDepth -= 1
+            if self._writerDepth == 0:
+                self._writer = None
+                self._condition.notify_all()
+
+
+class ConnectionPool:
+    """Bounded set of long lived connections shared by the http threads.
+
+    A thread gets back the connection it returned last time, idle
+    connections of other threads are reused only once the pool is full.
+    """
+
+    def __init__(self, factory, size=10, timeout=20.0):
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        # thread ident -> idle connection
+        self.idle = {}
+        self.busy = set()
+
+    def acquire(self):
+        connection = self._acquire()
+        profileConnection(connection)
+        return connection
+
+    def _acquire(self):
+        ident = threading.get_ident()
+        deadline = time.monotonic() + self.timeout
+        with self.condition:
+            while True:
+                connection = self.idle.pop(ident, None)
+                if connection is None and self.idle and len(self.busy) + len(self.idle) >= self.size:
+                    _, connection = self.idle.popitem()
+                if connection is not None:
+                    self.busy.add(connection)
+                    return connection
+                if len(self.busy) + len(self.idle) < self.size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.condition.wait(remaining):
+                    raise TimeoutError("no sqlite connection available")
+            # reserve the slot while the connection is opened
+            self.busy.add(ident)
+        try:
+            connection = self.factory()
+        finally:
+            with self.condition:
+                self.busy.discard(ident)
+                self.condition.notify()
+        with self.condition:
+            self.busy.add(connection)
+        return connection
+
+    def release(self, connection):
+        ident = threading.get_ident()
+        with self.condition:
+            if connection not in self.busy:
+                # the pool was reset while the connection was in use
+                connection.close()
+                return
+            self.busy.discard(connection)
+            if not connection.getautocommit():
+                connection.cursor().execute('rollback')
+            previous = self.idle.pop(ident, None)
+            if previous is not None:
+                previous.close()
+            self.idle[ident] = connection
+            self.condition.notify()
+
+    @contextlib.contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def stats(self):
+        with self.condition:
+            return {
+                'size': self.size,
+                'busy': len(self.busy),
+                'idle': len(self.idle),
+            }
+
+    def reset(self):
+        with self.condition:
+            for connection in self.idle.values():
+                connection.close()
+            self.idle.clear()
+            # connections still in use are closed on release
+            self.busy.clear()
+            self.condition.notify_all()
+
+
+class CheckpointScheduler:
+    """Checkpoints the WAL of a gara from a background thread.
+
+    A checkpoint runs once nothing has been written for `quiet` seconds, so
+    bursts of votes are never slowed down by it, or anyway after `maxDelay`
+    seconds from the previous one.
+    """
+
+    def __init__(self, factory, interval=1.0, quiet=2.0, maxDelay=60.0, task=None):
+        self.factory = factory
+        # called with the connection on every interval, True after a write
+        self.task = task
+        self.interval = interval
+        self.quiet = quiet
+        self.maxDelay = maxDelay
+        self.lastWrite = None
+        self.lastCheckpoint = time.monotonic()
+        self.thread = None
+        self.stopped = threading.Event()
+        self.mutex = threading.Lock()
+
+    def touch(self):
+        self.lastWrite = time.monotonic()
+        self.start()
+
+    def start(self):
+        if self.thread is None:
+            with self.mutex:
+                if self.thread is None:
+                    self.stopped.clear()
+                    self.thread = threading.Thread(target=self.run, name='checkpoint', daemon=True)
+                    self.thread.start()
+
+    def due(self, now):
+        if self.lastWrite is None:
+            return False
+        if now - self.lastWrite >= self.quiet:
+            return True
+        return now - self.lastCheckpoint >= self.maxDelay
+
+    def run(self):
+        connection = None
+        try:
+            connection = self.factory()
+            while not self.stopped.wait(self.interval):
+                if self.task is not None and self.task(connection):
+                    self.lastWrite = time.monotonic()
+                if self.due(time.monotonic()):
+                    self.checkpoint(connection)
+            if self.lastWrite is not None:
+                self.checkpoint(connection)
+        except Exception as e:
+            # lastWrite is kept, the next touch starts again
+            log.warning("checkpoints stopped: %s", e)
+        finally:
+            with self.mutex:
+                if self.thread is threading.current_thread():
+                    self.thread = None
+            if connection is not None:
+                connection.close()
+
+    def checkpoint(self, connection):
+        self.lastWrite = None
+        self.lastCheckpoint = time.monotonic()
+        try:
+            connection.wal_checkpoint(mode=apsw.SQLITE_CHECKPOINT_PASSIVE)
+        except apsw.BusyError:
+            self.lastWrite = self.lastCheckpoint
+
+    def stop(self):
+        with self.mutex:
+            thread = self.thread
+            self.thread = None
+            self.stopped.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+
+class VoteWriter:
+    """Writes the votes of the http threads from a single thread.
+
+    Votes are handed to `write(connection, votes)` in batches: a batch
+    waits up to `delay` seconds after its first vote or until it has
+    `batchSize` submits, then it is committed in one transaction. `submit`
+    returns the result of its vote once the batch is committed, or raises
+    LockTimeout after `timeout` seconds; `submitMany` does the same for a
+    list of votes that all go in the same batch.
+    """
+
+    class Pending:
+        def __init__(self, votes):
+            self.votes = votes
+            self.results = None
+            self.error = None
+            self.done = threading.Event()
+
+    def __init__(self, factory, write, delay=0.002, batchSize=32, timeout=20.0):
+        self.factory = factory
+        self.write = write
+        self.delay = delay
+        self.batchSize = batchSize
+        self.timeout = timeout
+        self.queue = None
+        self.thread = None
+        self.mutex = threading.Lock()
+
+    def submit(self, vote):
+        return self.submitMany([vote])[0]
+
+    def submitMany(self, votes):
+        if not votes:
+            return []
+        pending = VoteWriter.Pending(list(votes))
+        with self.mutex:
+            if self.thread is None:
+                self.queue = queue.Queue()
+                self.thread = threading.Thread(target=self.run, args=(self.queue,), name='votes', daemon=True)
+                self.thread.start()
+            self.queue.put(pending)
+        if not pending.done.wait(self.timeout):
+            raise LockTimeout("vote not written")
+        if pending.error is not None:
+            raise pending.error
+        return pending.results
+
+    def run(self, votes):
+        connection = None
+        error = None
+        try:
+            connection = self.factory()
+            stop = False
+            while not stop:
+                pending = votes.get()
+                if pending is None:
+                    break
+                batch = [pending]
+                deadline = time.monotonic() + self.delay
+                while len(batch) < self.batchSize:
+                    try:
+                        pending = votes.get(timeout=max(deadline - time.monotonic(), 0))
+                    except queue.Empty:
+                        break
+                    if pending is None:
+                        stop = True
+                        break
+                    batch.append(pending)
+                self.flush(connection, batch)
+        except Exception as e:
+            log.error("vote writer stopped: %s", e)
+            error = e
+        finally:
+            # the next submit starts a new thread
+            with self.mutex:
+                if self.queue is votes:
+                    self.thread = None
+                    self.queue = None
+            # nobody reads this queue anymore
+            while True:
+                try:
+                    pending = votes.get_nowait()
+                except queue.Empty:
+                    break
+                if pending is not None:
+                    pending.error = error or LockTimeout("vote writer stopped")
+                    pending.done.set()
+            if connection is not None:
+                connection.close()
+
+    def flush(self, connection, batch):
+        try:
+            results = self.write(connection, [vote for pending in batch for vote in pending.votes])
+            start = 0
+            for pending in batch:
+                pending.results = results[start:start + len(pending.votes)]
+                start += len(pending.votes)
+        except Exception as e:
+            for pending in batch:
+                pending.error = e
+        finally:
+            for pending in batch:
+                pending.done.set()
+
+    def stop(self):
+        with self.mutex:
+            thread = self.thread
+            self.thread = None
+            if thread is not None:
+                self.queue.put(None)
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+
+class RequestCache:
+    """Outcomes of the last requests by id, so a retried request gets the
+    first answer instead of running again. Entries expire after `ttl`
+    seconds, at most `size` are kept. A retry waits up to `timeout` seconds
+    for the first request to finish, then raises LockTimeout.
+    """
+
+    class Entry:
+        def __init__(self, created):
+            self.created = created
+            self.result = None
+            self.done = threading.Event()
+
+    def __init__(self, size=4096, ttl=600.0, timeout=20.0):
+        self.size = size
+        self.ttl = ttl
+        self.timeout = timeout
+        self.entries = collections.OrderedDict()
+        self.mutex = threading.Lock()
+
+    def run(self, key, action):
+        now = time.monotonic()
+        with self.mutex:
+            while self.entries:
+                k, entry = next(iter(self.entries.items()))
+                if now - entry.created < self.ttl and len(self.entries) < self.size:
+                    break
+                del self.entries[k]
+            entry = self.entries.get(key)
+            owner = entry is None
+            if owner:
+                entry = self.entries[key] = RequestCache.Entry(now)
+        if not owner:
+            # a replay, or a retry while the first one is still running
+            if not entry.done.wait(self.timeout):
+                raise LockTimeout("request still running")
+            if entry.result is not None:
+                return entry.result
+            return self.run(key, action)
+        try:
+            entry.result = action()
+            return entry.result
+        finally:
+            if entry.result is None:
+                # raised, nothing to replay: the next retry runs again
+                with self.mutex:
+                    if self.entries.get(key) is entry:
+                        del self.entries[key]
+            entry.done.set()
+
+
+class StateWatcher:
+    """A single poll of the state version for all the waiters.
+
+    The thread runs while someone waits: changes made in this process wake
+    it up at once, those of other processes are noticed within `poll`
+    seconds. `version` returns the current version, None once closed, and
+    `alive` is given the uuids of the waiting judges on every poll.
+    Threads block in `wait`, others (the asyncio engine) `join` with a
+    listener called from the watcher thread after every poll.
+    """
+
+    def __init__(self, version, alive, poll=1.0):
+        self.version = version
+        self.alive = alive
+        self.poll = poll
+        self.condition = threading.Condition()
+        self.current = None
+        self.polled = False
+        self.events = 0
+        self.waiters = 0
+        self.waiting = {}
+        # listener -> joined count
+        self.listeners = {}
+        self.thread = None
+
+    def changed(self):
+        with self.condition:
+            self.events += 1
+            self.condition.notify_all()
+
+    def join(self, uuid=None, listener=None):
+        """Wait without blocking, until leave()"""
+        with self.condition:
+            self.waiters += 1
+            if uuid is not None:
+                self.waiting[uuid] = self.waiting.get(uuid, 0) + 1
+            if listener is not None:
+                self.listeners[listener] = self.listeners.get(listener, 0) + 1
+            if self.thread is None:
+                self.polled = False
+                self.thread = threading.Thread(target=self.run, name='state watcher', daemon=True)
+                self.thread.start()
+
+    def leave(self, uuid=None, listener=None):
+        with self.condition:
+            self.waiters -= 1
+            for key, counts in ((uuid, self.waiting), (listener, self.listeners)):
+                if key is not None:
+                    counts[key] -= 1
+                    if counts[key] == 0:
+                        del counts[key]
+            self.condition.notify_all()
+
+    def past(self, since):
+        """True once the version is past `since` or the gara is closed"""
+        return self.polled and (self.current is None or self.current > since)
+
+    def result(self, since):
+        if not self.polled or self.current is None:
+            return since
+        return self.current
+
+    def wait(self, since, timeout, uuid=None):
+        """The version once past `since`, or after `timeout` seconds"""
+        self.join(uuid)
+        try:
+            with self.condition:
+                self.condition.wait_for(lambda: self.past(since), timeout)
+                return self.result(since)
+        finally:
+            self.leave(uuid)
+
+    def run(self):
+        while True:
+            with self.condition:
+                if self.waiters == 0:
+                    self.thread = None
+                    return
+                events = self.events
+                uuids = list(self.waiting)
+            try:
+                self.alive(uuids)
+                version = self.version()
+            except Exception as e:
+                log.warning("state watcher: %s", e)
+                version = self.current
+            with self.condition:
+                self.current = version
+                self.polled = True
+                self.condition.notify_all()
+                listeners = list(self.listeners)
+            for listener in listeners:
+                listener()
+            with self.condition:
+                self.condition.wait_for(lambda: self.events != events or self.waiters == 0, self.poll)
+
+
+class BoundSignal:
+    """Signal of an instance: callbacks run on the emitting thread"""
+
+    def __init__(self):
+        self.slots = []
+
+    def connect(self, slot):
+        self.slots.append(slot)
+
+    def disconnect(self, slot=None):
+        if slot is None:
+            self.slots.clear()
+        else:
+            self.slots.remove(slot)
+
+    def emit(self, *args):
+        for slot in list(self.slots):
+            slot(*args)
+
+
+class Signal:
+    """pyqtSignal stand in, Gara works headless without PyQt"""
+
+    def __init__(self, *types, name=None):
+        self.name = name
+        self.attribute = None
+
+    def __set_name__(self, owner, attribute):
+        self.attribute = attribute
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return instance.__dict__.setdefault(self.attribute, BoundSignal())
+
+
+try:
+    from PyQt5.QtCore import QObject, pyqtSignal
+except ImportError:
+    QObject = object
+    pyqtSignal = Signal
 
-    def __exit__(self, a, b, c):
-        TimeoutLock.lock.release()
 
 class Gara(QObject):
 
     DONOT_ALLOW_DUPLICATE_JUDGES = True
     activeInstance = None
-    #lock = FakeLock() 
-    #lock = threading.RLock()
-    lock = TimeoutLock()
+    # read or write, shared by every gara
+    lock = ReadWriteLock()
+    # pooled connections, one for each http thread
+    poolSize = 10
 
     # signal (trial, user, judge, vote)
     vote_updated = pyqtSignal(int, int, int, float, name='voteUpdated')
@@ -438,33 +1600,69 @@ class Gara(QObject):
                  nUsers=5,
                  filename=None,
                  average=Average_Aritmetica, 
-                 maxVote=100.0):
-        super(QObject, self).__init__()
+                 maxVote=100.0,
+                 durability=Durability_Balanced):
+        super().__init__()
         self._description = description
         self._nJudges = nJudges
-        self._date = date if date is not None else QDate.currentDate()
+        self._date = date if date is not None else datetime.date.today()
         self._nTrials = nTrials
         self._nUsers = nUsers
         self._average = average
-        self._uuid = QUuid.createUuid().toString()
+        self._uuid = '{' + str(uuid4()) + '}'
+        # with getStateVersion makes the keepAlive ETag, differs on every run
+        self.stateTag = uuid4().hex[:8]
         self._maxVote = maxVote
+        self._durability = durability
         self.usersUUID = dict()
         self.usersTIME = dict()
         self._created = False
         self._message = None
         self._messageIndex = 0
+        self.connection = None
+        # read only snapshot of the config table, configVersion changes
+        # whenever its content does
+        self.configVersion = 0
+        self._config = None
+        self._configDataVersion = None
+        self._configChecked = 0.0
+        self._configWatcher = None
+        # nJudges of the loaded config, bounds the lock free keepAlive
+        self._judgesBound = None
+        self._configMutex = threading.RLock()
+        self.states = StateWatcher(self._watchedVersion, self._keepAlive)
+        # judges registration is shared by the readers
+        self._judgesMutex = threading.Lock()
+        self._sessionsMutex = threading.Lock()
+        self._sessionsSaved = 0.0
+        # {judge: (uuid, seen)} as in the judges table
+        self._sessionsStored = {}
+        self.pool = ConnectionPool(self.getConnection, Gara.poolSize)
+        self.checkpoints = CheckpointScheduler(self.getConnection, task=self._flushSessions)
+        self.votes = VoteWriter(self.getConnection, self._writeVotes)
+        self.requests = RequestCache()
         if filename:
             self.filename = pathlib.Path(filename)
         else:
-            where = QStandardPaths.TempLocation
-            dd = QStandardPaths.writableLocation(where)
-            pd = pathlib.Path(dd)
+            pd = pathlib.Path(tempfile.gettempdir())
             pu = pathlib.Path(self._uuid + '.gara')
             self.filename = pd / pu
 
     def close(self):
-        with self.lock:
+        # the writer and the checkpoint thread could be waiting for the lock
+        self.votes.stop()
+        self.checkpoints.stop()
+        with self.lock.write:
+            if self.connection is not None:
+                # last liveness, the checkpoints are over
+                self._flushSessions(self.connection, force=True)
             self.connection = None
+            self.pool.reset()
+            with self._configMutex:
+                if self._configWatcher is not None:
+                    self._configWatcher.close()
+                    self._configWatcher = None
+            self._invalidateConfiguration()
             Gara.activeInstance = None
 
     @staticmethod
@@ -476,33 +1674,77 @@ class Gara(QObject):
     @staticmethod
     def setActiveInstance(gara):
         assert gara.connection, "connection not available"
-        with Gara.lock:
+        previous = Gara.activeInstance
+        if previous is not None and previous is not gara:
+            previous.votes.stop()
+            previous.checkpoints.stop()
+        with Gara.lock.write:
+            previous = Gara.activeInstance
+            if previous is not None and previous is not gara:
+                previous.pool.reset()
             Gara.activeInstance = gara
-            print("Set active instance: ", gara)
+            log.info("set active instance: %s", gara.filename)
 
     def getConnection(self):
-        with self.lock:
+        with self.lock.read:
             connection = apsw.Connection(str(self.filename))
             connection.setbusytimeout(15000)
+            profileConnection(connection)
+            if self._created:
+                applyDurability(connection, self._durability)
             return connection
 
-    def openDB(self):
-        with self.lock:
+    def openDB(self, durability=None):
+        self.votes.stop()
+        with self.lock.write:
             self.connection = self.getConnection()
             version = checkDBVersion(self.connection)
             if version != USER_DB_VERSION:
                 # Let's BUMP
                 if version == 2:
-                    print("Bump DB from 2 to 3")
+                    log.info("Bump DB from 2 to 3")
                     version_from_2_to_3(self.connection)
                     version = 3
-                else:            
+                if version == 3:
+                    log.info("Bump DB from 3 to 4")
+                    version_from_3_to_4(self.connection)
+                    version = 4
+                if version == 4:
+                    log.info("Bump DB from 4 to 5")
+                    version_from_4_to_5(self.connection)
+                    version = 5
+                if version == 5:
+                    log.info("Bump DB from 5 to 6")
+                    version_from_5_to_6(self.connection)
+                    version = 6
+                if version == 6:
+                    log.info("Bump DB from 6 to 7")
+                    version_from_6_to_7(self.connection)
+                    version = 7
+                if version == 7:
+                    log.info("Bump DB from 7 to 8")
+                    version_from_7_to_8(self.connection)
+                    version = 8
+                if version == 8:
+                    log.info("Bump DB from 8 to 9")
+                    version_from_8_to_9(self.connection)
+                    version = 9
+                if version != USER_DB_VERSION:
                     raise Exception("DB not compatible")
+                # stored scores are computed by the current code
+                rebuildScores(self.connection)
+            if durability is not None:
+                setDurability(self.connection, durability)
+            self._durability = getConfig(self.connection)['durability']
+            applyDurability(self.connection, self._durability)
+            self._loadSessions()
+            self.pool.reset()
+            self._invalidateConfiguration()
             self._created = True
 
     def createDB(self):
         assert not self._created, "already created"
-        with self.lock:
+        with self.lock.write:
             self.connection = self.getConnection()
 
             if checkDBVersion(self.connection) == USER_DB_VERSION:
@@ -512,24 +1754,96 @@ class Gara(QObject):
                 createTableV2(self.connection)
                 setConfig(self.connection,
                           description=self._description,
-                          date=datetime.date(year=self._date.year(),
-                                             month=self._date.month(),
-                                             day=self._date.day()),
+                          date=self._date,
                           nJudges=self._nJudges,
                           nUsers=self._nUsers,
                           nTrials=self._nTrials,
                           average=self._average,
                           state=State_Configure,
                           uuid=self._uuid,
-                          maxVote=self._maxVote)
-                self._created = True
+                          maxVote=self._maxVote,
+                          durability=self._durability)
+            applyDurability(self.connection, self._durability)
+            self._created = True
+
+    def _dataVersion(self):
+        # changes when another connection, or another process, commits
+        with self._configMutex:
+            if self._configWatcher is None:
+                self._configWatcher = self.getConnection()
+            for v, in self._configWatcher.cursor().execute('PRAGMA data_version'):
+                return v
+
+    def _invalidateConfiguration(self):
+        self._configDataVersion = None
+        self._judgesBound = None
+        self._notifyState()
+
+    def _notifyState(self):
+        # wakes up the waitStateVersion callers
+        self.states.changed()
+
+    def _watchedVersion(self):
+        if self.connection is None:
+            # closed
+            return None
+        with self.pool.connection() as connection:
+            return self.getStateVersion(connection)
+
+    def _keepAlive(self, uuids):
+        now = time.time()
+        with self._judgesMutex:
+            for uuid in uuids:
+                self.usersTIME[uuid] = now
+
+    def waitStateVersion(self, since, timeout=25.0, uuid=None):
+        """Wait up to `timeout` seconds for the state version to be past
+        `since` and return it. A single thread polls the version for all the
+        callers, the judge `uuid` is kept alive meanwhile.
+        """
+        return self.states.wait(since, timeout, uuid)
 
     def getConfiguration(self, connection):
-        with self.lock:
-            return getConfig(connection)
+        """The cached configuration. Writes of this process invalidate it,
+        those of other processes are noticed within STATE_RECHECK seconds."""
+        config = self._config
+        if (config is not None and self._configDataVersion is not None
+                and time.monotonic() - self._configChecked < STATE_RECHECK):
+            return config
+        with self.lock.read, self._configMutex:
+            dataVersion = self._dataVersion()
+            if self._config is None or dataVersion != self._configDataVersion:
+                config = getConfig(connection)
+                if config is None:
+                    return None
+                if self._config is None or dict(self._config) != config:
+                    self.configVersion += 1
+                    self._config = types.MappingProxyType(config)
+                self._configDataVersion = dataVersion
+                self._judgesBound = self._config['nJudges']
+            self._configChecked = time.monotonic()
+            return self._config
+
+    def getStateVersion(self, connection):
+        """Grows whenever getState could return something else: config,
+        state, current trial or message.
+        """
+        with self.lock.read:
+            self.getConfiguration(connection)
+            return self.configVersion + self._messageIndex
+
+    def cachedStateVersion(self, connection):
+        """getStateVersion without lock and query if the configuration was
+        checked less than STATE_RECHECK seconds ago and is still valid."""
+        if self._configDataVersion is not None and time.monotonic() - self._configChecked < STATE_RECHECK:
+            version = self.configVersion + self._messageIndex
+            # not invalidated meanwhile
+            if self._configDataVersion is not None:
+                return version
+        return self.getStateVersion(connection)
 
     def getState(self, connection):
-        with self.lock:
+        with self.lock.read:
             configuration = self.getConfiguration(connection)
             msgs = {
                 State_Running: "in corso",
@@ -557,7 +1871,13 @@ class Gara(QObject):
             return state
 
     def registerJudgeWithUUID(self, connection, judge, uuid):
-        with self.lock:
+        # fast path, judge already registered with this token: dict reads
+        # and writes are atomic, no lock nor query is needed
+        bound = self._judgesBound
+        if bound is not None and 0 < judge <= bound and self.usersUUID.get(judge) == uuid:
+            self.usersTIME[uuid] = time.time()
+            return (200, {})
+        with self.lock.read:
             configuration = self.getConfiguration(connection)
             if judge <= 0 or judge > configuration['nJudges']:
                 # should be 409 but QML XHTTPXmlRequest.status is bugged on
@@ -566,152 +1886,321 @@ class Gara(QObject):
                     'error': 'judge not in range',
                     'max': configuration['nJudges']
                 })
+            with self._judgesMutex:
+                result = self._registerJudge(judge, uuid)
+            # written by the checkpoint thread
+            self.checkpoints.start()
+            return result
+
+    def _loadSessions(self):
+        # lock held
+        now = time.time()
+        stored = getJudgeSessions(self.connection)
+        sessions = {judge: (uuid, seen) for judge, (uuid, seen) in stored.items()
+                    if now - seen <= SESSIONS_EXPIRE}
+        with self._judgesMutex:
+            self.usersUUID = {judge: uuid for judge, (uuid, seen) in sessions.items()}
+            self.usersTIME = {uuid: seen for uuid, seen in sessions.values()}
+        # the expired ones are deleted by the next flush
+        self._sessionsStored = stored
+        self._sessionsSaved = time.monotonic()
+        if sessions:
+            log.info("judges restored: %s", self.usersUUID)
+            self.checkpoints.start()
+
+    def _flushSessions(self, connection, force=False):
+        """Writes the judges changed since the last flush, a change of
+        liveness alone once every SESSIONS_SAVE_INTERVAL seconds. Runs on the
+        checkpoint thread, True after a write."""
+        with self._sessionsMutex:
+            liveness = force or time.monotonic() - self._sessionsSaved >= SESSIONS_SAVE_INTERVAL
+            with self._judgesMutex:
+                sessions = {judge: (uuid, self.usersTIME.get(uuid, 0.0)) for judge, uuid in self.usersUUID.items()}
+            stored = self._sessionsStored
+            changed = {judge: session for judge, session in sessions.items()
+                       if judge not in stored or stored[judge][0] != session[0]
+                       or (liveness and stored[judge][1] != session[1])}
+            removed = [judge for judge in stored if judge not in sessions]
+            if liveness:
+                self._sessionsSaved = time.monotonic()
+            if not changed and not removed:
+                return False
+            try:
+                saveJudgeSessions(connection, changed, removed)
+            except apsw.Error as e:
+                # next time
+                log.warning("judges not saved: %s", e)
+                return False
+            stored = {judge: session for judge, session in stored.items() if judge in sessions}
+            stored.update(changed)
+            self._sessionsStored = stored
+            return True
 
-            if self.DONOT_ALLOW_DUPLICATE_JUDGES:
-                # remove any judge with the same uuid
-                for k, v in list(self.usersUUID.items()):
-                    if v == uuid and k != judge:
-                        print("Removed judge: {}".format(k))
-                        del self.usersUUID[k]
-
-                # register user
-                present = self.usersUUID.get(judge)
-                if present is None:
-                    present = uuid
-                    print("Add judge: {} -> {}".format(judge, present))
-                    self.usersUUID[judge] = present
-                else:
-                    if present != uuid:
-                        print("Judge conflict: {} -> {}")
+    def _registerJudge(self, judge, uuid):
+        if self.DONOT_ALLOW_DUPLICATE_JUDGES:
+            # remove any judge with the same uuid
+            for k, v in list(self.usersUUID.items()):
+                if v == uuid and k != judge:
+                    log.info("removed judge: %s", k)
+                    del self.usersUUID[k]
+
+            # register user
+            present = self.usersUUID.get(judge)
+            if present is None:
+                present = uuid
+                log.info("add judge: %s -> %s", judge, present)
+                self.usersUUID[judge] = present
             else:
-                present = self.usersUUID.get(judge)
                 if present != uuid:
-                    print("Judgle conflict detected")
-                present = uuid
-                self.usersUUID[judge] = uuid
-
-            self.usersTIME[uuid] = time.time()
+                    log.info("judge conflict: %s -> %s", judge, uuid)
+        else:
+            present = self.usersUUID.get(judge)
             if present != uuid:
-                return (403, {'error': 'judge in use'})
-            return (200, {})
+                log.info("judge conflict: %s -> %s", judge, uuid)
+            present = uuid
+            self.usersUUID[judge] = uuid
+
+        self.usersTIME[uuid] = time.time()
+        if present != uuid:
+            return (403, {'error': 'judge in use'})
+        return (200, {})
 
     def validJudge(self, judge, uuid):
-        with self.lock:
+        with self._judgesMutex:
             v = self.usersUUID.get(judge)
             if v is None:
                 return False
             return v == uuid
 
     def addRemoteVote(self, connection, trial, user, judge, user_uuid, vote):
-        with self.lock:
+        with self.lock.read:
+            result = self._checkVote(self.getConfiguration(connection), trial, user, judge, user_uuid, vote)
+
+        if result is None:
+            if self.lock.held():
+                # the writer thread would wait for us, a reader upgrades
+                result = self._writeVotes(connection, [(trial, user, judge, vote)])[0]
+            else:
+                result = self.votes.submit((trial, user, judge, vote))
+        self._auditVote(trial, user, judge, vote, result)
+        return result
+
+    def _auditVote(self, trial, user, judge, vote, result):
+        code, body = result
+        if code == 200:
+            VOTES.inc('accepted', '')
+        else:
+            VOTES.inc('rejected', body.get('code'))
+        if audit.isEnabledFor(logging.INFO):
+            data = {'trial': trial, 'user': user, 'judge': judge, 'vote': vote, 'status': code}
+            if code != 200:
+                data['code'] = body.get('code')
+            audit.info("vote %s", 'accepted' if code == 200 else body.get('error'), extra={'data': data})
+
+    def idempotent(self, user_uuid, requestId, action, route=None):
+        """Runs action() once for each request id of a judge on a route, a
+        retry gets the outcome of the first request without touching the
+        database.
+        """
+        if requestId is None:
+            return action()
+        return self.requests.run((user_uuid, route, requestId), action)
+
+    def addRemoteVotes(self, connection, judge, user_uuid, votes):
+        """addRemoteVote for many (trial, user, vote) of the same judge, the
+        valid ones go to the vote writer together and are written in the same
+        transaction. Returns (code, body) for each vote.
+        """
+        with self.lock.read:
             configuration = self.getConfiguration(connection)
-            
-            if configuration['state'] != State_Running:
-                return (500, {'code': 0, 'error': 'gara not configured yet'})
+            results = [self._checkVote(configuration, trial, user, judge, user_uuid, vote)
+                       for trial, user, vote in votes]
+        valid = [i for i, r in enumerate(results) if r is None]
+        log.debug("judge %s sent %d votes, %d valid", judge, len(votes), len(valid))
+        batch = [(votes[i][0], votes[i][1], judge, votes[i][2]) for i in valid]
+        if self.lock.held():
+            # as in addRemoteVote
+            written = self._writeVotes(connection, batch)
+        else:
+            written = self.votes.submitMany(batch)
+        for i, r in zip(valid, written):
+            results[i] = r
+        for (trial, user, vote), result in zip(votes, results):
+            self._auditVote(trial, user, judge, vote, result)
+        return results
 
-            if trial != configuration['currentTrial']:
-                return (403, {'code': 1, 'error': 'Trial not accepted'})
+    def _checkVote(self, configuration, trial, user, judge, user_uuid, vote):
+        if configuration['state'] != State_Running:
+            return (500, {'code': 0, 'error': 'gara not configured yet'})
 
-            if not (0 <= user <= configuration['nUsers']):
-                return (403, {'code': 2, 'error': 'User not valid'})
+        if trial != configuration['currentTrial']:
+            return (403, {'code': 1, 'error': 'Trial not accepted'})
 
-            if not (0 <= vote <= configuration['maxVote']):
-                return (403, {'code': 3, 'error': 'Vote not valid'})
+        if not (0 <= user <= configuration['nUsers']):
+            return (403, {'code': 2, 'error': 'User not valid'})
 
-            if not self.validJudge(judge, user_uuid):
-                return (403, {'code': 4, 'error': 'Judge not maching registered uuid'})
+        if not (0 <= vote <= configuration['maxVote']):
+            return (403, {'code': 3, 'error': 'Vote not valid'})
 
-            print("Add vote: ", trial, judge, user, vote)
-            v = addVote(connection,
-                        trial=trial,
-                        user=user,
-                        judge=judge,
-                        vote=vote)
-            if v:
-                self.vote_updated.emit(trial, user, judge, vote)
-                return (200, {})
+        if not self.validJudge(judge, user_uuid):
+            return (403, {'code': 4, 'error': 'Judge not maching registered uuid'})
 
-            return (403, {'code': 5, 'error': 'duplicate'})
+        return None
+
+    def _writeVotes(self, connection, votes):
+        # trial and state are checked again, they could have changed while
+        # the votes were queued
+        profileConnection(connection)
+        with self.lock.write:
+            configuration = self.getConfiguration(connection)
+            results = []
+            valid = []
+            for trial, user, judge, vote in votes:
+                if configuration['state'] != State_Running:
+                    results.append((500, {'code': 0, 'error': 'gara not configured yet'}))
+                elif trial != configuration['currentTrial']:
+                    results.append((403, {'code': 1, 'error': 'Trial not accepted'}))
+                else:
+                    results.append(None)
+                    valid.append(len(results)-1)
+            stored = addVotes(connection, [votes[i] for i in valid], configuration)
+            for i, v in zip(valid, stored):
+                if v:
+                    results[i] = (200, {})
+                else:
+                    results[i] = (403, {'code': 5, 'error': 'duplicate'})
+            if True in stored:
+                self.checkpoints.touch()
+        for i, v in zip(valid, stored):
+            if v:
+                self.vote_updated.emit(*votes[i])
+        return results
 
     def save(self, connection, filename):
         self.properName = filename
         self._uuid = filename
 
     def saveAs(self, connection, filename):
-        with self.lock:
-            print("Saving as:", filename)
+        with self.lock.read:
+            log.info("saving as: %s", filename)
             db = apsw.Connection(filename)
             with db.backup("main", connection, "main") as b:
                 while not b.done:
                     b.step(100)
-                    print(b.remaining, b.pagecount, "\r")
-            print("Saved.")
+                    log.debug("saving: %d of %d pages left", b.remaining, b.pagecount)
+            log.info("saved")
 
     def getUser(self, connection, user):
-        with self.lock:
-            return getUser(connection, user)
+        with self.lock.read:
+            return getUser(connection, user, self.getConfiguration(connection))
 
     def deleteTrialForUser(self, connection, trial, user):
-        print("Delete user {} trial {}".format(user, trial))
-        with self.lock:
-            deleteTrialForUser(connection, trial, user)
+        if audit.isEnabledFor(logging.INFO):
+            audit.info("trial deleted", extra={'data': {'trial': trial, 'user': user}})
+        with self.lock.write:
+            deleteTrialForUser(connection, trial, user, self.getConfiguration(connection))
+            self.checkpoints.touch()
             self.vote_deleted.emit(trial, user)
 
     def countDone(self, connection, trial):
-        with self.lock:
+        with self.lock.read:
             return countDone(connection, trial)
 
     def advanceToNextTrial(self, connection):
-        with self.lock:
-            return advanceToNextTrial(connection)
+        with self.lock.write:
+            self.checkpoints.touch()
+            try:
+                return advanceToNextTrial(connection)
+            finally:
+                self._invalidateConfiguration()
 
     def setState(self, connection, state=State_Configure):
-        with self.lock:
-            return setState(connection, state)
+        with self.lock.write:
+            self.checkpoints.touch()
+            try:
+                return setState(connection, state)
+            finally:
+                self._invalidateConfiguration()
+
+    def resetToTrial(self, connection, trial=0):
+        with self.lock.write:
+            self.checkpoints.touch()
+            try:
+                return resetToTrial(connection, trial)
+            finally:
+                self._invalidateConfiguration()
+
+    def resetMaxTrials(self, connection, trials=0):
+        with self.lock.write:
+            self.checkpoints.touch()
+            try:
+                return resetMaxTrials(connection, trials)
+            finally:
+                self._invalidateConfiguration()
 
     def updateUserInfo(self, connection, payloads):
-        with self.lock:
+        with self.lock.write:
+            conf = self.getConfiguration(connection)
             for k, v in payloads.items():
-                updateUserInfo(connection, k, v)
+                updateUserInfo(connection, k, v, conf)
+            self.checkpoints.touch()
+
+    def getAllUsers(self, connection, users=None):
+        with self.lock.read:
+            return getAllUsers(connection, users, self.getConfiguration(connection))
 
     def getUserInfo(self, connection, user):
-        with self.lock:
+        with self.lock.read:
             return getUserInfo(connection, user)
 
+    def getAllUserInfo(self, connection):
+        with self.lock.read:
+            return getAllUserInfo(connection)
+
     def getAllUsersWithAVote(self, connection):
-        with self.lock:
+        with self.lock.read:
             return getAllUsersWithAVote(connection)
 
     def generateRapport(self, connection, filename='demo2.xlsx', include=True):
+        # openpyxl is loaded on first use
+        from rapport import generateRapport
         generateRapport(self, connection, filename, include)
 
     def setEnd(self, connection):
-        with self.lock:
+        with self.lock.write:
             conf = self.getConfiguration(connection)
             self.setState(connection, State_Completed)
             if conf['currentTrial'] != conf['nTrials']:
-                resetMaxTrials(connection, conf['currentTrial']+1)
+                self.resetMaxTrials(connection, conf['currentTrial']+1)
                 return False
             return True
 
     def canCreditBeEdited(self, connection, trial):
-        with self.lock:
+        with self.lock.read:
             return countReceived(connection, trial) == 0
 
     def deleteTrialVotesForUser(self, connection, trial, user, judges):
-        with self.lock:
-            deleteTrialVotesForUser(connection, trial, user, judges)
+        if audit.isEnabledFor(logging.INFO):
+            audit.info("votes deleted", extra={'data': {'trial': trial, 'user': user, 'judges': sorted(judges)}})
+        with self.lock.write:
+            deleteTrialVotesForUser(connection, trial, user, judges, self.getConfiguration(connection))
+            self.checkpoints.touch()
             self.vote_deleted.emit(trial, user)
 
     def sendMessage(self, message):
-        with self.lock:
+        with self.lock.write:
             self._messageIndex += 1
             self._message = message
+        self._notifyState()
 
     def countIncomplete(self, connection, trial):
-        with self.lock:
+        with self.lock.read:
             return countIncomplete(connection, trial)
 
+    def getTrialProgress(self, connection, trial):
+        with self.lock.read:
+            return getTrialProgress(connection, trial)
+
 
 if __name__ == '__main__':
     c = apsw.Connection(":memory:")
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+GaraServer
+Copyright 2016 Nicola Ferruzzi <nicola.ferruzzi@gmail.com>
+License: GPLv3 (see LICENSE)
+
+Headless server, no window nor Qt widget:
+
+    python3 -m giudice serve file.esame [--port N] [--engine asyncio] ...
+    python3 -m giudice start|next|end|state [--port N]
+
+the second form drives the server running on this machine.
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import urllib.error
+import urllib.request
+from gara import Gara
+from logs import log, stopLogging
+from webserver import (ADMIN_ACTIONS, SERVER_PROFILES, addServerArguments, createController,
+                       serverOptions, setupSettings, startLogging)
+
+
+def parseCommand(argv):
+    parser = argparse.ArgumentParser(prog='giudice')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help="open a gara file and serve the judges")
+    serve.add_argument('filename', help="gara file to open")
+    addServerArguments(serve)
+    port = int(os.environ.get('GIUDICE_PORT', SERVER_PROFILES['small']['port']))
+    helps = {
+        'start': "start the gara",
+        'next': "move to the next trial",
+        'end': "end the gara at the current trial",
+        'state': "state, incomplete athletes and judges",
+    }
+    for action in ADMIN_ACTIONS + ('state',):
+        command = commands.add_parser(action, help=helps[action])
+        command.add_argument('--port', type=int, default=port)
+    return parser.parse_args(argv)
+
+
+def serve(args):
+    startLogging(args)
+    options = serverOptions(args)
+    # a pooled connection for every http thread
+    Gara.poolSize = options['threads']
+    gara = Gara.fromFilename(args.filename)
+    Gara.setActiveInstance(gara)
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *args: stop.set())
+    controller = createController(options)
+    threading.Thread(target=controller.listen, name='http', daemon=True).start()
+    while not stop.wait(1.0):
+        pass
+
+    controller.shutdown()
+    gara.close()
+    if Gara.lock.stats is not None:
+        log.info("lock stats\n%s", Gara.lock.dump())
+    stopLogging()
+    return 0
+
+
+def command(args):
+    url = 'http://127.0.0.1:{}/admin/{}'.format(args.port, args.command)
+    data = None if args.command == 'state' else b''
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data)) as response:
+            body = json.loads(response.read().decode())
+    except urllib.error.HTTPError as e:
+        print(e.read().decode(), file=sys.stderr)
+        return 1
+    except urllib.error.URLError as e:
+        print("server not reachable: {}".format(e.reason), file=sys.stderr)
+        return 2
+    print(json.dumps(body, indent=2, sort_keys=True))
+    return 0
+
+
+def main(argv):
+    args = parseCommand(argv)
+    setupSettings()
+    if args.command == 'serve':
+        return serve(args)
+    return command(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+GaraServer
+Copyright 2016 Nicola Ferruzzi <nicola.ferruzzi@gmail.com>
+License: GPLv3 (see LICENSE)
+"""
+import json
+import logging
+import logging.handlers
+import queue
+
+# everything logs here, nothing is written until setupLogging
+log = logging.getLogger('giudice')
+log.addHandler(logging.NullHandler())
+# one record for every vote received or deleted, with `data`
+audit = logging.getLogger('giudice.audit')
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """A JSON object for each record, `extra={'data': {..}}` is included"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + '.{:03d}'.format(int(record.msecs)),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        data = getattr(record, 'data', None)
+        if data is not None:
+            entry['data'] = data
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def rotatingFile(filename, maxBytes, backupCount):
+    handler = logging.handlers.RotatingFileHandler(filename, maxBytes=maxBytes,
+                                                   backupCount=backupCount, encoding='utf-8')
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+def setupLogging(level='INFO', filename=None, auditFilename=None, console=True,
+                 maxBytes=5*1024*1024, backupCount=5):
+    """The loggers only put records in a queue, a background thread writes
+    them to the console and, as JSON lines, to the rotating `filename`.
+    The vote audit trail also goes to `auditFilename`.
+    """
+    global _listener
+    stopLogging()
+    if not isinstance(level, int):
+        level = logging.getLevelName(level.upper())
+    handlers = []
+    if console:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        handlers.append(handler)
+    if filename:
+        handlers.append(rotatingFile(filename, maxBytes, backupCount))
+    for handler in handlers:
+        handler.setLevel(level)
+    if auditFilename:
+        handler = rotatingFile(auditFilename, maxBytes, backupCount)
+        handler.addFilter(logging.Filter(audit.name))
+        handlers.append(handler)
+
+    records = queue.SimpleQueue()
+    for handler in list(log.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            log.removeHandler(handler)
+    log.addHandler(logging.handlers.QueueHandler(records))
+    log.setLevel(level)
+    # with its own file the audit trail is kept whatever the level
+    audit.setLevel(logging.INFO if auditFilename else logging.NOTSET)
+    _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stopLogging():
+    """Writes what is still queued"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -10,153 +10,53 @@ import sys
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
-from PyQt5.QtPrintSupport import *
-from PyQt5.QtNetwork import *
-import http.server
+import os
 import threading
-import socketserver
+import functools
 import ui
 import pathlib
 import json
-import cherrypy
-from cheroot.wsgi import Server as WSGIServer
 from gara import *
-from serial import *
-from bottle import Bottle, run, get, post, request
-from bottle import ServerAdapter, abort, install
-from urllib.error import HTTPError
-from serialport import *
+from webserver import *
+from tablemodels import *
+from logs import log, stopLogging
 
-VERSION = '1.1.3'
-API_VERSION = '1.0'
 
-webapp = Bottle()
 _translate = QCoreApplication.translate
 
-COLOR_ROW_INCOMPLETE = QColor(255, 0, 0)
-COLOR_ROW_DISPLAY = QColor(0, 200, 0)
 
 def _e():
     return sys.exc_info()[1]
 
 
-def _f(val):
-    assert isinstance(val, float)
-    return "{:0.02f}".format(val)
-
-def getSqliteConnection(callback):
-    def wrapper(*args, **kwargs):
-        gara = Gara.activeInstance
-        if gara is None:
-            abort(500, {'error': 'server not configured'})
-
-        connection = gara.getConnection()
-        if connection is None:
-            abort(500, {'error': 'server internal error'})
-
-        kwargs['connection'] = connection
-        kwargs['gara'] = gara
-
-        print("Gara: ", gara)
-        print("Connection created: ", connection)
-
+def showLockTimeout(slot):
+    """The gara is busy: tell the user instead of raising out of the slot"""
+    @functools.wraps(slot)
+    def wrapper(self, *args):
         try:
-            body = callback(*args, **kwargs)
-            return body
-        finally:
-            connection.close()
-            print("Connection closed")
-            pass
-
+            return slot(self, *args)
+        except LockTimeout:
+            log.warning("%s: %s", slot.__name__, _e())
+            QMessageBox.critical(self, "Attenzione",
+                                 _translate("MainWindow", "La gara e' occupata, riprovare"),
+                                 QMessageBox.Ok)
     return wrapper
 
-webapp.install(getSqliteConnection)
-
-
-class MyWSGIRefServer(ServerAdapter):
-    server = None
-
-    def run(self, handler):
-        from wsgiref.simple_server import make_server, WSGIRequestHandler
-        if self.quiet:
-            class QuietHandler(WSGIRequestHandler):
-                def log_request(*args, **kw): pass
-            self.options['handler_class'] = QuietHandler
-        self.server = make_server(self.host, self.port, handler, **self.options)
-        self.server.serve_forever()
-
-    def stop(self):
-        # self.server.server_close() <--- alternative but causes bad
-        # fd exception
-        self.server.shutdown()
-
-
-@webapp.error(401)
-@webapp.error(403)
-@webapp.error(404)
-@webapp.error(409)
-def error404(error):
-    print(error.body)
-    return error.body
-
-
-@webapp.get('/keepAlive/<judge>')
-def keepAlive(judge, connection=None, gara=None):
-    judge = int(judge)
 
-    # configuration = Gara.activeInstance.getConfiguration(connection)
-    # if configuration['state'] == State_Configure:
-    #     abort(500, {'error': 'gara not configured yet'})
-
-    response = gara.getState(connection)
-    response['version'] = API_VERSION
-
-    ua = request.headers.get('X-User-Auth')
-    if ua is None:
-        abort(401, {'error': 'no token'})
-
-    code, err = gara.registerJudgeWithUUID(connection, judge, ua)
-    if code != 200:
-        abort(code, err)
-
-    return response
-
-
-@webapp.post("/vote")
-def vote(connection, gara):
-    uuid = request.headers.get('X-User-Auth')
-    if uuid is None:
-        abort(401, {'error': 'no token'})
-
-    configuration = Gara.activeInstance.getConfiguration(connection)
-
-    if configuration['state'] != State_Running:
-        abort(404, {'error': 'gara not running'})
-
-    trial = int(request.json['trial'])
-    judge = int(request.json['judge'])
-    user = int(request.json['user'])
-    vote = float(request.json['vote'])
-
-    code, body = gara.addRemoteVote(connection, trial, user, judge, uuid, vote)
-    if code != 200:
-        abort(code, body)
-
-    return body
-
-
-class Controller (object):
-    def listen(self):
-        print("listening")
-        self.server = WSGIServer(('0.0.0.0', 8000), webapp)
-        # run(webapp, server=self.server)
-        # run(webapp, server='bjoern', port=8000)
-        self.server.start()
+def skipLockTimeout(slot):
+    """Refresh slots: on a busy gara the next call catches up"""
+    @functools.wraps(slot)
+    def wrapper(self, *args):
+        try:
+            return slot(self, *args)
+        except LockTimeout:
+            log.warning("%s: %s", slot.__name__, _e())
+    return wrapper
 
-    def shutdown(self):
-        self.server.stop()
-        print("done listening")
 
+def _f(val):
+    assert isinstance(val, float)
+    return "{:0.02f}".format(val)
 
 class DlgInfo (QDialog):
     def __init__(self, parent):
@@ -181,11 +81,17 @@ class DlgPickJudges (QDialog, ui.Ui_DlgPickJudges):
             6: self.checkBox_6,
         }
         conf = Gara.activeInstance.getConfiguration(parent.connection)
+        # the form has 6 judges, add the others on demand
+        for k in range(len(self.judges)+1, conf['nJudges']+1):
+            v = QCheckBox(_translate("DlgPickJudges", "Giudice {}").format(k), self)
+            self.verticalLayout.addWidget(v)
+            self.judges[k] = v
         for k, v in list(self.judges.items()):
             if k > conf['nJudges']:
                 v.setHidden(True)
 
 
+    @showLockTimeout
     def accept(self):
         judges = set()
         for k, v in self.judges.items():
@@ -204,6 +110,7 @@ class DlgMessage (QDialog, ui.Ui_DlgMessage):
         self.setupUi(self)
         self.setModal(True)
 
+    @showLockTimeout
     def accept(self):
         Gara.activeInstance.sendMessage(self.lineEdit.text())
         testo = _translate("MainWindow", "Messaggio inoltrato")
@@ -218,6 +125,8 @@ class DlgSerialConfig (QDialog, ui.Ui_DlgSerialConfig):
         super().__init__(parent)
         self.setupUi(self)
         self.serials = []
+        # serial display, loaded on first use
+        from serialport import MySerialPortInfo
         l = MySerialPortInfo.availablePorts()
         found = None
         s = QSettings()
@@ -259,6 +168,10 @@ class DlgNewGara (QDialog):
         self.ui.setupUi(self)
         self.setModal(True)
         self.ui.dateEdit.setDate(QDate.currentDate())
+        for i in range(self.ui.numeroGiudici.count()+1, MAX_JUDGES+1):
+            self.ui.numeroGiudici.addItem(str(i))
+        for i in range(self.ui.prove.count()+1, MAX_TRIALS+1):
+            self.ui.prove.addItem(str(i))
         self.ui.numeroGiudici.setCurrentIndex(5)
         self.ui.prove.setCurrentIndex(3)
         self.ui.radioButton.setChecked(True)
@@ -302,11 +215,12 @@ class DlgNewGara (QDialog):
 
             gara = Gara(description=self.ui.description.text(),
                         nJudges=int(ng),
-                        date=self.ui.dateEdit.date(),
+                        date=self.ui.dateEdit.date().toPyDate(),
                         nTrials=int(self.ui.prove.currentText()),
                         nUsers=int(self.ui.atleti.text()),
                         average=average,
                         maxVote=float(self.ui.votoMassimo.text()),
+                        durability=int(QSettings().value("database/durability", Durability_Balanced)),
                         filename=filename[0])
             gara.createDB()
             self.parent().setGara(gara)
@@ -427,6 +341,7 @@ class DlgConfigCredits (QDialog):
             g[col-1] = v
             self.changes[user] = g
 
+    @showLockTimeout
     def accept(self):
         Gara.activeInstance.updateUserInfo(self.connection, self.changes)
         super().accept()
@@ -442,12 +357,10 @@ class GaraMainWindow (QMainWindow):
         dlg.show()
 
     def setShowOnDisplay(self, trial, user):
-        g = self.show_on_display.setdefault(trial, {})
-        g[user] = True
+        self.store.setDisplayed(trial, user)
 
     def isShowOnDisplay(self, trial, user):
-        g = self.show_on_display.get(trial, {})
-        return g.get(user, False)
+        return self.store.isDisplayed(trial, user)
 
     def setGara(self, gara):
         Gara.setActiveInstance(gara)
@@ -457,7 +370,7 @@ class GaraMainWindow (QMainWindow):
         # gara is on a different thread but for Qt is the same
         gara.vote_updated.connect(self.voteUpdated, Qt.QueuedConnection)
         gara.vote_deleted.connect(self.voteDeleted, Qt.QueuedConnection)
-        print("UI connection:", self.connection)
+        log.debug("UI connection: %s", self.connection)
         self.updateUI()
         self.prepareModel()
         configuration = gara.getConfiguration(self.connection)
@@ -466,17 +379,16 @@ class GaraMainWindow (QMainWindow):
             self.ui.tabWidget.setCurrentIndex(self.ui.tabWidget.count()-1)
 
     @pyqtSlot(int, int, int, float)
+    @skipLockTimeout
     def voteUpdated(self, trial, user, judge, vote):
-        print("Vote received by UI:", trial, user, judge, vote)
-        table = self.tables[trial]
-        configuration = Gara.activeInstance.getConfiguration(self.connection)
-        user_data = Gara.activeInstance.getUser(self.connection, user)
-        model = self.tables[trial].model()
-        completed = self.updateTableRow(table, trial, user, configuration, user_data)
+        log.debug("vote received by UI: %s %s %s %s", trial, user, judge, vote)
+        self.refreshUser(user)
+        completed = self.store.isComplete(trial, user)
         if completed and self.ui.autoShow.isChecked() and self.serialManager != None:
             self.sendTrialUserToDisplay(trial, user)
 
     @pyqtSlot()
+    @skipLockTimeout
     def updateUI(self):
         gara = Gara.activeInstance
         mainbuttons = [
@@ -497,6 +409,7 @@ class GaraMainWindow (QMainWindow):
         if gara is None:
             self.deselect()
             self.setWindowTitle(_translate("MainWindow", "Giudice v{} - non configurato".format(VERSION)))
+            from PyQt5.QtNetwork import QNetworkInterface
             addrs = QNetworkInterface.allAddresses()
             show = []
             for h in addrs:
@@ -560,12 +473,10 @@ class GaraMainWindow (QMainWindow):
                 stato += " | "
             self.statusLabel.setText(stato)
         except:
-            print("timeout")
+            log.warning("timeout")
 
-    def createTableAndModel(self, rows, cols, labels):
+    def createTable(self, model):
         tv = QTableView(self)
-        model = QStandardItemModel(rows, cols)
-        model.setHorizontalHeaderLabels(labels)
 
         font_size = QSettings().value("preference/font_size", 0)
 
@@ -576,6 +487,8 @@ class GaraMainWindow (QMainWindow):
 
         tv.setHorizontalHeader(hv)
 
+        # the view owns its model
+        model.setParent(tv)
         tv.setModel(model)
         tv.setSelectionBehavior(QAbstractItemView.SelectRows)
         tv.setSelectionMode(QAbstractItemView.SingleSelection)
@@ -587,14 +500,24 @@ class GaraMainWindow (QMainWindow):
 
         m = tv.selectionModel()
         m.currentRowChanged.connect(lambda a, b, table=tv: self.selection(a, b, table))
-        return (tv, model)
+        return tv
+
+    def updateRowsVisibility(self, table, rows=None):
+        model = table.model()
+        if rows is None:
+            rows = range(model.rowCount())
+        for row in rows:
+            table.setRowHidden(row, not model.isRowVisible(row))
+
+    def refreshUser(self, user):
+        # the models repaint their row, only its visibility is left
+        self.store.refreshUser(user)
+        for table in self.tables:
+            self.updateRowsVisibility(table, [user])
 
     def prepareModel(self):
         gara = Gara.activeInstance
         configuration = gara.getConfiguration(self.connection)
-
-        cols = configuration['nJudges'] + 2
-        rows = configuration['nUsers'] + 1
         trials = configuration['nTrials']
 
         def doLabels(trial):
@@ -606,33 +529,21 @@ class GaraMainWindow (QMainWindow):
             if trial != 0:
                 labels.append(_translate("MainWindow", "Media punteggi\nprove 1-{}\ncon crediti".format(trial+1)))
             return labels
-        tables = []
-        models = []
 
         font_size = QSettings().value("preference/font_size", 0)
+        # a single query for all the tables
+        self.store = ScoreStore(gara, self.connection, self.show_on_display)
 
         self.ui.tabWidget.clear()
+        for table in self.tables:
+            table.deleteLater()
+        tables = []
         for i in range(trials):
-            labels = doLabels(i)
-            tv, model = self.createTableAndModel(rows, cols, labels)
+            tv = self.createTable(TrialTableModel(self.store, i, doLabels(i), font_size))
+            self.updateRowsVisibility(tv)
             tables.append(tv)
-            models.append(model)
             self.ui.tabWidget.addTab(tv, _translate("MainWindow", "Prova {}".format(i+1)))
 
-        for y in range(0, rows+1):
-            user = gara.getUser(self.connection, y)
-            for trial in range(0, trials):
-                cols = models[trial].columnCount()
-                for x in range(0, cols):
-                    item = QStandardItem("")
-                    item.setEditable(False)
-                    item.setSelectable(True)
-                    g = item.font()
-                    g.setPointSize(g.pointSize() + font_size)
-                    item.setFont(g)
-                    models[trial].setItem(y, x, item)
-                self.updateTableRow(tables[trial], trial, y, configuration, user)
-
         self.tables = tables
         self.createTableViewFromResults()
         self.deselect()
@@ -641,7 +552,6 @@ class GaraMainWindow (QMainWindow):
         gara = Gara.activeInstance
         configuration = gara.getConfiguration(self.connection)
 
-        rows = configuration['nUsers'] + 1
         trials = configuration['nTrials']
 
         labels = [_translate("MainWindow", "Concorrente")]
@@ -650,90 +560,13 @@ class GaraMainWindow (QMainWindow):
         labels.append(_translate("MainWindow", "Media punteggi\nprove"))
         labels.append(_translate("MainWindow", "Media punteggi\nprove\ncon crediti"))
         labels.append(_translate("MainWindow", "Somma\npunteggi prove\ncon crediti"))
-        cols = len(labels)
-        tv, model = self.createTableAndModel(rows, cols, labels)
-        self.tables.append(tv)
         font_size = QSettings().value("preference/font_size", 0)
-        for y in range(0, rows+1):
-            for x in range(0, cols):
-                item = QStandardItem("")
-                item.setEditable(False)
-                item.setSelectable(True)
-                g = item.font()
-                g.setPointSize(g.pointSize() + font_size)
-                item.setFont(g)
-                model.setItem(y, x, item)
-            tv.hideRow(y)
+        tv = self.createTable(ResultsTableModel(self.store, labels, font_size))
+        self.updateRowsVisibility(tv)
+        self.tables.append(tv)
 
         self.ui.tabWidget.addTab(tv, _translate("MainWindow", "Risultati"))
 
-    def updateTableRow(self, table, trial, row, configuration, user):
-        mostra = False
-        model = table.model()
-        votes = user['trials'][trial]['votes']
-        cols = model.columnCount()
-        jn = configuration['nJudges']
-        red = False
-        font_size = QSettings().value("preference/font_size", 0)
-        for x in range(0, cols):
-            item = model.item(row, x)
-            b = QBrush(Qt.black)
-            item.setForeground(b)
-
-            # pettorina
-            if x == 0:
-                item.setText(str(row))
-            # votes
-            if x >= 1 and x <= jn:
-                if votes[x] is not None:
-                    mostra = True
-                    item.setText(_f(votes[x]))
-                else:
-                    red = True
-            # score
-            if x == jn+1:
-                score = user['trials'][trial]['score']
-                if score is not None:
-                    item.setText(_f(score))
-            # score bonus
-            elif x == jn+2:
-                score = user['trials'][trial]['score_bonus']
-                if score is not None:
-                    item.setText(_f(score))
-            # score bonus
-            elif x == jn+3:
-                score = user['trials'][trial]['average_bonus']
-                if score is not None:
-                    item.setText(_f(score))
-        for x in range(0, cols):
-            item = model.item(row, x)
-            green = self.isShowOnDisplay(trial, row)
-            if x == 0:
-                if red:
-                    b = QBrush(COLOR_ROW_INCOMPLETE)
-                    item.setForeground(b)
-                    g = item.font()
-                    g.setBold(True)
-                    item.setFont(g)
-                else:
-                    b = QBrush(Qt.black)
-                    item.setForeground(b)
-                    g = item.font()
-                    g.setBold(False)
-                    item.setFont(g)
-                continue
-
-            if green:
-                b = QBrush(COLOR_ROW_DISPLAY)
-            else:
-                b = QBrush(Qt.black)
-            item.setForeground(b)
-        if mostra:
-            table.showRow(row)
-        else:
-            table.hideRow(row)
-        return not red
-
     def selection(self, a, b, table):
         if a.row() == -1 or a.column() == -1:
             return
@@ -800,6 +633,7 @@ class GaraMainWindow (QMainWindow):
         self.ui.userSum.setText("")
 
     @pyqtSlot()
+    @showLockTimeout
     def retryTrial(self):
         if self.selected_user is None or self.selected_trial is None:
             return
@@ -825,13 +659,15 @@ class GaraMainWindow (QMainWindow):
 
 
     @pyqtSlot(int, int)
+    @skipLockTimeout
     def voteDeleted(self, trial, user):
         self.deselect()
-        self.prepareModel()
+        self.refreshUser(user)
         self.ui.tabWidget.setCurrentIndex(trial)
 
 
     @pyqtSlot()
+    @showLockTimeout
     def saveAs(self):
         if Gara.activeInstance is None:
             return
@@ -851,7 +687,7 @@ class GaraMainWindow (QMainWindow):
                 else:
                     QMessageBox.information(self, "", _translate("MainWindow", "Copia creata"), QMessageBox.Ok)
             else:
-                print("Same file")
+                log.debug("same file")
 
 
     @pyqtSlot()
@@ -889,8 +725,9 @@ class GaraMainWindow (QMainWindow):
 
     def warnAdvanceState(self):
         conf = Gara.activeInstance.getConfiguration(self.connection)
-        incomplete = Gara.activeInstance.countIncomplete(self.connection, conf['currentTrial'])
-        count = Gara.activeInstance.countDone(self.connection, conf['currentTrial'])
+        progress = Gara.activeInstance.getTrialProgress(self.connection, conf['currentTrial'])
+        incomplete = progress['incompleteUsers']
+        count = progress['done']
         diff = conf['nUsers'] - count
         ok = None
         test_incomplete = len(incomplete) > 0
@@ -921,6 +758,7 @@ class GaraMainWindow (QMainWindow):
         return True
 
     @pyqtSlot()
+    @showLockTimeout
     def nextTrial(self):
         cont = self.warnAdvanceState()
         if cont is False:
@@ -941,6 +779,7 @@ class GaraMainWindow (QMainWindow):
         self.deselect()
 
     @pyqtSlot()
+    @showLockTimeout
     def start(self):
         dlg = QMessageBox.information(self,
                                       _translate("MainWindow", "Attenzione"),
@@ -950,6 +789,7 @@ class GaraMainWindow (QMainWindow):
             Gara.activeInstance.setState(self.connection, State_Running)
 
     @pyqtSlot()
+    @showLockTimeout
     def end(self):
         dlg = QMessageBox.information(self,
                                       _translate("MainWindow", "Attenzione"),
@@ -975,29 +815,10 @@ class GaraMainWindow (QMainWindow):
         dlg.show()
 
     def fillTableWithResults(self, table):
-        model = table.model()
-        configuration = Gara.activeInstance.getConfiguration(self.connection)
-        rows = configuration['nUsers']
-        for row in range(0, rows+1):
-            user = Gara.activeInstance.getUser(self.connection, row)
-            results = user.get('results')
-            if results:
-                vals = []
-                vals.append(str(row))
-                for trial in range(0, configuration['nTrials']):
-                    score = user['trials'][trial]['score']
-                    vals.append(_f(score))
-                vals.append(_f(results['average']))
-                vals.append(_f(results['average_bonus']))
-                vals.append(_f(results['sum']))
-                cols = model.columnCount()
-                for x in range(0, cols):
-                    item = model.item(row, x)
-                    item.setText(vals[x])
-                table.showRow(row)
-            else:
-                table.hideRow(row)
+        table.model().setFilled()
+        self.updateRowsVisibility(table)
 
+    @showLockTimeout
     def configuraPettorine(self):
         configuration = Gara.activeInstance.getConfiguration(self.connection)
         if configuration['state'] != State_Completed:
@@ -1012,6 +833,7 @@ class GaraMainWindow (QMainWindow):
             dlg.show()
 
     @pyqtSlot()
+    @showLockTimeout
     def generaRapporto(self):
         gara = Gara.activeInstance
 
@@ -1063,6 +885,7 @@ class GaraMainWindow (QMainWindow):
             q = QSettings()
             v = q.value("serial/name", None)
             if v != None:
+                from serial import SerialManager
                 self.serialManager = SerialManager(self, v)
                 r = self.serialManager.connectTo()
                 if r == False:
@@ -1076,6 +899,7 @@ class GaraMainWindow (QMainWindow):
             self.serialDisconnected()
 
     @pyqtSlot()
+    @showLockTimeout
     def sendToDisplay(self):
         if self.serialManager == None:
             QMessageBox.critical(self, "Errore", _translate("MainWindow", "Il display non risulta collegato"), QMessageBox.Ok)
@@ -1105,16 +929,9 @@ class GaraMainWindow (QMainWindow):
         if self.serialManager != None:
             self.serialManager.writeMultipleStrings(lines)
         self.setShowOnDisplay(selected_trial, selected_user)
-        for t in [self.tables[selected_trial], self.tables[-1]]:
-            model = t.model()
-            cols = model.columnCount()
-            for x in range(1, cols+1):
-                item = model.item(selected_user, x)
-                if item is not None:
-                    b = QBrush(COLOR_ROW_DISPLAY)
-                    item.setForeground(b)
 
     @pyqtSlot()
+    @showLockTimeout
     def keyPressEvent(self, event):
         if event.modifiers() & Qt.AltModifier:
             q = QSettings()
@@ -1138,6 +955,7 @@ class GaraMainWindow (QMainWindow):
     def __init__(self):
         QMainWindow.__init__(self)
         self.tables = []
+        self.store = None
         self.show_on_display = {}
         self.ui = ui.Ui_MainWindow()
         self.ui.setupUi(self)
@@ -1193,9 +1011,20 @@ if __name__ == '__main__':
                 gara.setState(c, State_Configure)
         gara.saveAs(c, "livigno.esame")
         exit(-1)
+    # settings
+    setupSettings()
+    if QSettings().value("debug/lockStats", False, type=bool):
+        Gara.lock.enableStats()
+
+    args = parseArguments(sys.argv[1:])
+    startLogging(args)
+    options = serverOptions(args)
+    # a pooled connection for every http thread
+    Gara.poolSize = options['threads']
+
     gara = None
-    if len(sys.argv) == 2:
-        gara = Gara.fromFilename(sys.argv[1])
+    if args.filename:
+        gara = Gara.fromFilename(args.filename)
         Gara.setActiveInstance(gara)
         # gara.generateRapport(gara.getConnection())
         # resetToTrial(gara.getConnection(), 0)
@@ -1205,15 +1034,10 @@ if __name__ == '__main__':
         assert gara.connection, "connection not set"
 
     # webservice
-    controller = Controller()
+    controller = createController(options)
     tr = threading.Thread(target=controller.listen)
     tr.start()
 
-    # settings
-    QCoreApplication.setOrganizationName("Nicola Ferruzzi")
-    QCoreApplication.setOrganizationDomain("github.com/nferruzzi/giudice-server")
-    QCoreApplication.setApplicationName("Giudice " + VERSION)
-
     # main ui
     ui.qInitResources()
     app = QApplication(sys.argv)
@@ -1221,8 +1045,14 @@ if __name__ == '__main__':
     if gara:
         MainWindow.setGara(gara)
     MainWindow.show()
+    if os.environ.get('GIUDICE_STARTUP_BENCHMARK'):
+        # startup.py: quit at the first paint
+        QTimer.singleShot(0, lambda: (print("painted", flush=True), app.quit()))
     v = app.exec_()
 
     # shutdown
     controller.shutdown()
+    if Gara.lock.stats is not None:
+        log.info("lock stats\n%s", Gara.lock.dump())
+    stopLogging()
     sys.exit(v)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+GaraServer
+Copyright 2016 Nicola Ferruzzi <nicola.ferruzzi@gmail.com>
+License: GPLv3 (see LICENSE)
+"""
+import threading
+
+# seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def formatLabels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for k, v in zip(names, values):
+        v = str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append('{}="{}"'.format(k, v))
+    return '{' + ','.join(pairs) + '}'
+
+
+def formatValue(v):
+    if v == float('inf'):
+        return '+Inf'
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self.mutex = threading.Lock()
+
+    def inc(self, *labels, value=1):
+        with self.mutex:
+            self.values[labels] = self.values.get(labels, 0) + value
+
+    def get(self, *labels):
+        return self.values.get(labels, 0)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} counter'.format(self.name)]
+        with self.mutex:
+            values = sorted(self.values.items())
+        for labels, v in values:
+            lines.append('{}{} {}'.format(self.name, formatLabels(self.labels, labels), formatValue(v)))
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # labels -> [count for each bucket, sum, count]
+        self.values = {}
+        self.mutex = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self.mutex:
+            v = self.values.get(labels)
+            if v is None:
+                v = self.values[labels] = [[0]*len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    v[0][i] += 1
+                    break
+            v[1] += value
+            v[2] += 1
+
+    def count(self, *labels):
+        v = self.values.get(labels)
+        return 0 if v is None else v[2]
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} histogram'.format(self.name)]
+        with self.mutex:
+            values = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self.values.items())
+        names = self.labels + ('le',)
+        for labels, (buckets, total, count) in values:
+            cumulative = 0
+            for bound, n in zip(self.buckets, buckets):
+                cumulative += n
+                lines.append('{}_bucket{} {}'.format(self.name, formatLabels(names, labels + (formatValue(bound),)), cumulative))
+            lines.append('{}_bucket{} {}'.format(self.name, formatLabels(names, labels + ('+Inf',)), count))
+            lines.append('{}_sum{} {}'.format(self.name, formatLabels(self.labels, labels), formatValue(total)))
+            lines.append('{}_count{} {}'.format(self.name, formatLabels(self.labels, labels), count))
+        return lines
+
+
+class Gauge:
+    """Read at scrape time from collect() -> {labels: value}"""
+
+    def __init__(self, name, help, labels=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.collect = collect
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} gauge'.format(self.name)]
+        for labels, v in sorted(self.collect().items()):
+            lines.append('{}{} {}'.format(self.name, formatLabels(self.labels, labels), formatValue(v)))
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    'giudice_http_requests_total', 'HTTP requests by route and status.', ('route', 'method', 'status')))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    'giudice_http_request_seconds', 'HTTP request latency.', ('route',)))
+VOTES = REGISTRY.register(Counter(
+    'giudice_votes_total', 'Votes received: accepted, or rejected with their error code.', ('result', 'code')))
+KEEPALIVES = REGISTRY.register(Counter(
+    'giudice_keepalive_total', 'keepAlive polls by judge.', ('judge',)))
+DB_QUERY = REGISTRY.register(Histogram(
+    'giudice_db_query_seconds', 'Duration of every SQLite statement.'))
+LOCK_WAIT = REGISTRY.register(Histogram(
+    'giudice_lock_wait_seconds', 'Time spent waiting for Gara.lock.', ('mode',)))
@@ -8,6 +8,7 @@ License: GPLv3 (see LICENSE)
 from openpyxl import Workbook
 from openpyxl.styles import Font, Fill, Alignment
 from openpyxl.styles import PatternFill, Border, Side, Protection
+from gara import emptyUserInfo
 
 def baseGen():
     return [
@@ -16,7 +17,7 @@ def baseGen():
     ]
 
 
-def dumpRows(gara, connection, worksheet, generator, conf, resuls_required=True, trial_required=None):
+def dumpRows(gara, connection, worksheet, generator, conf, resuls_required=True, trial_required=None, users=None, infos=None):
     alignment = Alignment(horizontal='center',
                           vertical='bottom',
                           wrap_text=True)
@@ -42,9 +43,11 @@ def dumpRows(gara, connection, worksheet, generator, conf, resuls_required=True,
         c.border = thin_border
 
     row += 1
-    users_with_a_vote = gara.getAllUsersWithAVote(connection)
-    for user in users_with_a_vote:
-        user_values = gara.getUser(connection, user)
+    if users is None:
+        users = gara.getAllUsers(connection, gara.getAllUsersWithAVote(connection))
+    if infos is None:
+        infos = gara.getAllUserInfo(connection)
+    for user, user_values in users.items():
         results = user_values.get('results')
         if resuls_required and results is None:
             continue
@@ -53,7 +56,9 @@ def dumpRows(gara, connection, worksheet, generator, conf, resuls_required=True,
             s = set(votes)
             if None in s and len(s) == 1:
                 continue
-        user_info = gara.getUserInfo(connection, user)
+        user_info = infos.get(user)
+        if user_info is None:
+            user_info = emptyUserInfo()
         for x, g in enumerate(generator):
             gen = g[1]
             val = gen(user, user_values, user_info)
@@ -106,6 +111,10 @@ def generateRapport(gara, connection, filename, include):
     conf = gara.getConfiguration(connection)
     workbook = Workbook()
 
+    # scored once and shared by every worksheet
+    users = gara.getAllUsers(connection, gara.getAllUsersWithAVote(connection))
+    infos = gara.getAllUserInfo(connection)
+
     generator = baseGen()
     for t in range(0, conf['nTrials']):
         v = ('Punteggio prova {}'.format(t+1), lambda n, user_values, user_info, trial=t: user_values['trials'][trial]['score_bonus'] or 0.0)
@@ -117,7 +126,7 @@ def generateRapport(gara, connection, filename, include):
 
     worksheet = workbook.active
     worksheet.title = 'Risultati'
-    dumpRows(gara, connection, worksheet, generator, conf)
+    dumpRows(gara, connection, worksheet, generator, conf, users=users, infos=infos)
 
     for t in range(conf['nTrials']):
         worksheet = workbook.create_sheet(title="Prova {}".format(t+1))
@@ -146,6 +155,6 @@ def generateRapport(gara, connection, filename, include):
             generator.append(('Media punteggi prove con crediti',
                              lambda n, user_values, user_info, trial=t: user_values['trials'][trial]['average_bonus'] or 0.0))
 
-        dumpRows(gara, connection, worksheet, generator, conf, False, trial_required=t)
+        dumpRows(gara, connection, worksheet, generator, conf, False, trial_required=t, users=users, infos=infos)
 
     workbook.save(filename)
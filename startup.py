@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+GaraServer
+Copyright 2016 Nicola Ferruzzi <nicola.ferruzzi@gmail.com>
+License: GPLv3 (see LICENSE)
+
+Startup benchmark: import time of the server modules and time to the first
+paint of the main window, each in a fresh interpreter.
+
+    python3 startup.py [--runs N] [--output results.jsonl]
+
+exits with 1 when a measure is over its budget.
+"""
+import argparse
+import datetime
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import time
+
+HERE = pathlib.Path(__file__).resolve().parent
+
+# seconds, best of the runs
+BUDGETS = {
+    'import gara': 0.4,
+    'import webserver': 0.6,
+    'import giudice': 0.6,
+    'first paint': 2.0,
+}
+# optional subsystems, loaded on first use only
+LAZY_MODULES = ('numpy', 'openpyxl', 'rapport', 'serial', 'serialport', 'cheroot',
+                'PyQt5.QtPrintSupport', 'PyQt5.QtNetwork', 'PyQt5.QtSerialPort')
+
+IMPORT_SCRIPT = """
+import sys, time, json
+start = time.perf_counter()
+import {0}
+print(json.dumps({{'seconds': time.perf_counter() - start, 'modules': sorted(sys.modules)}}))
+"""
+
+
+def environment():
+    env = dict(os.environ)
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    return env
+
+
+def importTime(module):
+    """(seconds, loaded modules) of `import module` in a new interpreter"""
+    output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT.format(module)],
+                                     cwd=str(HERE), env=environment())
+    result = json.loads(output.decode().splitlines()[-1])
+    return result['seconds'], result['modules']
+
+
+def firstPaint(timeout=60.0):
+    """Seconds from the launch of main.py to its first paint"""
+    env = environment()
+    env['GIUDICE_STARTUP_BENCHMARK'] = '1'
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, 'main.py', '--port', '0'], cwd=str(HERE), env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        for line in process.stdout:
+            if line.strip() == b'painted':
+                return time.perf_counter() - start
+        raise RuntimeError("main.py exited before painting")
+    finally:
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def measure(runs=3, paint=True):
+    """{name: best seconds}, {module: lazy modules it loaded}"""
+    results = {}
+    eager = {}
+    for module in ('gara', 'webserver', 'giudice'):
+        best = None
+        for i in range(runs):
+            seconds, modules = importTime(module)
+            best = seconds if best is None else min(best, seconds)
+        results['import ' + module] = best
+        eager[module] = [m for m in LAZY_MODULES if m in modules]
+    if paint:
+        results['first paint'] = min(firstPaint() for i in range(runs))
+    return results, eager
+
+
+def overBudget(results, factor=1.0):
+    return {name: seconds for name, seconds in results.items()
+            if seconds > BUDGETS[name] * factor}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='startup')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--no-paint', dest='paint', action='store_false',
+                        help="imports only, no main window")
+    parser.add_argument('--factor', type=float, default=1.0, help="budgets multiplier for slow machines")
+    parser.add_argument('--output', help="append the results as a JSON line")
+    args = parser.parse_args(argv)
+
+    results, eager = measure(args.runs, args.paint)
+    for name, seconds in sorted(results.items()):
+        print("{:<20} {:7.3f}s  (budget {:.3f}s)".format(name, seconds, BUDGETS[name] * args.factor))
+    if args.output:
+        with open(args.output, 'a') as f:
+            entry = {'time': datetime.datetime.now().isoformat(timespec='seconds'), 'results': results}
+            f.write(json.dumps(entry) + '\n')
+
+    failed = False
+    for module, modules in sorted(eager.items()):
+        if modules:
+            print("import {} loads {}".format(module, ', '.join(modules)))
+            failed = True
+    for name, seconds in sorted(overBudget(results, args.factor).items()):
+        print("{} over budget".format(name))
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+GaraServer
+Copyright 2016 Nicola Ferruzzi <nicola.ferruzzi@gmail.com>
+License: GPLv3 (see LICENSE)
+"""
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, QObject, Qt, QVariant, pyqtSignal
+from PyQt5.QtGui import QBrush, QColor, QFont
+
+COLOR_ROW_INCOMPLETE = QColor(255, 0, 0)
+COLOR_ROW_DISPLAY = QColor(0, 200, 0)
+
+
+def formatScore(val):
+    if val is None:
+        return ""
+    return "{:0.02f}".format(val)
+
+
+class ScoreStore(QObject):
+    """getUser of every athlete, loaded with a single query and shared by
+    the tables of the main window. refreshUser reloads one athlete and
+    tells the models which row changed.
+    """
+    # user
+    userChanged = pyqtSignal(int)
+
+    def __init__(self, gara, connection, displayed=None, parent=None):
+        super().__init__(parent)
+        self.gara = gara
+        self.connection = connection
+        # {trial: {user: True}} already sent to the display
+        self.displayed = displayed if displayed is not None else {}
+        self.configuration = gara.getConfiguration(connection)
+        self.rows = self.configuration['nUsers'] + 1
+        self.users = gara.getAllUsers(connection, range(0, self.rows))
+
+    def user(self, row):
+        return self.users[row]
+
+    def trial(self, row, trial):
+        return self.users[row]['trials'][trial]
+
+    def refreshUser(self, user):
+        if not 0 <= user < self.rows:
+            return
+        self.users[user] = self.gara.getUser(self.connection, user)
+        self.userChanged.emit(user)
+
+    def isComplete(self, trial, user):
+        return None not in self.trial(user, trial)['votes'].values()
+
+    def hasVotes(self, trial, user):
+        return any(v is not None for v in self.trial(user, trial)['votes'].values())
+
+    def setDisplayed(self, trial, user):
+        self.displayed.setdefault(trial, {})[user] = True
+        self.userChanged.emit(user)
+
+    def isDisplayed(self, trial, user):
+        return self.displayed.get(trial, {}).get(user, False)
+
+
+class ScoreTableModel(QAbstractTableModel):
+    """Read only table of the athletes of a ScoreStore, a row per athlete:
+    cells are computed when the view asks for them and only the rows of a
+    changed athlete are repainted."""
+
+    def __init__(self, store, labels, fontSize=0, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.labels = labels
+        self.font = QFont()
+        self.font.setPointSize(self.font.pointSize() + fontSize)
+        self.boldFont = QFont(self.font)
+        self.boldFont.setBold(True)
+        store.userChanged.connect(self.rowChanged)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.store.rows
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.labels)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole and section < len(self.labels):
+            return self.labels[section]
+        return QVariant()
+
+    def flags(self, index):
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def rowChanged(self, row):
+        self.dataChanged.emit(self.index(row, 0), self.index(row, self.columnCount()-1))
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return QVariant()
+        if role == Qt.DisplayRole:
+            return self.text(index.row(), index.column())
+        if role == Qt.ForegroundRole:
+            return QBrush(self.color(index.row(), index.column()))
+        if role == Qt.FontRole:
+            return self.boldFont if self.bold(index.row(), index.column()) else self.font
+        return QVariant()
+
+    def text(self, row, column):
+        raise NotImplementedError
+
+    def color(self, row, column):
+        return QColor(Qt.black)
+
+    def bold(self, row, column):
+        return False
+
+    def isRowVisible(self, row):
+        return True
+
+
+class TrialTableModel(ScoreTableModel):
+    """athlete, a vote for each judge, score, score with credits and, after
+    the first trial, the progressive average"""
+
+    def __init__(self, store, trial, labels, fontSize=0, parent=None):
+        super().__init__(store, labels, fontSize, parent)
+        self.trial = trial
+        self.nJudges = store.configuration['nJudges']
+
+    def text(self, row, column):
+        if column == 0:
+            return str(row)
+        trial = self.store.trial(row, self.trial)
+        if column <= self.nJudges:
+            vote = trial['votes'].get(column)
+            return "" if vote is None else formatScore(vote)
+        key = {1: 'score', 2: 'score_bonus', 3: 'average_bonus'}.get(column - self.nJudges)
+        return formatScore(trial.get(key)) if key else ""
+
+    def color(self, row, column):
+        if column == 0:
+            if self.store.isComplete(self.trial, row):
+                return QColor(Qt.black)
+            return COLOR_ROW_INCOMPLETE
+        if self.store.isDisplayed(self.trial, row):
+            return COLOR_ROW_DISPLAY
+        return QColor(Qt.black)
+
+    def bold(self, row, column):
+        return column == 0 and not self.store.isComplete(self.trial, row)
+
+    def isRowVisible(self, row):
+        return self.store.hasVotes(self.trial, row)
+
+
+class ResultsTableModel(ScoreTableModel):
+    """athlete, score of each trial, averages and sum; empty until filled
+    at the end of the gara"""
+
+    def __init__(self, store, labels, fontSize=0, parent=None):
+        super().__init__(store, labels, fontSize, parent)
+        self.nTrials = store.configuration['nTrials']
+        self.filled = False
+
+    def setFilled(self, filled=True):
+        self.beginResetModel()
+        self.filled = filled
+        self.endResetModel()
+
+    def text(self, row, column):
+        results = self.store.user(row).get('results')
+        if not self.filled or not results:
+            return ""
+        if column == 0:
+            return str(row)
+        if column <= self.nTrials:
+            return formatScore(self.store.trial(row, column-1)['score'])
+        key = {1: 'average', 2: 'average_bonus', 3: 'sum'}.get(column - self.nTrials)
+        return formatScore(results[key]) if key else ""
+
+    def color(self, row, column):
+        if column > 0 and any(self.store.isDisplayed(trial, row) for trial in range(self.nTrials)):
+            return COLOR_ROW_DISPLAY
+        return QColor(Qt.black)
+
+    def isRowVisible(self, row):
+        return self.filled and 'results' in self.store.user(row)
@@ -6,7 +6,16 @@ Copyright 2016 Nicola Ferruzzi <nicola.ferruzzi@gmail.com>
 License: GPLv3 (see LICENSE)
 """
 import unittest
+import io
+import json
+import threading
+import time
+import random
+import os
+import logging
+import logging.handlers
 from gara import *
+from logs import *
 
 
 class GaraBaseTest(unittest.TestCase):
@@ -40,6 +49,22 @@ class GaraBaseTest(unittest.TestCase):
                                     vote=vote)
         return v
 
+    def call(self, method, path, body=None, headers={}, remote='127.0.0.1'):
+        # the bottle app, no server in between
+        from webserver import webapp
+        data = b'' if body is None else json.dumps(body).encode()
+        environ = {
+            'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': '',
+            'SERVER_NAME': 'test', 'SERVER_PORT': '80', 'wsgi.url_scheme': 'http',
+            'REMOTE_ADDR': remote, 'wsgi.input': io.BytesIO(data), 'wsgi.errors': io.StringIO(),
+            'CONTENT_LENGTH': str(len(data)), 'CONTENT_TYPE': 'application/json',
+        }
+        for k, v in headers.items():
+            environ['HTTP_' + k.upper().replace('-', '_')] = v
+        status = []
+        payload = b''.join(webapp(environ, lambda s, h, e=None: status.append(int(s.split()[0]))))
+        return status[0], payload.decode()
+
     def setGara(self, *args, **kwargs):
         self.gara = Gara(*args, **kwargs)
         self.gara.createDB()
@@ -128,6 +153,41 @@ class BasicFunctionalityJudges(GaraBaseTest):
         code, _ = self.gara.registerJudgeWithUUID(self.connection, 0, "XXX")
         self.assertEqual(code, 404)
 
+    def test_register_fast_path(self):
+        self.assertEqual(self.gara.registerJudgeWithUUID(self.connection, 1, "abc")[0], 200)
+        self.gara.usersTIME["abc"] = 0
+
+        def unavailable(*args):
+            raise AssertionError("slow path")
+        getConfiguration = self.gara.getConfiguration
+        self.gara.getConfiguration = unavailable
+        # registered judge: no lock, no configuration
+        self.assertEqual(self.gara.registerJudgeWithUUID(self.connection, 1, "abc"), (200, {}))
+        self.assertTrue(self.gara.usersTIME["abc"] > 0)
+        # everything else still checks
+        for judge, uuid in ((2, "abc"), (1, "def"), (3, "abc")):
+            self.assertRaises(AssertionError, self.gara.registerJudgeWithUUID, self.connection, judge, uuid)
+        self.gara.getConfiguration = getConfiguration
+        # a config change drops the cached bound until it is reloaded
+        self.gara.setState(self.connection, State_Completed)
+        self.assertIsNone(self.gara._judgesBound)
+        self.assertEqual(self.gara.registerJudgeWithUUID(self.connection, 1, "abc"), (200, {}))
+        self.assertEqual(self.gara._judgesBound, 2)
+
+    def test_cached_state_version(self):
+        version = self.gara.cachedStateVersion(self.connection)
+        other = self.gara.getConnection()
+        setState(other, State_Completed)
+        other.close()
+        # another process: seen after STATE_RECHECK
+        self.assertEqual(self.gara.cachedStateVersion(self.connection), version)
+        self.gara._configChecked -= STATE_RECHECK
+        self.assertTrue(self.gara.cachedStateVersion(self.connection) > version)
+        # this process: at once
+        version = self.gara.cachedStateVersion(self.connection)
+        self.gara.sendMessage('pausa')
+        self.assertTrue(self.gara.cachedStateVersion(self.connection) > version)
+
 
 class BasicFunctionalityTrialsAdvance(GaraBaseTest):
 
@@ -526,5 +586,1234 @@ class BasicGaraConfigurationVote(GaraBaseTest):
         self.assertEqual(v[0], 403)
 
 
+class BasicSchemaUpgrade(GaraBaseTest):
+
+    V3 = """CREATE TABLE users (id INTEGER NOT NULL, user INTEGER NOT NULL, trial INTEGER,
+vote1 FLOAT, vote2 FLOAT, vote3 FLOAT, vote4 FLOAT, vote5 FLOAT, vote6 FLOAT, extra INTEGER, PRIMARY KEY (id));
+CREATE TABLE config (id INTEGER NOT NULL, description VARCHAR(250), date DATE, "nJudges" INTEGER,
+"nUsers" INTEGER, "nTrials" INTEGER, "currentTrial" INTEGER, "average" INTEGER, "state" INTEGER,
+"uuid" VARCHAR(250), "maxVote" FLOAT, PRIMARY KEY (id));
+CREATE TABLE credits (user INTEGER NOT NULL, trial1 FLOAT, trial2 FLOAT, trial3 FLOAT, trial4 FLOAT,
+trial5 FLOAT, trial6 FLOAT, trial7 FLOAT, trial8 FLOAT, trial9 FLOAT, trial10 FLOAT,
+nickname VARCHAR(250), PRIMARY KEY (user));
+INSERT INTO config VALUES (1, 'v3', '2018-04-27', 2, 10, 1, 0, 0, 1, 'uuid', 10.0);
+INSERT INTO credits (user, trial1, trial3, nickname) VALUES (2, 0.5, 1.5, 'due');
+PRAGMA user_version=3;
+"""
+
+    def createV3(self, rows):
+        self.gara = Gara()
+        connection = self.gara.getConnection()
+        connection.cursor().execute(self.V3)
+        for trial, user, vote1, vote2 in rows:
+            connection.cursor().execute('insert into users (trial, user, vote1, vote2) values (?, ?, ?, ?)',
+                                        (trial, user, vote1, vote2))
+        connection.close()
+        return Gara.fromFilename(self.gara.filename)
+
+    def tearDown(self):
+        self.connection = None
+        self.gara = None
+
+    def test_upgrade_from_3(self):
+        gara = self.createV3([(0, 1, 5.0, None), (0, 1, None, 7.0), (0, 2, 6.0, None)])
+        self.assertEqual(checkDBVersion(gara.connection), USER_DB_VERSION)
+        self.assertEqual(gara.getUser(gara.connection, 1)['trials'][0]['score'], 6.0)
+        p = gara.getTrialProgress(gara.connection, 0)
+        self.assertEqual((p['done'], p['received'], p['incompleteUsers']), (1, 2, [2]))
+        self.assertEqual(gara.getConfiguration(gara.connection)['durability'], Durability_Safe)
+        u = gara.getUser(gara.connection, 1)
+        self.assertEqual(u['trials'][0]['votes'], {1: 5.0, 2: 7.0})
+        info = gara.getUserInfo(gara.connection, 2)
+        self.assertEqual(info['nickname'], 'due')
+        self.assertEqual(info['credits'][0:4], [0.5, 0.0, 1.5, 0.0])
+        rows = list(gara.connection.cursor().execute('select count(*) from users'))
+        self.assertEqual(rows[0][0], 2)
+        self.assertTrue(addVote(gara.connection, trial=0, user=2, judge=2, vote=1.0))
+        self.assertFalse(addVote(gara.connection, trial=0, user=2, judge=2, vote=1.0))
+
+    def test_addvote_uses_index(self):
+        self.setGara(nJudges=2, nTrials=1, nUsers=10)
+        query = 'explain query plan select vote from votes where trial=? and user=? and judge=?'
+        plan = " ".join(str(v) for v in self.connection.cursor().execute(query, (0, 1, 1)))
+        self.assertIn('PRIMARY KEY', plan)
+        query = 'explain query plan ' + SCORES_QUERY + ' where u.user=? and u.trial<? order by u.trial'
+        plan = " ".join(str(v) for v in self.connection.cursor().execute(query, (1, 1)))
+        self.assertIn('votes_user', plan)
+        self.assertNotIn('SCAN', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class BasicConnectionPool(GaraBaseTest):
+
+    def setUp(self):
+        self.setGara(nJudges=1, nTrials=1, nUsers=1)
+
+    def tearDown(self):
+        self.gara.pool.reset()
+        self.connection = None
+        self.gara = None
+
+    def test_thread_affinity(self):
+        pool = self.gara.pool
+        with pool.connection() as a:
+            pass
+        with pool.connection() as b:
+            self.assertIs(a, b)
+            getConfig(b)
+        self.assertEqual(pool.stats()['idle'], 1)
+
+    def test_bounded(self):
+        pool = ConnectionPool(self.gara.getConnection, size=1, timeout=0.1)
+        a = pool.acquire()
+        result = []
+
+        def other():
+            try:
+                pool.acquire()
+            except TimeoutError:
+                result.append('timeout')
+
+        t = threading.Thread(target=other)
+        t.start()
+        t.join()
+        self.assertEqual(result, ['timeout'])
+        pool.release(a)
+        t = threading.Thread(target=lambda: result.append(pool.acquire()))
+        t.start()
+        t.join()
+        self.assertIs(result[-1], a)
+
+    def test_reset(self):
+        pool = self.gara.pool
+        a = pool.acquire()
+        pool.reset()
+        pool.release(a)
+        self.assertEqual(pool.stats(), {'size': pool.size, 'busy': 0, 'idle': 0})
+        with pool.connection() as b:
+            self.assertIsNot(a, b)
+
+
+class BasicDurability(GaraBaseTest):
+
+    def tearDown(self):
+        self.gara.close()
+        self.connection = None
+        self.gara = None
+
+    def pragma(self, connection, name):
+        for v, in connection.cursor().execute('PRAGMA {}'.format(name)):
+            return v
+
+    def test_profile_applied(self):
+        self.setGara(durability=Durability_Fast)
+        self.assertEqual(self.gara.getConfiguration(self.connection)['durability'], Durability_Fast)
+        self.assertEqual(self.pragma(self.connection, 'journal_mode'), 'wal')
+        with self.gara.pool.connection() as c:
+            self.assertEqual(self.pragma(c, 'synchronous'), 0)
+            self.assertEqual(self.pragma(c, 'wal_autocheckpoint'), WAL_AUTOCHECKPOINT)
+
+    def test_profile_stored(self):
+        self.setGara(durability=Durability_Safe)
+        gara = Gara.fromFilename(self.gara.filename)
+        with gara.pool.connection() as c:
+            self.assertEqual(self.pragma(c, 'synchronous'), 2)
+        gara = Gara.fromFilename(self.gara.filename)
+        gara.openDB(durability=Durability_Balanced)
+        with gara.pool.connection() as c:
+            self.assertEqual(self.pragma(c, 'synchronous'), 1)
+        gara.pool.reset()
+
+    def test_checkpoint_when_quiet(self):
+        self.setGara()
+        scheduler = CheckpointScheduler(self.gara.getConnection, interval=0.01, quiet=0.05)
+        self.assertFalse(scheduler.due(time.monotonic()))
+        scheduler.touch()
+        self.assertFalse(scheduler.due(time.monotonic()))
+        self.assertTrue(scheduler.due(time.monotonic() + 0.1))
+        self.gara.setState(self.connection, State_Running)
+        time.sleep(0.2)
+        self.assertIsNone(scheduler.lastWrite)
+        scheduler.stop()
+
+    def test_restart_after_failure(self):
+        self.setGara()
+        opened = []
+        def factory():
+            opened.append(1)
+            if len(opened) == 1:
+                raise apsw.CantOpenError("cannot open")
+            return self.gara.getConnection()
+        scheduler = CheckpointScheduler(factory, interval=0.01, quiet=0.02)
+        scheduler.touch()
+        time.sleep(0.1)
+        self.assertIsNone(scheduler.thread)
+        self.assertIsNotNone(scheduler.lastWrite)
+        scheduler.touch()
+        time.sleep(0.2)
+        self.assertIsNone(scheduler.lastWrite)
+        scheduler.stop()
+
+
+class BasicConfigurationCache(GaraBaseTest):
+
+    def setUp(self):
+        self.setGara(nJudges=1, nTrials=3, nUsers=1)
+
+    def tearDown(self):
+        self.gara.close()
+        self.connection = None
+        self.gara = None
+
+    def test_snapshot(self):
+        a = self.gara.getConfiguration(self.connection)
+        version = self.gara.configVersion
+        b = self.gara.getConfiguration(self.connection)
+        self.assertIs(a, b)
+        self.assertEqual(self.gara.configVersion, version)
+        with self.assertRaises(TypeError):
+            a['state'] = State_Running
+
+    def test_hit_without_query(self):
+        from unittest import mock
+        self.gara.setState(self.connection, State_Running)
+        self.registerUsers(1)
+        config = self.gara.getConfiguration(self.connection)
+        with mock.patch.object(self.gara, '_dataVersion', side_effect=AssertionError("queried")):
+            # votes of this process do not touch the configuration
+            self.addVote(judge=1, user=0, vote=5.0)
+            self.assertIs(self.gara.getConfiguration(self.connection), config)
+
+    def test_invalidated_by_writes(self):
+        self.gara.getConfiguration(self.connection)
+        version = self.gara.configVersion
+        self.gara.setState(self.connection, State_Running)
+        c = self.gara.getConfiguration(self.connection)
+        self.assertEqual(c['state'], State_Running)
+        self.assertEqual(self.gara.configVersion, version+1)
+        self.gara.advanceToNextTrial(self.connection)
+        self.assertEqual(self.gara.getConfiguration(self.connection)['currentTrial'], 1)
+        self.gara.setEnd(self.connection)
+        c = self.gara.getConfiguration(self.connection)
+        self.assertEqual(c['state'], State_Completed)
+        self.assertEqual(c['nTrials'], 2)
+
+    def test_external_change(self):
+        self.gara.getConfiguration(self.connection)
+        version = self.gara.configVersion
+        other = self.gara.getConnection()
+        setState(other, State_Running)
+        # another process: seen after STATE_RECHECK
+        self.assertEqual(self.gara.getConfiguration(self.connection)['state'], State_Configure)
+        self.gara._configChecked -= STATE_RECHECK
+        self.assertEqual(self.gara.getConfiguration(self.connection)['state'], State_Running)
+        self.assertEqual(self.gara.configVersion, version+1)
+        # a commit that does not touch config keeps the same version
+        addVote(other, 0, 1, 1, 5.0)
+        self.gara._configChecked -= STATE_RECHECK
+        self.gara.getConfiguration(self.connection)
+        self.assertEqual(self.gara.configVersion, version+1)
+        other.close()
+
+
+class BasicAllUsers(GaraBaseTest):
+
+    def setUp(self):
+        self.setGara(nJudges=3, nTrials=3, nUsers=5, average=Average_Mediata)
+        self.gara.setState(self.connection, State_Running)
+        self.registerUsers(3)
+
+    def tearDown(self):
+        self.gara.close()
+        self.connection = None
+        self.gara = None
+
+    def fill(self):
+        self.gara.updateUserInfo(self.connection, {2: {-1: 'test', 0: 0.5, 1: 1.5}})
+        for user in range(0, 5):
+            for judge in range(1, 4):
+                self.addVote(judge=judge, user=user, vote=user+judge*0.3)
+        self.gara.advanceToNextTrial(self.connection)
+        for judge in range(1, 3):
+            self.addVote(trial=1, judge=judge, user=2, vote=judge*1.1)
+        self.addVote(trial=1, judge=1, user=3, vote=2.0)
+
+    def test_same_as_getuser(self):
+        self.fill()
+        users = self.gara.getAllUsers(self.connection)
+        self.assertEqual(list(users), list(range(0, 6)))
+        for user, values in users.items():
+            self.assertEqual(values, self.gara.getUser(self.connection, user))
+
+    def test_constant_queries(self):
+        self.fill()
+        statements = []
+
+        def trace(cursor, sql, bindings):
+            statements.append(sql)
+            return True
+
+        self.gara.getConfiguration(self.connection)
+        self.connection.exec_trace = trace
+        self.gara.getAllUsers(self.connection)
+        self.connection.exec_trace = None
+        self.assertEqual(len(statements), 1)
+
+    def recompute(self):
+        conf = self.gara.getConfiguration(self.connection)
+        query = VOTES_QUERY + ' order by u.user, u.trial'
+        votes = groupVotes(conf['nJudges'], self.connection.cursor().execute(query))
+        credits = getAllUserInfo(self.connection)
+        default = emptyUserInfo()
+        return {u: scoreUser(conf, credits.get(u, default), votes.get(u, ())) for u in range(0, 6)}
+
+    def test_stored_scores(self):
+        self.fill()
+        self.assertEqual(self.gara.getAllUsers(self.connection), self.recompute())
+        self.gara.updateUserInfo(self.connection, {3: {0: 2.0}, 2: {1: 0.25}})
+        self.assertEqual(self.gara.getAllUsers(self.connection), self.recompute())
+        self.gara.deleteTrialVotesForUser(self.connection, 0, 2, {1})
+        self.assertEqual(self.gara.getAllUsers(self.connection), self.recompute())
+        self.gara.deleteTrialForUser(self.connection, 0, 3)
+        self.assertEqual(self.gara.getAllUsers(self.connection), self.recompute())
+        u = self.gara.getUser(self.connection, 3)
+        self.assertEqual(u['trials'][0]['score'], None)
+        self.assertNotIn('average', u['trials'][1])
+
+
+@unittest.skipIf(loadNumpy() is None, "numpy not available")
+class BasicScoringEngines(GaraBaseTest):
+
+    def randomCompetition(self, seed, nJudges, nTrials, average):
+        rnd = random.Random(seed)
+        conf = {'nJudges': nJudges, 'nTrials': nTrials, 'average': average}
+        votes = {}
+        credits = {}
+        users = range(0, 60)
+        for user in users:
+            if rnd.random() < 0.5:
+                credits[user] = {'nickname': '', 'credits': [rnd.random()*2 for x in range(0, MAX_TRIALS)]}
+            rows = []
+            for trial in range(0, nTrials):
+                if rnd.random() < 0.1:
+                    continue
+                vals = [None]*MAX_JUDGES
+                for j in range(0, nJudges):
+                    if rnd.random() < 0.85:
+                        vals[j] = rnd.random() * 10.0
+                rows.append((trial, ) + tuple(vals))
+            votes[user] = rows
+        return conf, credits, votes, users
+
+    def compare(self, nJudges, nTrials, average):
+        for seed in range(0, 20):
+            conf, credits, votes, users = self.randomCompetition(seed, nJudges, nTrials, average)
+            fast = scoreCompetitionNumpy(conf, credits, votes, users)
+            for user in users:
+                slow = scoreUser(conf, credits.get(user, emptyUserInfo()), votes[user])
+                self.assertEqual(fast[user], slow)
+
+    def test_aritmetica(self):
+        self.compare(6, 4, Average_Aritmetica)
+        self.compare(1, 1, Average_Aritmetica)
+
+    def test_mediata(self):
+        self.compare(6, 3, Average_Mediata)
+        self.compare(3, 10, Average_Mediata)
+
+
+class BasicTrialProgress(GaraBaseTest):
+
+    def setUp(self):
+        self.setGara(nJudges=3, nTrials=2, nUsers=10)
+        self.gara.setState(self.connection, State_Running)
+        self.registerUsers(3)
+
+    def tearDown(self):
+        self.gara.close()
+        self.connection = None
+        self.gara = None
+
+    def test_progress(self):
+        p = self.gara.getTrialProgress(self.connection, 0)
+        self.assertEqual(p, {'done': 0, 'received': 0, 'incomplete': 0, 'incompleteUsers': []})
+        for judge in range(1, 4):
+            self.addVote(judge=judge, user=1, vote=5.0)
+        self.addVote(judge=1, user=4, vote=5.0)
+        self.addVote(judge=2, user=2, vote=5.0)
+        p = self.gara.getTrialProgress(self.connection, 0)
+        self.assertEqual(p, {'done': 1, 'received': 3, 'incomplete': 2, 'incompleteUsers': [2, 4]})
+        self.assertEqual(self.gara.countDone(self.connection, 0), 1)
+        self.assertEqual(self.gara.countIncomplete(self.connection, 0), [2, 4])
+        self.gara.deleteTrialVotesForUser(self.connection, 0, 1, {2})
+        self.gara.deleteTrialForUser(self.connection, 0, 4)
+        self.gara.deleteTrialVotesForUser(self.connection, 0, 2, {2})
+        p = self.gara.getTrialProgress(self.connection, 0)
+        self.assertEqual(p, {'done': 0, 'received': 1, 'incomplete': 1, 'incompleteUsers': [1]})
+        self.assertFalse(self.gara.canCreditBeEdited(self.connection, 0))
+        self.assertTrue(self.gara.canCreditBeEdited(self.connection, 1))
+
+
+class BasicReadWriteLock(GaraBaseTest):
+
+    def setUp(self):
+        self.lock = ReadWriteLock(timeout=0.2)
+
+    def inThread(self, target):
+        res = []
+        def run():
+            try:
+                res.append(target())
+            except Exception as e:
+                res.append(e)
+        t = threading.Thread(target=run)
+        t.start()
+        t.join()
+        return res[0]
+
+    def tryRead(self):
+        with self.lock.read:
+            return True
+
+    def tryWrite(self):
+        with self.lock.write:
+            return True
+
+    def test_readers_share(self):
+        with self.lock.read:
+            self.assertTrue(self.inThread(self.tryRead))
+            self.assertIsInstance(self.inThread(self.tryWrite), LockTimeout)
+
+    def test_writer_excludes(self):
+        with self.lock.write:
+            self.assertIsInstance(self.inThread(self.tryRead), LockTimeout)
+            self.assertIsInstance(self.inThread(self.tryWrite), LockTimeout)
+        self.assertTrue(self.inThread(self.tryWrite))
+
+    def test_reentrant(self):
+        with self.lock.write:
+            with self.lock.read:
+                with self.lock.write:
+                    pass
+            self.assertIsInstance(self.inThread(self.tryRead), LockTimeout)
+        with self.lock.read:
+            with self.lock.read:
+                pass
+            # upgraded
+            with self.lock.write:
+                self.assertIsInstance(self.inThread(self.tryRead), LockTimeout)
+            self.assertTrue(self.inThread(self.tryRead))
+        self.assertTrue(self.inThread(self.tryWrite))
+
+    def test_upgrade_waits_for_readers(self):
+        entered, leave = threading.Event(), threading.Event()
+        def reader():
+            with self.lock.read:
+                entered.set()
+                leave.wait()
+        t = threading.Thread(target=reader)
+        t.start()
+        entered.wait()
+        with self.lock.read:
+            self.assertRaises(LockTimeout, self.tryWrite)
+            leave.set()
+            t.join()
+            self.assertTrue(self.tryWrite())
+
+    def test_waiting_writer_blocks_new_readers(self):
+        entered = threading.Event()
+        def writer():
+            with self.lock.write:
+                entered.set()
+        with self.lock.read:
+            t = threading.Thread(target=writer)
+            self.lock.timeout = 1.0
+            t.start()
+            time.sleep(0.1)
+            self.lock.timeout = 0.05
+            self.assertIsInstance(self.inThread(self.tryRead), LockTimeout)
+            # a reader already inside can go on
+            self.assertTrue(self.tryRead())
+        t.join()
+        self.assertTrue(entered.is_set())
+
+
+class BasicLockStats(GaraBaseTest):
+
+    def setUp(self):
+        self.lock = ReadWriteLock(timeout=0.05)
+
+    def test_disabled(self):
+        with self.lock.read:
+            pass
+        self.assertEqual(self.lock.statistics(), {})
+
+    def test_sites(self):
+        self.lock.enableStats()
+        for x in range(0, 3):
+            with self.lock.write:
+                with self.lock.read:
+                    time.sleep(0.01)
+        stats = self.lock.statistics()
+        writes = [v for (mode, site), v in stats.items() if mode == 'write']
+        reads = [v for (mode, site), v in stats.items() if mode == 'read']
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(len(reads), 1)
+        self.assertIn('test_sites', list(stats)[0][1])
+        self.assertEqual(writes[0]['count'], 3)
+        self.assertEqual(reads[0]['depthMax'], 1)
+        self.assertTrue(writes[0]['hold'] >= 0.03)
+        self.assertTrue(writes[0]['holdMax'] >= reads[0]['holdMax'])
+
+    def test_timeouts(self):
+        stats = self.lock.enableStats()
+        with self.lock.read:
+            t = threading.Thread(target=lambda: self.assertRaises(LockTimeout, self.lock.write.__enter__))
+            t.start()
+            t.join()
+        timeouts = sum(v['timeouts'] for v in stats.statistics().values())
+        self.assertEqual(timeouts, 1)
+        self.assertIn('timeouts', self.lock.dump())
+        self.lock.disableStats()
+        self.assertEqual(self.lock.dump(), "lock stats disabled")
+
+
+class BasicVoteWriter(GaraBaseTest):
+
+    def setUp(self):
+        self.setGara(nJudges=6, nTrials=2, nUsers=10)
+        self.gara.setState(self.connection, State_Running)
+        self.registerUsers(6)
+
+    def tearDown(self):
+        self.gara.close()
+        self.connection = None
+        self.gara = None
+
+    def burst(self, votes):
+        res = [None]*len(votes)
+        def run(i, judge, user, vote):
+            res[i] = self.addVoteRaw(judge, user, vote)
+        threads = [threading.Thread(target=run, args=(i,) + v) for i, v in enumerate(votes)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return res
+
+    def test_vote_holding_the_lock(self):
+        with self.gara.lock.write:
+            self.addVote(judge=1, user=1, vote=5.0)
+        with self.gara.lock.read:
+            self.addVote(judge=2, user=1, vote=5.0)
+        self.assertEqual(countReceived(self.connection, 0), 1)
+
+    def test_batches(self):
+        batches = []
+        def write(connection, votes):
+            batches.append(len(votes))
+            return [v * 2 for v in votes]
+        writer = VoteWriter(self.gara.getConnection, write, delay=0.05)
+        res = []
+        threads = [threading.Thread(target=lambda x=x: res.append(writer.submit(x))) for x in range(0, 10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        writer.stop()
+        self.assertEqual(sorted(res), [x * 2 for x in range(0, 10)])
+        self.assertEqual(sum(batches), 10)
+        self.assertTrue(len(batches) < 10, batches)
+
+    def test_duplicates(self):
+        votes = [(judge, user, 5.0) for judge in range(1, 7) for user in range(0, 3)]
+        res = self.burst(votes + [(1, 1, 6.0), (2, 1, 6.0)])
+        self.assertEqual([v[0] for v in res].count(200), len(votes))
+        self.assertEqual([v[1].get('code') for v in res].count(5), 2)
+        u = self.gara.getUser(self.connection, 1)
+        self.assertEqual(u['trials'][0]['votes'], dict.fromkeys(range(1, 7), 5.0))
+        self.assertEqual(self.gara.countDone(self.connection, 0), 3)
+
+    def test_trial_changed(self):
+        self.gara.advanceToNextTrial(self.connection)
+        res = self.gara._writeVotes(self.connection, [(0, 1, 1, 5.0), (1, 1, 1, 5.0)])
+        self.assertEqual(res, [(403, {'code': 1, 'error': 'Trial not accepted'}), (200, {})])
+
+    def test_submit_many(self):
+        batches = []
+        def write(connection, votes):
+            batches.append(list(votes))
+            return [v * 2 for v in votes]
+        writer = VoteWriter(self.gara.getConnection, write, delay=0.05, batchSize=2)
+        self.assertEqual(writer.submitMany([1, 2, 3]), [2, 4, 6])
+        self.assertEqual(writer.submitMany([]), [])
+        writer.stop()
+        self.assertEqual(batches, [[1, 2, 3]])
+
+    def test_batch(self):
+        from unittest import mock
+        self.gara.advanceToNextTrial(self.connection)
+        votes = [(1, 1, 5.0), (1, 2, 6.0), (0, 3, 5.0), (1, 11, 5.0), (1, 4, 1000.0), (1, 1, 7.0)]
+        with mock.patch.object(self.gara.votes, 'submitMany', wraps=self.gara.votes.submitMany) as submitMany:
+            res = self.gara.addRemoteVotes(self.connection, 2, '222', votes)
+        # the valid ones, through the vote writer
+        self.assertEqual(len(submitMany.call_args[0][0]), 3)
+        self.assertEqual([r[0] for r in res], [200, 200, 403, 403, 403, 403])
+        self.assertEqual([r[1].get('code') for r in res], [None, None, 1, 2, 3, 5])
+        res = self.gara.addRemoteVotes(self.connection, 2, '111', votes[0:1])
+        self.assertEqual(res[0][1]['code'], 4)
+        u = self.gara.getUser(self.connection, 1)
+        self.assertEqual(u['trials'][1]['votes'][2], 5.0)
+        self.assertEqual(self.gara.getTrialProgress(self.connection, 1)['incompleteUsers'], [1, 2])
+
+    def test_errors(self):
+        def write(connection, votes):
+            raise apsw.BusyError("busy")
+        writer = VoteWriter(self.gara.getConnection, write)
+        self.assertRaises(apsw.BusyError, writer.submit, 1)
+        writer.stop()
+
+    def test_open_failure(self):
+        opened = []
+        def factory():
+            opened.append(1)
+            if len(opened) == 1:
+                raise apsw.CantOpenError("cannot open")
+            return self.gara.getConnection()
+        writer = VoteWriter(factory, lambda connection, votes: votes)
+        self.assertRaises(apsw.CantOpenError, writer.submit, 1)
+        # a new thread for the next vote
+        self.assertEqual(writer.submit(2), 2)
+        writer.stop()
+
+    def test_timeout(self):
+        release = threading.Event()
+        def write(connection, votes):
+            release.wait()
+            return votes
+        writer = VoteWriter(self.gara.getConnection, write, timeout=0.1)
+        self.assertRaises(LockTimeout, writer.submit, 1)
+        release.set()
+        writer.stop()
+
+
+class BasicStateVersion(GaraBaseTest):
+
+    def setUp(self):
+        self.setGara(nJudges=1, nTrials=3, nUsers=10)
+        self.gara.registerJudgeWithUUID(self.connection, 1, '111')
+
+    def tearDown(self):
+        self.gara.close()
+        self.connection = None
+        self.gara = None
+
+    def test_version(self):
+        versions = [self.gara.getStateVersion(self.connection)]
+        self.assertEqual(self.gara.getStateVersion(self.connection), versions[-1])
+        self.gara.setState(self.connection, State_Running)
+        versions.append(self.gara.getStateVersion(self.connection))
+        self.addVote(judge=1, user=1, vote=5.0)
+        self.assertEqual(self.gara.getStateVersion(self.connection), versions[-1])
+        self.gara.advanceToNextTrial(self.connection)
+        versions.append(self.gara.getStateVersion(self.connection))
+        self.gara.sendMessage('pausa')
+        versions.append(self.gara.getStateVersion(self.connection))
+        self.gara.setEnd(self.connection)
+        versions.append(self.gara.getStateVersion(self.connection))
+        self.assertEqual(versions, sorted(set(versions)))
+
+    def test_wait(self):
+        version = self.gara.getStateVersion(self.connection)
+        start = time.monotonic()
+        self.assertEqual(self.gara.waitStateVersion(version, timeout=0.1), version)
+        self.assertTrue(time.monotonic() - start >= 0.1)
+        threading.Timer(0.05, lambda: self.gara.sendMessage('via')).start()
+        self.gara.states.poll = 5.0
+        start = time.monotonic()
+        self.assertTrue(self.gara.waitStateVersion(version, timeout=5.0, uuid='111') > version)
+        self.assertTrue(time.monotonic() - start < 1.0)
+        self.assertTrue(time.time() - self.gara.usersTIME['111'] < 1.0)
+        # an older cursor gets the state immediately
+        self.assertTrue(self.gara.waitStateVersion(version - 1, timeout=5.0) > version)
+
+    def test_shared_watcher(self):
+        version = self.gara.getStateVersion(self.connection)
+        results = []
+        waiters = [threading.Thread(target=lambda: results.append(self.gara.waitStateVersion(version, 5.0)))
+                   for i in range(5)]
+        for waiter in waiters:
+            waiter.start()
+        time.sleep(0.1)
+        self.assertEqual([t.name for t in threading.enumerate()].count('state watcher'), 1)
+        watcher = self.gara.states.thread
+        self.gara.sendMessage('via')
+        for waiter in waiters:
+            waiter.join(1.0)
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(v > version for v in results))
+        # the watcher stops with the last waiter
+        watcher.join(1.0)
+        self.assertIsNone(self.gara.states.thread)
+
+    def test_events_slots(self):
+        from unittest import mock
+        import webserver
+        Gara.setActiveInstance(self.gara)
+        slots = threading.BoundedSemaphore(1)
+        with mock.patch.object(webserver, 'eventsSlots', slots):
+            slots.acquire()
+            self.assertEqual(self.call('GET', '/events/1', headers={'X-User-Auth': '111'})[0], 503)
+            slots.release()
+            self.assertEqual(self.call('GET', '/events/1', headers={'X-User-Auth': '111'})[0], 200)
+            # the slot is given back
+            self.assertTrue(slots.acquire(blocking=False))
+
+    def test_external_change(self):
+        version = self.gara.getStateVersion(self.connection)
+        other = self.gara.getConnection()
+        setState(other, State_Running)
+        other.close()
+        self.gara._configChecked -= STATE_RECHECK
+        self.assertTrue(self.gara.getStateVersion(self.connection) > version)
+
+
+class BasicJudgeSessions(GaraBaseTest):
+
+    def setUp(self):
+        self.setGara(nJudges=2, nTrials=1, nUsers=10)
+        self.gara.setState(self.connection, State_Running)
+        self.registerUsers(2)
+
+    def tearDown(self):
+        self.gara.close()
+        self.connection = None
+        self.gara = None
+
+    def test_restart(self):
+        seen = self.gara.usersTIME['111']
+        self.gara.close()
+        self.gara = Gara.fromFilename(self.gara.filename)
+        self.connection = self.gara.connection
+        self.assertEqual(self.gara.usersUUID, {1: '111', 2: '222'})
+        self.assertEqual(self.gara.usersTIME['111'], seen)
+        # votes are accepted before any keepAlive
+        self.addVote(judge=1, user=1, vote=5.0)
+        self.assertEqual(self.gara.registerJudgeWithUUID(self.connection, 2, '333')[0], 403)
+
+    def test_expired(self):
+        self.gara.usersTIME['222'] -= SESSIONS_EXPIRE + 1
+        self.gara.close()
+        self.gara = Gara.fromFilename(self.gara.filename)
+        self.connection = self.gara.connection
+        self.assertEqual(self.gara.usersUUID, {1: '111'})
+        # while running a silent judge keeps its slot
+        self.gara.usersTIME['111'] -= SESSIONS_EXPIRE + 1
+        self.assertEqual(self.gara.registerJudgeWithUUID(self.connection, 1, '333')[0], 403)
+        self.assertEqual(self.gara.registerJudgeWithUUID(self.connection, 1, '111')[0], 200)
+
+    def test_registration_written(self):
+        self.gara.checkpoints.stop()
+        self.assertTrue(self.gara._flushSessions(self.connection))
+        # the token moves to judge 1, taken: judge 2 is unregistered anyway
+        self.assertEqual(self.gara.registerJudgeWithUUID(self.connection, 1, '222')[0], 403)
+        sessions = getJudgeSessions(self.connection)
+        self.assertEqual(set(sessions), {1, 2})
+        self.assertTrue(self.gara._flushSessions(self.connection))
+        sessions = getJudgeSessions(self.connection)
+        self.assertEqual({judge: uuid for judge, (uuid, seen) in sessions.items()}, {1: '111'})
+
+    def test_heartbeat_throttled(self):
+        self.gara.checkpoints.stop()
+        self.gara._flushSessions(self.connection, force=True)
+        saved = getJudgeSessions(self.connection)[1][1]
+        statements = []
+
+        def trace(cursor, sql, bindings):
+            statements.append(sql)
+            return True
+        self.connection.set_exec_trace(trace)
+        self.gara.registerJudgeWithUUID(self.connection, 1, '111')
+        self.connection.set_exec_trace(None)
+        # the keepAlive itself does not query
+        self.assertEqual(statements, [])
+        self.assertFalse(self.gara._flushSessions(self.connection))
+        self.assertEqual(getJudgeSessions(self.connection)[1][1], saved)
+        self.gara._sessionsSaved -= SESSIONS_SAVE_INTERVAL
+        self.assertTrue(self.gara._flushSessions(self.connection))
+        self.assertTrue(getJudgeSessions(self.connection)[1][1] > saved)
+
+    def test_flushed_by_checkpoints(self):
+        self.gara.checkpoints.stop()
+        self.gara.checkpoints = CheckpointScheduler(self.gara.getConnection, interval=0.05,
+                                                    task=self.gara._flushSessions)
+        self.gara.registerJudgeWithUUID(self.connection, 2, '333')
+        deadline = time.monotonic() + 2.0
+        while len(getJudgeSessions(self.connection)) < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(set(getJudgeSessions(self.connection)), {1, 2})
+
+
+class BasicRequestCache(GaraBaseTest):
+
+    def test_replay(self):
+        self.setGara(nJudges=1, nTrials=1, nUsers=10)
+        self.gara.setState(self.connection, State_Running)
+        self.registerUsers(1)
+        vote = lambda: self.addVoteRaw(judge=1, user=1, vote=5.0)
+        self.assertEqual(self.gara.idempotent('111', 'a', vote), (200, {}))
+        self.assertEqual(self.gara.idempotent('111', 'a', vote), (200, {}))
+        self.assertEqual(self.gara.idempotent('111', 'b', vote)[1]['code'], 5)
+        self.assertEqual(self.gara.idempotent('111', None, vote)[1]['code'], 5)
+        self.gara.close()
+
+    def test_expire(self):
+        cache = RequestCache(size=2, ttl=0.05)
+        calls = []
+        action = lambda: calls.append(1) or len(calls)
+        self.assertEqual(cache.run('a', action), 1)
+        self.assertEqual(cache.run('a', action), 1)
+        time.sleep(0.06)
+        self.assertEqual(cache.run('a', action), 2)
+        cache.ttl = 10.0
+        cache.run('b', action)
+        cache.run('c', action)
+        self.assertEqual(len(cache.entries), 2)
+        self.assertEqual(cache.run('a', action), 5)
+
+    def test_errors_not_cached(self):
+        cache = RequestCache()
+        def fail():
+            raise LockTimeout("busy")
+        self.assertRaises(LockTimeout, cache.run, 'a', fail)
+        self.assertEqual(cache.run('a', lambda: 1), 1)
+
+    def test_stalled_first_request(self):
+        cache = RequestCache(timeout=0.05)
+        started, release = threading.Event(), threading.Event()
+        def stalled():
+            started.set()
+            release.wait()
+            raise LockTimeout("busy")
+        t = threading.Thread(target=lambda: self.assertRaises(LockTimeout, cache.run, 'a', stalled))
+        t.start()
+        started.wait()
+        start = time.monotonic()
+        self.assertRaises(LockTimeout, cache.run, 'a', lambda: 1)
+        self.assertTrue(time.monotonic() - start < 1.0)
+        release.set()
+        t.join()
+        # the failed first request left nothing behind
+        self.assertNotIn('a', cache.entries)
+        self.assertEqual(cache.run('a', lambda: 2), 2)
+
+    def test_concurrent_retry(self):
+        cache = RequestCache()
+        calls = []
+        def slow():
+            calls.append(1)
+            time.sleep(0.05)
+            return len(calls)
+        res = []
+        threads = [threading.Thread(target=lambda: res.append(cache.run('a', slow))) for x in range(0, 4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(res, [1, 1, 1, 1])
+
+
+class BasicAsyncServer(GaraBaseTest):
+
+    def setUp(self):
+        from webserver import SERVER_PROFILES
+        from aioserver import AsyncController
+        self.setGara(nJudges=2, nTrials=2, nUsers=10)
+        Gara.setActiveInstance(self.gara)
+        self.gara.setState(self.connection, State_Running)
+        options = dict(SERVER_PROFILES['small'], port=0)
+        self.controller = AsyncController(options)
+        self.thread = threading.Thread(target=self.controller.listen)
+        self.thread.start()
+        self.controller.started.wait()
+
+    def tearDown(self):
+        self.controller.shutdown()
+        self.thread.join()
+        self.gara.close()
+        self.connection = None
+        self.gara = None
+
+    def request(self, method, path, body=None, headers={}):
+        import http.client
+        c = http.client.HTTPConnection('127.0.0.1', self.controller.port, timeout=10)
+        try:
+            c.request(method, path, body=None if body is None else json.dumps(body),
+                      headers=dict(headers, **{'Content-Type': 'application/json'}))
+            r = c.getresponse()
+            data = r.read()
+            return r.status, r.getheader('ETag'), json.loads(data) if data else None
+        finally:
+            c.close()
+
+    def raw(self, data):
+        import socket
+        with socket.create_connection(('127.0.0.1', self.controller.port), timeout=10) as s:
+            s.sendall(data)
+            s.shutdown(socket.SHUT_WR)
+            received = b''
+            while True:
+                chunk = s.recv(65536)
+                if not chunk:
+                    return received
+                received += chunk
+
+    def test_protocol_errors(self):
+        self.assertTrue(self.raw(b'GARBAGE\r\n\r\n').startswith(b'HTTP/1.1 400 '))
+        self.assertTrue(self.raw(b'GET /keepAlive/1 HTTP/1.1\r\nno colon\r\n\r\n').startswith(b'HTTP/1.1 400 '))
+        chunked = b'POST /vote HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nhello\r\n0\r\n\r\n'
+        answer = self.raw(chunked)
+        self.assertTrue(answer.startswith(b'HTTP/1.1 501 '))
+        # the body is not read as another request
+        self.assertEqual(answer.count(b'HTTP/1.1'), 1)
+
+    def test_head_and_continue(self):
+        answer = self.raw(b'HEAD /keepAlive/1 HTTP/1.1\r\nX-User-Auth: a\r\nConnection: close\r\n\r\n')
+        headers, _, body = answer.partition(b'\r\n\r\n')
+        self.assertTrue(headers.startswith(b'HTTP/1.1 200 '))
+        self.assertIn(b'Content-Length: ', headers)
+        self.assertEqual(body, b'')
+        vote = json.dumps({'trial': 0, 'judge': 1, 'user': 1, 'vote': 4.0}).encode()
+        request = 'POST /vote HTTP/1.1\r\nX-User-Auth: a\r\nContent-Type: application/json\r\n' \
+                  'Content-Length: {}\r\nExpect: 100-continue\r\nConnection: close\r\n\r\n'.format(len(vote))
+        answer = self.raw(request.encode() + vote)
+        self.assertTrue(answer.startswith(b'HTTP/1.1 100 Continue\r\n\r\nHTTP/1.1 200 '))
+
+    def test_keepalive_and_vote(self):
+        status, etag, body = self.request('GET', '/keepAlive/1', headers={'X-User-Auth': 'a'})
+        self.assertEqual((status, body['state']), (200, 'in corso'))
+        status, _, body = self.request('GET', '/keepAlive/1', headers={'X-User-Auth': 'a', 'If-None-Match': etag})
+        self.assertEqual(status, 304)
+        vote = {'trial': 0, 'judge': 1, 'user': 1, 'vote': 4.0}
+        self.assertEqual(self.request('POST', '/vote', vote, {'X-User-Auth': 'a'})[0], 200)
+        status, _, body = self.request('POST', '/vote', vote, {'X-User-Auth': 'a'})
+        self.assertEqual((status, body['code']), (403, 5))
+        self.assertEqual(self.request('GET', '/keepAlive/1')[0], 401)
+
+    def test_events(self):
+        status, _, body = self.request('GET', '/events/1?since=-1', headers={'X-User-Auth': 'a'})
+        self.assertEqual(status, 200)
+        cursor = body['cursor']
+        threading.Timer(0.1, lambda: self.gara.advanceToNextTrial(self.connection)).start()
+        start = time.monotonic()
+        status, _, body = self.request('GET', '/events/1?since={}'.format(cursor), headers={'X-User-Auth': 'a'})
+        self.assertTrue(time.monotonic() - start < 1.0)
+        self.assertEqual(body['current_trial'], 1)
+        self.assertTrue(body['cursor'] > cursor)
+        # the gara watcher does the polling, only while someone waits
+        watcher = self.gara.states.thread
+        if watcher is not None:
+            watcher.join(2.0)
+        self.assertIsNone(self.gara.states.thread)
+        self.assertEqual(self.gara.states.waiting, {})
+
+
+class BasicLogging(GaraBaseTest):
+
+    def setUp(self):
+        import tempfile
+        self.folder = tempfile.TemporaryDirectory()
+        self.setGara(nJudges=1, nTrials=1, nUsers=3)
+        self.gara.setState(self.connection, State_Running)
+        self.registerUsers(1)
+
+    def tearDown(self):
+        stopLogging()
+        log.setLevel(logging.NOTSET)
+        audit.setLevel(logging.NOTSET)
+        for handler in list(log.handlers):
+            if isinstance(handler, logging.handlers.QueueHandler):
+                log.removeHandler(handler)
+        self.gara.close()
+        self.folder.cleanup()
+
+    def lines(self, name):
+        import json
+        with open(os.path.join(self.folder.name, name)) as f:
+            return [json.loads(l) for l in f]
+
+    def test_disabled(self):
+        from unittest import mock
+        self.assertFalse(audit.isEnabledFor(logging.INFO))
+        self.assertFalse(log.isEnabledFor(logging.INFO))
+        self.addVote(judge=1, user=1, vote=5.0)
+        with mock.patch.object(audit, 'info') as info:
+            self.gara.deleteTrialVotesForUser(self.connection, 0, 1, {1})
+            self.gara.deleteTrialForUser(self.connection, 0, 1)
+        info.assert_not_called()
+
+    def test_audit(self):
+        setupLogging('WARNING', os.path.join(self.folder.name, 'log.jsonl'),
+                     os.path.join(self.folder.name, 'audit.jsonl'), console=False)
+        self.addVote(judge=1, user=1, vote=5.0)
+        self.addVoteRaw(judge=1, user=1, vote=6.0)
+        self.gara.deleteTrialVotesForUser(self.connection, 0, 1, {1})
+        log.info("not logged")
+        log.warning("logged")
+        stopLogging()
+        audit = self.lines('audit.jsonl')
+        self.assertEqual([a['message'] for a in audit], ['vote accepted', 'vote duplicate', 'votes deleted'])
+        self.assertEqual(audit[1]['data'], {'trial': 0, 'user': 1, 'judge': 1, 'vote': 6.0, 'status': 403, 'code': 5})
+        self.assertEqual([l['message'] for l in self.lines('log.jsonl')], ['logged'])
+
+
+class BasicMetrics(GaraBaseTest):
+
+    def setUp(self):
+        self.setGara(nJudges=2, nTrials=1, nUsers=3)
+        Gara.setActiveInstance(self.gara)
+        self.gara.setState(self.connection, State_Running)
+
+    def tearDown(self):
+        Gara.lock.observeWaits(None)
+        observeQueries(None)
+        self.gara.close()
+
+    def test_counters(self):
+        from metrics import HTTP_REQUESTS, VOTES, KEEPALIVES, HTTP_LATENCY, LOCK_WAIT, DB_QUERY
+        # the first scrape starts timing the lock and the statements
+        self.assertIsNone(Gara.lock.waits)
+        queries = DB_QUERY.count()
+        self.gara.getTrialProgress(self.connection, 0)
+        self.assertEqual(DB_QUERY.count(), queries)
+        self.assertEqual(self.call('GET', '/metrics')[0], 200)
+        waits = LOCK_WAIT.count('write')
+        queries = DB_QUERY.count()
+        requests = HTTP_REQUESTS.get('/keepAlive/<judge>', 'GET', 200)
+        latency = HTTP_LATENCY.count('/vote')
+        accepted = VOTES.get('accepted', '')
+        duplicates = VOTES.get('rejected', 5)
+        keepalives = KEEPALIVES.get(2)
+        self.assertEqual(self.call('GET', '/keepAlive/2', headers={'X-User-Auth': 'b'})[0], 200)
+        vote = {'trial': 0, 'judge': 2, 'user': 1, 'vote': 1.0}
+        self.assertEqual(self.call('POST', '/vote', vote, {'X-User-Auth': 'b'})[0], 200)
+        self.assertEqual(self.call('POST', '/vote', vote, {'X-User-Auth': 'b'})[0], 403)
+        self.assertEqual(HTTP_REQUESTS.get('/keepAlive/<judge>', 'GET', 200), requests + 1)
+        self.assertEqual(HTTP_LATENCY.count('/vote'), latency + 2)
+        self.assertEqual(VOTES.get('accepted', ''), accepted + 1)
+        self.assertEqual(VOTES.get('rejected', 5), duplicates + 1)
+        self.assertEqual(KEEPALIVES.get(2), keepalives + 1)
+        self.assertGreater(LOCK_WAIT.count('write'), waits)
+        self.assertGreater(DB_QUERY.count(), queries)
+        status, text = self.call('GET', '/metrics')
+        self.assertEqual(status, 200)
+        self.assertIn('giudice_http_requests_total{route="/vote",method="POST",status="403"}', text)
+        self.assertIn('giudice_votes_total{result="rejected",code="5"}', text)
+        self.assertIn('giudice_db_query_seconds_bucket{le="+Inf"}', text)
+        self.assertIn('giudice_lock_wait_seconds_count{mode="write"}', text)
+        self.assertIn('giudice_pool_connections{state="size"} 10', text)
+
+    def test_request_id_per_route(self):
+        headers = {'X-User-Auth': 'b', 'X-Request-Id': 'r1'}
+        vote = {'trial': 0, 'judge': 2, 'user': 1, 'vote': 1.0}
+        self.assertEqual(self.call('GET', '/keepAlive/2', headers={'X-User-Auth': 'b'})[0], 200)
+        self.assertEqual(self.call('POST', '/vote', vote, headers)[0], 200)
+        status, body = self.call('POST', '/votes', {'judge': 2, 'votes': [{'trial': 0, 'user': 2, 'vote': 1.0}]}, headers)
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)['results'], [{'status': 200}])
+
+    def test_histogram(self):
+        from metrics import Histogram
+        h = Histogram('h', 'test', ('route',), buckets=(0.1, 1.0))
+        for v in (0.05, 0.5, 0.5, 5.0):
+            h.observe(v, 'a')
+        self.assertEqual(h.render()[2:], [
+            'h_bucket{route="a",le="0.1"} 1',
+            'h_bucket{route="a",le="1.0"} 3',
+            'h_bucket{route="a",le="+Inf"} 4',
+            'h_sum{route="a"} 6.05',
+            'h_count{route="a"} 4',
+        ])
+
+
+class BasicServerOptions(unittest.TestCase):
+
+    def options(self, argv, settings={}, env={}):
+        from unittest import mock
+        import webserver
+        environ = {k: v for k, v in os.environ.items() if not k.startswith('GIUDICE_')}
+        environ.update(env)
+        with mock.patch.object(webserver, 'setting', lambda key, default=None: settings.get(key, default)), \
+                mock.patch.dict(os.environ, environ, clear=True):
+            return webserver.serverOptions(webserver.parseArguments(argv))
+
+    def test_precedence(self):
+        from webserver import SERVER_PROFILES
+        self.assertEqual(self.options([]), SERVER_PROFILES['small'])
+        self.assertEqual(self.options(['--profile', 'large']), SERVER_PROFILES['large'])
+        self.assertEqual(self.options([], {'server/profile': 'large'})['threads'], 32)
+        self.assertEqual(self.options([], env={'GIUDICE_PROFILE': 'large'})['threads'], 32)
+        # profile defaults < settings < environment < command line
+        settings = {'server/port': '8001', 'server/threads': '12'}
+        self.assertEqual(self.options([], settings)['port'], 8001)
+        env = {'GIUDICE_PORT': '8002'}
+        options = self.options([], settings, env)
+        self.assertEqual((options['port'], options['threads']), (8002, 12))
+        options = self.options(['--port', '8003', '--engine', 'asyncio'], settings, env)
+        self.assertEqual((options['port'], options['threads'], options['engine']), (8003, 12, 'asyncio'))
+
+    def test_types(self):
+        options = self.options([], {'server/timeout': '15', 'server/engine': 'asyncio'},
+                               {'GIUDICE_KEEPALIVE': '0', 'GIUDICE_QUEUE': '64'})
+        self.assertEqual(options['timeout'], 15)
+        self.assertEqual(options['keepAlive'], 0)
+        self.assertEqual(options['queue'], 64)
+        self.assertEqual(options['engine'], 'asyncio')
+        for k, v in options.items():
+            self.assertIsInstance(v, type(self.options([])[k]), k)
+
+
+class BasicAdmin(GaraBaseTest):
+
+    def setUp(self):
+        self.setGara(nJudges=1, nTrials=2, nUsers=3)
+        Gara.setActiveInstance(self.gara)
+        self.registerUsers(1)
+
+    def tearDown(self):
+        self.gara.close()
+
+    def test_actions(self):
+        status, body = self.call('GET', '/admin/state')
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)['state'], 'non iniziato')
+        self.assertEqual(self.call('POST', '/admin/next')[0], 409)
+        self.assertEqual(self.call('POST', '/admin/start')[0], 200)
+        self.assertEqual(self.call('POST', '/admin/start')[0], 409)
+        self.addVote(judge=1, user=1, vote=5.0)
+        status, body = self.call('POST', '/admin/next')
+        body = json.loads(body)
+        self.assertEqual((status, body['current_trial'], body['incomplete']), (200, 1, []))
+        self.assertEqual(list(body['judges']), ['1'])
+        self.assertEqual(self.call('POST', '/admin/next')[0], 409)
+        status, body = self.call('POST', '/admin/end')
+        self.assertEqual((status, json.loads(body)['state']), (200, 'terminato'))
+        self.assertEqual(self.call('POST', '/admin/reset')[0], 404)
+
+    def test_local_only(self):
+        headers = {'X-Forwarded-For': '127.0.0.1'}
+        self.assertEqual(self.call('POST', '/admin/start', headers=headers, remote='10.0.0.2')[0], 403)
+        self.assertEqual(self.gara.getConfiguration(self.connection)['state'], State_Configure)
+
+
+class BasicSignal(unittest.TestCase):
+
+    def test_fallback(self):
+        class Emitter:
+            changed = Signal(int, name='changed')
+
+        a, b = Emitter(), Emitter()
+        received = []
+        a.changed.connect(received.append)
+        a.changed.emit(1)
+        b.changed.emit(2)
+        self.assertEqual(received, [1])
+        a.changed.disconnect(received.append)
+        a.changed.emit(3)
+        self.assertEqual(received, [1])
+
+
+class BasicTableModels(GaraBaseTest):
+
+    def setUp(self):
+        # no display needed
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        from PyQt5.QtGui import QGuiApplication
+        self.app = QGuiApplication.instance() or QGuiApplication(['test'])
+        self.setGara(nJudges=2, nTrials=2, nUsers=3)
+        self.gara.setState(self.connection, State_Running)
+        self.registerUsers(2)
+        self.addVote(judge=1, user=1, vote=5.0)
+
+    def tearDown(self):
+        self.gara.close()
+
+    def test_trial(self):
+        from PyQt5.QtCore import Qt
+        from tablemodels import ScoreStore, TrialTableModel, COLOR_ROW_INCOMPLETE, COLOR_ROW_DISPLAY
+        store = ScoreStore(self.gara, self.connection)
+        model = TrialTableModel(store, 0, ['a', 'g1', 'g2', 'p', 'pc'])
+        self.assertEqual((model.rowCount(), model.columnCount()), (4, 5))
+        self.assertEqual([model.data(model.index(1, x)) for x in range(5)], ['1', '5.00', '', '5.00', '5.00'])
+        self.assertEqual(model.data(model.index(1, 0), Qt.ForegroundRole).color(), COLOR_ROW_INCOMPLETE)
+        self.assertEqual([model.isRowVisible(row) for row in range(4)], [False, True, False, False])
+
+        changed = []
+        model.dataChanged.connect(lambda a, b: changed.append((a.row(), b.row(), a.column(), b.column())))
+        self.addVote(judge=2, user=1, vote=7.0)
+        store.refreshUser(1)
+        self.assertEqual(changed, [(1, 1, 0, 4)])
+        self.assertEqual([model.data(model.index(1, x)) for x in range(5)], ['1', '5.00', '7.00', '6.00', '6.00'])
+        self.assertTrue(store.isComplete(0, 1))
+        store.setDisplayed(0, 1)
+        self.assertEqual(model.data(model.index(1, 1), Qt.ForegroundRole).color(), COLOR_ROW_DISPLAY)
+
+    def test_results(self):
+        from tablemodels import ScoreStore, ResultsTableModel
+        for trial in range(2):
+            for judge in (1, 2):
+                self.addVote(judge=judge, user=2, vote=4.0 + trial, trial=trial)
+            if trial == 0:
+                self.gara.advanceToNextTrial(self.connection)
+        store = ScoreStore(self.gara, self.connection)
+        model = ResultsTableModel(store, ['a', 'p1', 'p2', 'm', 'mc', 's'])
+        self.assertFalse(model.isRowVisible(2))
+        model.setFilled()
+        self.assertEqual([model.isRowVisible(row) for row in range(4)], [False, False, True, False])
+        self.assertEqual([model.data(model.index(2, x)) for x in range(6)],
+                         ['2', '4.00', '5.00', '4.50', '4.50', '9.00'])
+
+
+class BasicStartup(unittest.TestCase):
+
+    def test_lazy_modules(self):
+        # the time budgets are checked by running startup.py
+        import startup
+        for module in ('gara', 'webserver', 'giudice'):
+            seconds, modules = startup.importTime(module)
+            self.assertEqual([m for m in startup.LAZY_MODULES if m in modules], [], module)
+
+
+class BasicManyJudges(GaraBaseTest):
+
+    def setUp(self):
+        self.setGara(nJudges=MAX_JUDGES, nTrials=MAX_TRIALS, nUsers=3)
+        self.gara.setState(self.connection, State_Running)
+        self.registerUsers(MAX_JUDGES)
+
+    def tearDown(self):
+        self.gara.close()
+        self.connection = None
+        self.gara = None
+
+    def test_all_judges(self):
+        for judge in range(1, MAX_JUDGES+1):
+            self.addVote(judge=judge, user=1, vote=float(judge))
+        u = self.gara.getUser(self.connection, 1)
+        self.assertEqual(len(u['trials']), MAX_TRIALS)
+        self.assertEqual(u['trials'][0]['votes'], {j: float(j) for j in range(1, MAX_JUDGES+1)})
+        self.assertFEqual(u['trials'][0]['score'], (MAX_JUDGES+1)/2.0)
+        self.assertEqual(u['trials'][MAX_TRIALS-1]['votes'][MAX_JUDGES], None)
+        self.assertEqual(self.gara.countDone(self.connection, 0), 1)
+        self.gara.deleteTrialVotesForUser(self.connection, 0, 1, {MAX_JUDGES})
+        self.assertEqual(self.gara.countIncomplete(self.connection, 0), [1])
+
+    def test_last_trial_credits(self):
+        self.gara.updateUserInfo(self.connection, {2: {-1: 'last', MAX_TRIALS-1: 2.0}})
+        info = self.gara.getUserInfo(self.connection, 2)
+        self.assertEqual(info['nickname'], 'last')
+        self.assertEqual(info['credits'][MAX_TRIALS-1], 2.0)
+
+
 if __name__ == '__main__':
     unittest.main()
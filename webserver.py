@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+GaraServer
+Copyright 2016 Nicola Ferruzzi <nicola.ferruzzi@gmail.com>
+License: GPLv3 (see LICENSE)
+"""
+import os
+import time
+import threading
+import argparse
+import pathlib
+from gara import *
+from logs import log, setupLogging
+from metrics import REGISTRY, Gauge, HTTP_REQUESTS, HTTP_LATENCY, KEEPALIVES, LOCK_WAIT, DB_QUERY
+import bottle
+from bottle import Bottle, ServerAdapter, abort, request
+
+try:
+    from PyQt5.QtCore import QCoreApplication, QSettings, QStandardPaths
+except ImportError:
+    # headless without PyQt: command line and environment only
+    QSettings = None
+
+VERSION = '1.1.3'
+API_VERSION = '1.0'
+# seconds a judge waits on /events
+EVENTS_TIMEOUT = 25.0
+# share of the wsgi worker threads that /events waiters may hold, the
+# others keep serving votes and keepAlive
+EVENTS_SHARE = 0.5
+# free /events slots of the wsgi engine, None is unbounded
+eventsSlots = None
+
+webapp = Bottle()
+
+
+class RequestMetrics:
+    """Count and time every route, installed first so it sees the 503 of
+    getSqliteConnection too"""
+    name = 'metrics'
+    api = 2
+
+    def apply(self, callback, route):
+        rule = route.rule
+        method = route.method
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            status = 500
+            try:
+                body = callback(*args, **kwargs)
+                if isinstance(body, bottle.HTTPResponse):
+                    status = body.status_code
+                else:
+                    status = bottle.response.status_code
+                return body
+            except bottle.HTTPResponse as e:
+                status = e.status_code
+                raise
+            finally:
+                HTTP_REQUESTS.inc(rule, method, status)
+                HTTP_LATENCY.observe(time.perf_counter() - start, rule)
+
+        return wrapper
+
+webapp.install(RequestMetrics())
+
+
+def poolUsage():
+    gara = Gara.activeInstance
+    if gara is None:
+        return {}
+    stats = gara.pool.stats()
+    return {('busy',): stats['busy'], ('idle',): stats['idle'], ('size',): stats['size']}
+
+REGISTRY.register(Gauge('giudice_pool_connections', 'SQLite connection pool of the active gara.',
+                        ('state',), poolUsage))
+
+
+def getSqliteConnection(callback):
+    def wrapper(*args, **kwargs):
+        gara = Gara.activeInstance
+        if gara is None:
+            abort(500, {'error': 'server not configured'})
+
+        try:
+            connection = gara.pool.acquire()
+        except TimeoutError:
+            abort(503, {'error': 'server busy'})
+
+        kwargs['connection'] = connection
+        kwargs['gara'] = gara
+
+        try:
+            body = callback(*args, **kwargs)
+            return body
+        except LockTimeout:
+            abort(503, {'error': 'server busy'})
+        finally:
+            gara.pool.release(connection)
+
+    return wrapper
+
+webapp.install(getSqliteConnection)
+
+
+class MyWSGIRefServer(ServerAdapter):
+    server = None
+
+    def run(self, handler):
+        from wsgiref.simple_server import make_server, WSGIRequestHandler
+        if self.quiet:
+            class QuietHandler(WSGIRequestHandler):
+                def log_request(*args, **kw): pass
+            self.options['handler_class'] = QuietHandler
+        self.server = make_server(self.host, self.port, handler, **self.options)
+        self.server.serve_forever()
+
+    def stop(self):
+        # self.server.server_close() <--- alternative but causes bad
+        # fd exception
+        self.server.shutdown()
+
+
+@webapp.error(400)
+@webapp.error(401)
+@webapp.error(403)
+@webapp.error(404)
+@webapp.error(409)
+@webapp.error(503)
+def error404(error):
+    log.info("%s %s: %s %s", request.method, request.path, error.status_code, error.body)
+    return error.body
+
+
+@webapp.get('/keepAlive/<judge>')
+def keepAlive(judge, connection=None, gara=None):
+    judge = int(judge)
+
+    # configuration = Gara.activeInstance.getConfiguration(connection)
+    # if configuration['state'] == State_Configure:
+    #     abort(500, {'error': 'gara not configured yet'})
+
+    # taken before the state, a change in between is sent again next time
+    etag = '"{}-{}"'.format(gara.stateTag, gara.cachedStateVersion(connection))
+
+    ua = request.headers.get('X-User-Auth')
+    if ua is None:
+        abort(401, {'error': 'no token'})
+
+    code, err = gara.registerJudgeWithUUID(connection, judge, ua)
+    if code != 200:
+        abort(code, err)
+    KEEPALIVES.inc(judge)
+
+    if request.headers.get('If-None-Match') == etag:
+        return bottle.HTTPResponse(status=304, headers={'ETag': etag})
+
+    response = gara.getState(connection)
+    response['version'] = API_VERSION
+    bottle.response.set_header('ETag', etag)
+    return response
+
+
+@webapp.get('/events/<judge>', skip=[getSqliteConnection])
+def events(judge):
+    """Long poll: answers as soon as the state version is past `since`, or
+    after EVENTS_TIMEOUT seconds with the same state."""
+    gara = Gara.activeInstance
+    if gara is None:
+        abort(500, {'error': 'server not configured'})
+
+    judge = int(judge)
+    since = int(request.query.get('since', -1))
+
+    ua = request.headers.get('X-User-Auth')
+    if ua is None:
+        abort(401, {'error': 'no token'})
+
+    # a waiter holds a worker thread but no connection
+    slots = eventsSlots
+    if slots is not None and not slots.acquire(blocking=False):
+        abort(503, {'error': 'server busy'})
+    try:
+        with gara.pool.connection() as connection:
+            code, err = gara.registerJudgeWithUUID(connection, judge, ua)
+        if code != 200:
+            abort(code, err)
+        version = gara.waitStateVersion(since, EVENTS_TIMEOUT, uuid=ua)
+        with gara.pool.connection() as connection:
+            response = gara.getState(connection)
+    except TimeoutError:
+        abort(503, {'error': 'server busy'})
+    finally:
+        if slots is not None:
+            slots.release()
+
+    response['version'] = API_VERSION
+    response['cursor'] = version
+    return response
+
+
+@webapp.get('/metrics', skip=[getSqliteConnection])
+def metrics():
+    # lock waits and statements are timed from the first scrape on,
+    # unmonitored servers skip the clock
+    Gara.lock.observeWaits(LOCK_WAIT)
+    observeQueries(DB_QUERY)
+    bottle.response.content_type = 'text/plain; version=0.0.4'
+    return REGISTRY.render()
+
+
+@webapp.get('/debug/locks', skip=[getSqliteConnection])
+def debugLocks():
+    if Gara.lock.stats is None:
+        abort(404, {'error': 'lock stats disabled'})
+    bottle.response.content_type = 'text/plain'
+    return Gara.lock.dump()
+
+
+@webapp.post("/vote")
+def vote(connection, gara):
+    uuid = request.headers.get('X-User-Auth')
+    if uuid is None:
+        abort(401, {'error': 'no token'})
+
+    configuration = Gara.activeInstance.getConfiguration(connection)
+
+    if configuration['state'] != State_Running:
+        abort(404, {'error': 'gara not running'})
+
+    trial = int(request.json['trial'])
+    judge = int(request.json['judge'])
+    user = int(request.json['user'])
+    vote = float(request.json['vote'])
+
+    # a retry with the same X-Request-Id gets the first answer
+    requestId = request.headers.get('X-Request-Id')
+    code, body = gara.idempotent(uuid, requestId,
+                                 lambda: gara.addRemoteVote(connection, trial, user, judge, uuid, vote),
+                                 request.path)
+    if code != 200:
+        abort(code, body)
+
+    return body
+
+
+@webapp.post("/votes")
+def votes(connection, gara):
+    """{judge, votes: [{trial, user, vote}, ..]} -> {results: [{status, code, error}, ..]}
+    in the same order, code and error as in /vote."""
+    uuid = request.headers.get('X-User-Auth')
+    if uuid is None:
+        abort(401, {'error': 'no token'})
+
+    configuration = Gara.activeInstance.getConfiguration(connection)
+
+    if configuration['state'] != State_Running:
+        abort(404, {'error': 'gara not running'})
+
+    try:
+        judge = int(request.json['judge'])
+        votes = [(int(v['trial']), int(v['user']), float(v['vote'])) for v in request.json['votes']]
+    except (KeyError, TypeError, ValueError):
+        abort(400, {'error': 'malformed votes'})
+
+    requestId = request.headers.get('X-Request-Id')
+    results = []
+    for code, body in gara.idempotent(uuid, requestId,
+                                      lambda: gara.addRemoteVotes(connection, judge, uuid, votes),
+                                      request.path):
+        result = {'status': code}
+        result.update(body)
+        results.append(result)
+    return {'results': results}
+
+
+# /admin is served only to the local machine
+ADMIN_HOSTS = ('127.0.0.1', '::1')
+ADMIN_ACTIONS = ('start', 'next', 'end')
+
+
+def adminStatus(connection, gara):
+    response = gara.getState(connection)
+    configuration = gara.getConfiguration(connection)
+    response['incomplete'] = gara.countIncomplete(connection, configuration['currentTrial'])
+    now = time.time()
+    response['judges'] = {judge: round(now - gara.usersTIME.get(uuid, 0.0), 1)
+                          for judge, uuid in sorted(gara.usersUUID.items())}
+    return response
+
+
+def adminOnly():
+    # not remote_addr, X-Forwarded-For is up to the client
+    if request.environ.get('REMOTE_ADDR') not in ADMIN_HOSTS:
+        abort(403, {'error': 'admin is local only'})
+
+
+@webapp.get('/admin/state')
+def adminState(connection, gara):
+    """State, athletes without every vote in the current trial and seconds
+    since each judge was last seen"""
+    adminOnly()
+    return adminStatus(connection, gara)
+
+
+@webapp.post('/admin/<action>')
+def admin(action, connection, gara):
+    """start, next (trial) and end, as the buttons of the main window"""
+    adminOnly()
+    if action not in ADMIN_ACTIONS:
+        abort(404, {'error': 'unknown action'})
+    state = gara.getConfiguration(connection)['state']
+    if action == 'start':
+        if state != State_Configure:
+            abort(409, {'error': 'gara already started'})
+        gara.setState(connection, State_Running)
+    elif state != State_Running:
+        abort(409, {'error': 'gara not running'})
+    elif action == 'next':
+        ok, trial = gara.advanceToNextTrial(connection)
+        if not ok:
+            abort(409, {'error': 'no more trials'})
+    else:
+        gara.setEnd(connection)
+    log.info("admin: %s", action)
+    return adminStatus(connection, gara)
+
+
+# http server defaults: small is a single panel of judges, large is many
+# panels plus scoreboard viewers
+SERVER_PROFILES = {
+    'small': {'engine': 'wsgi', 'port': 8000, 'threads': 10, 'queue': 16, 'timeout': 10, 'keepAlive': 10},
+    'large': {'engine': 'wsgi', 'port': 8000, 'threads': 32, 'queue': 128, 'timeout': 30, 'keepAlive': 200},
+}
+SERVER_ENGINES = ('wsgi', 'asyncio')
+
+
+def setupSettings():
+    """QSettings of the application, shared by main.py and giudice.py"""
+    if QSettings is not None:
+        QCoreApplication.setOrganizationName("Nicola Ferruzzi")
+        QCoreApplication.setOrganizationDomain("github.com/nferruzzi/giudice-server")
+        QCoreApplication.setApplicationName("Giudice " + VERSION)
+
+
+def setting(key, default=None):
+    if QSettings is None:
+        return default
+    return QSettings().value(key, default)
+
+
+def dataLocation():
+    if QSettings is None:
+        return pathlib.Path.home() / '.local' / 'share' / 'giudice'
+    return pathlib.Path(QStandardPaths.writableLocation(QStandardPaths.AppDataLocation))
+
+
+def serverOptions(args):
+    """Profile defaults, overridden by the server/* settings, then by the
+    GIUDICE_* environment, then by the command line."""
+    profile = args.profile or os.environ.get('GIUDICE_PROFILE') or setting("server/profile", 'small')
+    options = dict(SERVER_PROFILES.get(profile, SERVER_PROFILES['small']))
+    for k in options:
+        cast = type(options[k])
+        v = setting("server/" + k)
+        if v is not None:
+            options[k] = cast(v)
+        v = os.environ.get('GIUDICE_' + k.upper())
+        if v is not None:
+            options[k] = cast(v)
+        v = getattr(args, k)
+        if v is not None:
+            options[k] = v
+    return options
+
+
+def startLogging(args):
+    """Command line, then log/* settings. The audit trail of the votes is
+    kept in the application data folder unless told otherwise."""
+    level = args.logLevel or setting("log/level", 'INFO')
+    filename = args.logFile or setting("log/file")
+    auditFilename = args.auditFile or setting("log/audit")
+    if auditFilename is None:
+        where = dataLocation()
+        where.mkdir(parents=True, exist_ok=True)
+        auditFilename = str(where / 'audit.jsonl')
+    return setupLogging(level, filename, auditFilename)
+
+
+def addServerArguments(parser):
+    parser.add_argument('--profile', choices=sorted(SERVER_PROFILES))
+    parser.add_argument('--engine', choices=SERVER_ENGINES,
+                        help="wsgi: a thread for each request, asyncio: an event loop")
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--threads', type=int, help="http worker threads")
+    parser.add_argument('--queue', type=int, help="pending connections")
+    parser.add_argument('--timeout', type=int, help="socket timeout in seconds")
+    parser.add_argument('--keep-alive', dest='keepAlive', type=int,
+                        help="idle keep-alive connections, 0 disables keep-alive")
+    parser.add_argument('--log-level', dest='logLevel', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    parser.add_argument('--log-file', dest='logFile', help="JSON lines, rotated")
+    parser.add_argument('--audit-file', dest='auditFile', help="votes audit trail, JSON lines, rotated")
+
+
+def parseArguments(argv):
+    parser = argparse.ArgumentParser(prog='giudice')
+    parser.add_argument('filename', nargs='?', help="gara file to open")
+    addServerArguments(parser)
+    # the rest is for Qt
+    args, rest = parser.parse_known_args(argv)
+    return args
+
+
+class Controller (object):
+    def __init__(self, options=SERVER_PROFILES['small']):
+        self.options = options
+
+    def listen(self):
+        global eventsSlots
+        from cheroot.wsgi import Server as WSGIServer
+        options = self.options
+        eventsSlots = threading.BoundedSemaphore(max(1, int(options['threads'] * EVENTS_SHARE)))
+        log.info("listening: %s", options)
+        self.server = WSGIServer(('0.0.0.0', options['port']), webapp,
+                                 numthreads=options['threads'],
+                                 request_queue_size=options['queue'],
+                                 timeout=options['timeout'])
+        self.server.keep_alive_conn_limit = options['keepAlive']
+        self.server.start()
+
+    def shutdown(self):
+        self.server.stop()
+        log.info("done listening")
+
+
+def createController(options=SERVER_PROFILES['small']):
+    if options['engine'] == 'asyncio':
+        from aioserver import AsyncController
+        return AsyncController(options)
+    return Controller(options)